@@ -0,0 +1,239 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import re
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+from code_index import _bloom_positions, code_hash
+from write_behind import WriteBehindQueue
+
+# 每個分段由兩個檔案組成：
+#   audit-<序號>.jsonl.gz：每批寫入附加一個獨立的 gzip 成員，寫到一半的分段也能完整讀取
+#   audit-<序號>.idx：分段封存時寫入的索引（little-endian）：
+#     magic、事件數、第一筆與最後一筆事件時間、Bloom filter 位元數、雜湊函數數量，接著是 Bloom filter 位元組
+# Bloom filter 記錄分段中出現過的用戶 ID 與邀請碼，查詢時只需解壓可能包含結果的分段
+_MAGIC = b'TGAUDX01'
+_HEADER = struct.Struct('<8sQddQQ')
+_SEGMENT_RE = re.compile(r'^audit-(\d+)\.jsonl\.gz$')
+
+
+def _user_key(user_id) -> int:
+    return code_hash(f"u:{user_id}")
+
+
+def _code_key(code) -> int:
+    return code_hash(f"c:{code}")
+
+
+class _Segment:
+    __slots__ = ('number', 'path', 'index_path', 'count', 'first_ts', 'last_ts', 'bloom_bits', 'k', 'bloom')
+
+    def __init__(self, directory: str, number: int, bloom_bits: int, k: int):
+        self.number = number
+        self.path = os.path.join(directory, f"audit-{number:08d}.jsonl.gz")
+        self.index_path = os.path.join(directory, f"audit-{number:08d}.idx")
+        self.count = 0
+        self.first_ts = 0.0
+        self.last_ts = 0.0
+        self.bloom_bits = bloom_bits
+        self.k = k
+        self.bloom = bytearray(bloom_bits // 8)
+
+    def add(self, event: dict):
+        if not self.count:
+            self.first_ts = event['ts']
+        self.count += 1
+        self.last_ts = event['ts']
+        if event.get('user_id') is not None:
+            self._set(_user_key(event['user_id']))
+        if event.get('code') is not None:
+            self._set(_code_key(event['code']))
+
+    def _set(self, h: int):
+        for position in _bloom_positions(h, self.bloom_bits, self.k):
+            self.bloom[position >> 3] |= 1 << (position & 7)
+
+    def might_contain(self, h: int) -> bool:
+        return all(self.bloom[position >> 3] & (1 << (position & 7))
+                   for position in _bloom_positions(h, self.bloom_bits, self.k))
+
+    def write_index(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, self.count, self.first_ts, self.last_ts, self.bloom_bits, self.k))
+            f.write(self.bloom)
+        os.replace(tmp_path, self.index_path)
+
+    @classmethod
+    def load_index(cls, directory: str, number: int) -> '_Segment | None':
+        segment = cls(directory, number, 0, 0)
+        try:
+            with open(segment.index_path, 'rb') as f:
+                magic, count, first_ts, last_ts, bloom_bits, k = _HEADER.unpack(f.read(_HEADER.size))
+                bloom = bytearray(f.read())
+        except (OSError, struct.error):
+            return None
+        if magic != _MAGIC or len(bloom) != bloom_bits // 8:
+            return None
+        segment.count, segment.first_ts, segment.last_ts = count, first_ts, last_ts
+        segment.bloom_bits, segment.k, segment.bloom = bloom_bits, k, bloom
+        return segment
+
+    def read(self):
+        # 逐筆讀取事件；程序中斷時最後一個 gzip 成員可能不完整，讀到該處為止
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    if line.endswith('\n'):
+                        yield json.loads(line)
+        except (EOFError, gzip.BadGzipFile, zlib.error, json.JSONDecodeError) as e:
+            logging.warning(f"Audit segment {self.path} is truncated: {e}")
+
+
+class AuditLog:
+    # 結構化稽核紀錄：record() 只把事件放入記憶體佇列，不會阻塞事件循環；
+    # 背景任務定期把佇列中的事件在專用執行緒中批次壓縮寫入目前的分段，
+    # 分段滿 segment_events 筆後封存並寫入索引，只保留最近 max_segments 個分段
+
+    def __init__(self, directory: str, segment_events: int = 100000, max_segments: int = 100,
+                 flush_interval: float = 1.0, batch_size: int = 5000, max_queue: int = 100000,
+                 bits_per_key: int = 10, k: int = 7):
+        self.directory = directory
+        self.segment_events = segment_events
+        self.max_segments = max_segments
+        self.max_queue = max_queue
+        # 每筆事件最多兩個索引鍵（用戶 ID 與邀請碼）
+        self.bloom_bits = max(segment_events * 2 * bits_per_key, 64)
+        self.bloom_bits += -self.bloom_bits % 64
+        self.k = k
+
+        # 已封存的分段（由舊到新）與目前寫入中的分段
+        self.segments = deque()
+        self.active = None
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='audit-log')
+        self._events = WriteBehindQueue(
+            self._write_batch, self._executor, flush_interval, batch_size, f"audit log {directory}"
+        )
+
+        # 統計
+        self.written = 0
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        # 等待寫入的事件數
+        return len(self._events)
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._open)
+        self._events.start()
+        logging.info(f"Opened audit log {self.directory} with {len(self.segments) + 1} segments")
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        numbers = sorted(
+            int(match.group(1)) for name in os.listdir(self.directory) if (match := _SEGMENT_RE.match(name))
+        )
+
+        for number in numbers:
+            segment = _Segment.load_index(self.directory, number)
+            if segment is None:
+                # 沒有索引的分段是上次關閉時仍在寫入的分段（或索引已損毀），重新掃描建立索引
+                segment = _Segment(self.directory, number, self.bloom_bits, self.k)
+                for event in segment.read():
+                    segment.add(event)
+                segment.write_index()
+            self.segments.append(segment)
+
+        # 每次啟動都從新的分段開始寫入，避免附加在可能不完整的 gzip 成員之後
+        self.active = _Segment(self.directory, (numbers[-1] if numbers else 0) + 1, self.bloom_bits, self.k)
+        self._prune()
+
+    async def close(self):
+        # 關閉前寫入佇列中剩餘的事件並封存目前的分段
+        try:
+            await self._events.stop()
+        except Exception as e:
+            logging.error(f"Error writing audit log {self.directory}: {e}")
+        if self.active is not None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._executor, self._seal)
+            self.active = None
+        self._executor.shutdown(wait=True)
+
+    def record(self, event: str, user_id: int | None = None, code: str | None = None, **fields):
+        if len(self._events) >= self.max_queue:
+            self.dropped += 1
+            return
+        self._events.put({'ts': time(), 'event': event, 'user_id': user_id, 'code': code, **fields})
+
+    async def query(self, user_id: int | None = None, code: str | None = None, group_ids=None,
+                    limit: int = 20) -> list[dict]:
+        # 由新到舊回傳符合用戶 ID 或邀請碼的事件，只讀取索引顯示可能包含結果的分段；
+        # 指定 group_ids 時只回傳屬於這些群組的事件
+        await self._events.flush()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._query, user_id, code, group_ids, limit)
+
+    def _query(self, user_id, code, group_ids, limit: int) -> list[dict]:
+        keys = []
+        if user_id is not None:
+            keys.append(_user_key(user_id))
+        if code is not None:
+            keys.append(_code_key(code))
+
+        results = []
+        segments = [self.active, *reversed(self.segments)] if self.active is not None else reversed(self.segments)
+        for segment in segments:
+            if not segment.count or not any(segment.might_contain(h) for h in keys):
+                continue
+            matches = [
+                event for event in segment.read()
+                if ((user_id is not None and event.get('user_id') == user_id)
+                    or (code is not None and event.get('code') == code))
+                and (group_ids is None or event.get('group_id') in group_ids)
+            ]
+            results.extend(reversed(matches))
+            if len(results) >= limit:
+                break
+        return results[:limit]
+
+    # 背景批次寫入（由 WriteBehindQueue 在專用執行緒中呼叫）
+
+    def _write_batch(self, batch: list[dict]):
+        while batch:
+            room = self.segment_events - self.active.count
+            if room <= 0:
+                self._seal()
+                self.active = _Segment(self.directory, self.active.number + 1, self.bloom_bits, self.k)
+                self._prune()
+                continue
+
+            chunk, batch = batch[:room], batch[room:]
+            data = ''.join(json.dumps(event, ensure_ascii=False, separators=(',', ':')) + '\n' for event in chunk)
+            with open(self.active.path, 'ab') as f:
+                f.write(gzip.compress(data.encode(), compresslevel=6))
+            for event in chunk:
+                self.active.add(event)
+            self.written += len(chunk)
+
+    def _seal(self):
+        if self.active.count:
+            self.active.write_index()
+            self.segments.append(self.active)
+
+    def _prune(self):
+        while len(self.segments) >= self.max_segments:
+            segment = self.segments.popleft()
+            for path in (segment.path, segment.index_path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,65 @@
+# 驗證碼渲染微基準：比較原始實作與快取素材渲染引擎的每秒渲染數與平均圖片大小
+#
+# 用法：python -m benchmarks.captcha_render [--count 2000] [--font path.ttf]
+import argparse
+import io
+import random
+from time import perf_counter
+
+from PIL import Image, ImageDraw
+
+from captcha import CaptchaRenderer
+
+
+def render_legacy() -> tuple[str, bytes]:
+    # 原始 generate_captcha() 的渲染流程
+    code = ''.join(random.choices('0123456789', k=4))
+    img = Image.new('RGB', (100, 40), color='white')
+    draw = ImageDraw.Draw(img)
+    for i in range(5):
+        x1 = random.randint(0, 100)
+        y1 = random.randint(0, 40)
+        x2 = random.randint(0, 100)
+        y2 = random.randint(0, 40)
+        draw.line([(x1, y1), (x2, y2)], fill='gray')
+    draw.text((20, 10), code, fill='black')
+    img_byte_arr = io.BytesIO()
+    img.save(img_byte_arr, format='PNG')
+    return code, img_byte_arr.getvalue()
+
+
+def run(name: str, render, count: int):
+    # 預熱
+    for _ in range(min(count, 50)):
+        render()
+
+    total_bytes = 0
+    start = perf_counter()
+    for _ in range(count):
+        code, data = render()
+        total_bytes += len(data)
+    elapsed = perf_counter() - start
+
+    print(f"{name:<14} {count / elapsed:>10.0f} renders/s {total_bytes / count:>10.0f} bytes/image")
+    return count / elapsed, total_bytes / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Captcha rendering micro-benchmark')
+    parser.add_argument('--count', type=int, default=2000)
+    parser.add_argument('--font', default=None)
+    args = parser.parse_args()
+
+    start = perf_counter()
+    png_renderer = CaptchaRenderer(font_path=args.font, image_format='png')
+    webp_renderer = CaptchaRenderer(font_path=args.font, image_format='webp')
+    print(f"asset warm-up: {(perf_counter() - start) * 1000:.1f} ms for two renderers")
+
+    legacy_rate, legacy_size = run('legacy', render_legacy, args.count)
+    for name, renderer in (('engine/png', png_renderer), ('engine/webp', webp_renderer)):
+        rate, size = run(name, renderer.render, args.count)
+        print(f"{'':<14} x{rate / legacy_rate:.2f} speed, {size / legacy_size:.0%} of legacy size")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+# 邀請碼索引基準：比較 Python set 與記憶體映射索引的常駐記憶體 (RSS) 與查詢延遲
+#
+# 用法：python -m benchmarks.code_index [--codes 1000000] [--lookups 200000]
+import argparse
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+from time import perf_counter
+
+from code_index import CodeIndex, build_index
+
+
+def _rss() -> int:
+    # 目前的 RSS（Linux 讀取 /proc，其他平台退回最高 RSS）
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _queries(count: int, lookups: int) -> list[str]:
+    # 一半命中、一半不存在
+    rng = random.Random(42)
+    return [
+        f"INV-{rng.randrange(count):08d}" if i % 2 else f"BAD-{rng.randrange(count):08d}"
+        for i in range(lookups)
+    ]
+
+
+def _lookup_latency(container, queries: list[str]) -> float:
+    start = perf_counter()
+    for code in queries:
+        code in container
+    return (perf_counter() - start) / len(queries)
+
+
+def measure_set(count: int, lookups: int) -> tuple[int, float]:
+    queries = _queries(count, lookups)
+    before = _rss()
+    codes = {f"INV-{i:08d}" for i in range(count)}
+    rss = _rss() - before
+    return rss, _lookup_latency(codes, queries)
+
+
+def measure_index(path: str, count: int, lookups: int) -> tuple[int, float]:
+    queries = _queries(count, lookups)
+    before = _rss()
+    index = CodeIndex(path)
+    latency = _lookup_latency(index, queries)
+    # 映射頁面屬於可回收的檔案快取，這裡仍計入查詢後的 RSS 增量
+    rss = _rss() - before
+    index.close()
+    return rss, latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Invite code set vs memory-mapped index benchmark')
+    parser.add_argument('--codes', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=200000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'codes.idx')
+        start = perf_counter()
+        build_index((f"INV-{i:08d}" for i in range(args.codes)), path)
+        print(f"index build      {perf_counter() - start:>10.2f} s, {os.path.getsize(path) / 1024 / 1024:.1f} MB on disk")
+
+        # 每種實作在獨立進程中量測，避免互相影響 RSS
+        ctx = multiprocessing.get_context('spawn')
+        with ctx.Pool(1) as pool:
+            set_rss, set_latency = pool.apply(measure_set, (args.codes, args.lookups))
+        with ctx.Pool(1) as pool:
+            index_rss, index_latency = pool.apply(measure_index, (path, args.codes, args.lookups))
+
+    print(f"set              {set_rss / 1024 / 1024:>10.1f} MB RSS {set_latency * 1e6:>8.2f} us/lookup")
+    print(f"mmap index       {index_rss / 1024 / 1024:>10.1f} MB RSS {index_latency * 1e6:>8.2f} us/lookup")
+
+
+if __name__ == '__main__':
+    main()
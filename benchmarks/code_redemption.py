@@ -0,0 +1,66 @@
+# 邀請碼兌換吞吐量基準：在 SQLite 狀態庫上持續兌換邀請碼，量測處理器端吞吐量、
+# 寫入落盤延遲與啟動載入時間
+#
+# 用法：python -m benchmarks.code_redemption [--codes 200000] [--concurrency 500]
+import argparse
+import asyncio
+import os
+import tempfile
+from time import perf_counter
+
+from storage import StateStore
+
+
+async def redeem_worker(store: StateStore, codes: list[str], counter: list[int]):
+    for code in codes:
+        if store.consume_code(code):
+            store.add_pending(int(code[5:]), {'invite_code': code})
+            counter[0] += 1
+        # 模擬處理器之間的讓出
+        await asyncio.sleep(0)
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        codes = [f"code-{i}" for i in range(args.codes)]
+
+        store = StateStore(path)
+        await store.open()
+        store.add_codes(codes)
+        await store.flush()
+
+        # 兌換：處理器只操作記憶體，寫入由背景任務批次落盤
+        counter = [0]
+        chunk = max(len(codes) // args.concurrency, 1)
+        start = perf_counter()
+        await asyncio.gather(*(
+            redeem_worker(store, codes[i:i + chunk], counter)
+            for i in range(0, len(codes), chunk)
+        ))
+        handler_elapsed = perf_counter() - start
+        await store.flush()
+        durable_elapsed = perf_counter() - start
+        await store.close()
+
+        print(f"redeemed         {counter[0]} codes")
+        print(f"handler side     {counter[0] / handler_elapsed:>12.0f} redemptions/s")
+        print(f"durable          {counter[0] / durable_elapsed:>12.0f} redemptions/s (including final flush)")
+
+        # 啟動載入
+        store = StateStore(path)
+        start = perf_counter()
+        await store.open()
+        print(f"startup load     {(perf_counter() - start) * 1000:>12.1f} ms for {len(store.pending_users)} pending users")
+        await store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sustained invite code redemption benchmark')
+    parser.add_argument('--codes', type=int, default=200000)
+    parser.add_argument('--concurrency', type=int, default=500)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
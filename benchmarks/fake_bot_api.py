@@ -0,0 +1,252 @@
+# 本機假 Bot API 伺服器：回應機器人用到的 Bot API 方法（可模擬網路延遲），
+# 並以 getUpdates 長輪詢或推送到已設定的 webhook 的方式送出合成的更新，
+# 讓長輪詢與 webhook 模式都能在沒有網路的情況下量測
+import asyncio
+import email.parser
+import email.policy
+import itertools
+import json
+import logging
+from collections import Counter, deque
+from time import time
+from urllib.parse import parse_qs
+
+import httpx
+from telegram.request import BaseRequest
+
+from http_server import HTTPServer
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Bot', 'username': 'fake_bot'}
+
+
+def message_update(user_id: int, text: str, chat_id: int | None = None) -> dict:
+    message = {
+        'message_id': 1,
+        'date': int(time()),
+        'chat': {'id': chat_id or user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}', 'username': f'user{user_id}'},
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'message': message}
+
+
+def callback_update(user_id: int, data: str, message_id: int = 1) -> dict:
+    return {'callback_query': {
+        'id': f'{user_id}-{message_id}',
+        'chat_instance': str(user_id),
+        'data': data,
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}', 'username': f'user{user_id}'},
+        'message': {'message_id': message_id, 'date': int(time()), 'chat': {'id': user_id, 'type': 'private'}, 'text': ''},
+    }}
+
+
+def join_request_update(user_id: int, chat_id: int) -> dict:
+    return {'chat_join_request': {
+        'chat': {'id': chat_id, 'type': 'supergroup', 'title': 'group'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}', 'username': f'user{user_id}'},
+        'user_chat_id': user_id,
+        'date': int(time()),
+    }}
+
+
+def _parse_params(request) -> dict:
+    content_type = request.headers.get('content-type', '')
+    if content_type.startswith('application/json'):
+        return json.loads(request.body or b'{}')
+    if content_type.startswith('multipart/form-data'):
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + request.body
+        )
+        params = {}
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            if part.get_filename() is None:
+                params[name] = part.get_content().strip()
+        return params
+    return {key: values[0] for key, values in parse_qs(request.body.decode()).items()}
+
+
+class FakeBotAPI:
+
+    def __init__(self, latency: float = 0.0, listen: str = '127.0.0.1', port: int = 0):
+        self.latency = latency
+        self.http = HTTPServer(self._handle, listen=listen, port=port, max_connections=1000)
+        self.calls = Counter()
+        # on_call(method, params) 在每次呼叫後執行，用於計數或斷言
+        self.on_call = None
+        # 經由 InProcessRequest 上傳的檔案大小（位元組）
+        self.uploaded_bytes = 0
+
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1000)
+        self._updates = deque()
+        self._updates_available = asyncio.Event()
+
+        # webhook 推送
+        self.webhook_url = None
+        self._webhook_secret = None
+        self._webhook_queue = asyncio.Queue()
+        self._webhook_workers = []
+        self._client = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.http.listen}:{self.http.port}"
+
+    async def start(self):
+        await self.http.start()
+
+    async def stop(self):
+        await self._stop_webhook()
+        await self.http.stop(timeout=1)
+
+    def push_update(self, update: dict):
+        update = dict(update, update_id=next(self._update_ids))
+        if self.webhook_url:
+            self._webhook_queue.put_nowait(update)
+        else:
+            self._updates.append(update)
+            self._updates_available.set()
+
+    async def _set_webhook(self, params: dict):
+        await self._stop_webhook()
+        self.webhook_url = params['url']
+        self._webhook_secret = params.get('secret_token', '')
+        # 與 Telegram 相同，同時推送的連線數不超過 max_connections
+        connections = int(params.get('max_connections', 40))
+        self._client = httpx.AsyncClient(limits=httpx.Limits(max_connections=connections))
+        self._webhook_workers = [asyncio.create_task(self._deliver()) for _ in range(connections)]
+
+    async def _stop_webhook(self):
+        for worker in self._webhook_workers:
+            worker.cancel()
+        await asyncio.gather(*self._webhook_workers, return_exceptions=True)
+        self._webhook_workers = []
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+        self.webhook_url = None
+
+    async def _deliver(self):
+        while True:
+            update = await self._webhook_queue.get()
+            for _ in range(3):
+                try:
+                    response = await self._client.post(
+                        self.webhook_url, json=update,
+                        headers={'X-Telegram-Bot-Api-Secret-Token': self._webhook_secret}
+                    )
+                    if response.status_code == 200:
+                        break
+                except httpx.HTTPError as e:
+                    logging.warning(f"Fake Bot API webhook delivery failed: {e}")
+                await asyncio.sleep(0.1)
+
+    async def _get_updates(self, params: dict) -> list[dict]:
+        offset = int(params.get('offset', 0) or 0)
+        limit = int(params.get('limit', 100) or 100)
+        while self._updates and self._updates[0]['update_id'] < offset:
+            self._updates.popleft()
+
+        if not self._updates:
+            self._updates_available.clear()
+            try:
+                await asyncio.wait_for(self._updates_available.wait(), float(params.get('timeout', 0) or 0))
+            except asyncio.TimeoutError:
+                return []
+        return list(itertools.islice(self._updates, limit))
+
+    def _message(self, params: dict) -> dict:
+        chat_id = int(params.get('chat_id', 0))
+        return {
+            'message_id': next(self._message_ids),
+            'date': int(time()),
+            'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'supergroup'},
+            'from': BOT_USER,
+            'text': params.get('text', ''),
+        }
+
+    async def _result(self, method: str, params: dict):
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getUpdates':
+            return await self._get_updates(params)
+        if method == 'setWebhook':
+            await self._set_webhook(params)
+            return True
+        if method == 'deleteWebhook':
+            await self._stop_webhook()
+            return True
+        if method == 'createChatInviteLink':
+            return {
+                'invite_link': f"https://t.me/+fake{next(self._message_ids)}",
+                'creator': BOT_USER,
+                'creates_join_request': False,
+                'is_primary': False,
+                'is_revoked': False,
+                'member_limit': 1,
+                'expire_date': int(params['expire_date']) if params.get('expire_date') else None,
+            }
+        if method == 'revokeChatInviteLink':
+            return {
+                'invite_link': params.get('invite_link', ''),
+                'creator': BOT_USER,
+                'creates_join_request': False,
+                'is_primary': False,
+                'is_revoked': True,
+            }
+        if method == 'sendPhoto':
+            return dict(self._message(params), photo=[
+                {'file_id': f"photo{next(self._message_ids)}", 'file_unique_id': 'p', 'width': 160, 'height': 60}
+            ])
+        if method == 'sendDocument':
+            return dict(self._message(params), document={'file_id': 'document', 'file_unique_id': 'd'})
+        if method.startswith(('send', 'edit', 'copy', 'forward')):
+            return self._message(params)
+        return True
+
+    async def call(self, method: str, params: dict):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        result = await self._result(method, params)
+        self.calls[method] += 1
+        if self.on_call:
+            self.on_call(method, params)
+        return result
+
+    async def _handle(self, request):
+        # 路徑格式：/bot<token>/<method>
+        method = request.path.rsplit('/', 1)[-1]
+        result = await self.call(method, _parse_params(request))
+        return 200, 'application/json', json.dumps({'ok': True, 'result': result}).encode()
+
+
+class InProcessRequest(BaseRequest):
+    # 不經過網路，直接把機器人的 Bot API 請求交給同一進程中的 FakeBotAPI 處理，
+    # 量測 CPU 與記憶體時不包含 HTTP 客戶端與伺服器的開銷；不需要呼叫 FakeBotAPI.start()
+
+    def __init__(self, api: FakeBotAPI):
+        self.api = api
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        params = request_data.json_parameters if request_data else {}
+        if request_data:
+            for _, content, *_ in request_data.multipart_data.values():
+                if isinstance(content, bytes):
+                    self.api.uploaded_bytes += len(content)
+        result = await self.api.call(url.rsplit('/', 1)[-1], params)
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
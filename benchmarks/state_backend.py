@@ -0,0 +1,113 @@
+# 共享狀態後端基準：多個模擬的機器人實例同時兌換同一批邀請碼並共用頻率限制，
+# 檢查每個邀請碼只被兌換一次、令牌桶的總放行數不超過限制，並量測每秒操作數。
+# 未指定 --redis-url 時使用 fakeredis 作為本機的 Redis 替身（pip install fakeredis[lua]）
+#
+# 用法：python -m benchmarks.state_backend [--replicas 4] [--codes 20000] [--redis-url redis://localhost:6379/15]
+import argparse
+import asyncio
+import os
+import tempfile
+from time import perf_counter
+
+from state_backend import MemoryBackend, RedisBackend
+from storage import StateStore
+from timer_wheel import TimerWheel
+
+
+def redis_backends(args) -> list[RedisBackend]:
+    prefix = f"bench{os.getpid()}:"
+    if args.redis_url:
+        return [RedisBackend(args.redis_url, prefix=prefix) for _ in range(args.replicas)]
+
+    import fakeredis
+    server = fakeredis.FakeServer()
+    return [
+        RedisBackend(prefix=prefix, client=fakeredis.aioredis.FakeRedis(server=server, decode_responses=True))
+        for _ in range(args.replicas)
+    ]
+
+
+async def redeem(backends, codes: list[str], concurrency: int) -> tuple[int, float]:
+    # 每個邀請碼由所有實例同時嘗試兌換
+    redeemed = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def attempt(backend, code: str):
+        nonlocal redeemed
+        async with semaphore:
+            if await backend.consume_code(code):
+                redeemed += 1
+
+    start = perf_counter()
+    await asyncio.gather(*(attempt(backend, code) for code in codes for backend in backends))
+    return redeemed, perf_counter() - start
+
+
+async def rate_limit(backends, users: int, attempts: int, burst: int, concurrency: int) -> tuple[int, float]:
+    # 頻率極低，量測期間不會補充令牌：每位用戶最多放行 burst 次
+    allowed = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def attempt(backend, user_id: int):
+        nonlocal allowed
+        async with semaphore:
+            if await backend.take_token(f"bench:{user_id}", 0.0001, burst):
+                allowed += 1
+
+    start = perf_counter()
+    await asyncio.gather(*(
+        attempt(backends[i % len(backends)], user_id)
+        for user_id in range(users) for i in range(attempts)
+    ))
+    return allowed, perf_counter() - start
+
+
+async def run_backend(name: str, backends, args):
+    for backend in backends:
+        await backend.open()
+    try:
+        codes = [f"code-{i}" for i in range(args.codes)]
+        await backends[0].add_codes(codes)
+
+        redeemed, elapsed = await redeem(backends, codes, args.concurrency)
+        status = 'ok' if redeemed == len(codes) else 'DOUBLE REDEMPTION' if redeemed > len(codes) else 'LOST CODES'
+        print(f"{name:<8} redeem     {len(codes) * len(backends) / elapsed:>10.0f} ops/s  "
+              f"{redeemed}/{len(codes)} codes redeemed once ({status})")
+
+        allowed, elapsed = await rate_limit(backends, args.users, args.burst * 2, args.burst, args.concurrency)
+        expected = args.users * args.burst
+        status = 'ok' if allowed == expected else 'LIMIT EXCEEDED' if allowed > expected else 'UNDER LIMIT'
+        print(f"{name:<8} rate limit {args.users * args.burst * 2 / elapsed:>10.0f} ops/s  "
+              f"{allowed}/{expected} tokens granted ({status})")
+    finally:
+        if isinstance(backends[0], RedisBackend):
+            keys = [key async for key in backends[0].redis.scan_iter(match=backends[0].prefix + '*')]
+            if keys:
+                await backends[0].redis.delete(*keys)
+        for backend in backends:
+            await backend.close()
+
+
+async def run(args):
+    # 記憶體後端只能單一實例使用，作為基準線
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = MemoryBackend(StateStore(os.path.join(tmp, 'bench.db')), TimerWheel(), attempt_ttl=3600)
+        await run_backend('memory', [backend], args)
+
+    await run_backend('redis', redis_backends(args), args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Shared state backend atomicity and throughput')
+    parser.add_argument('--replicas', type=int, default=4, help='simulated bot instances sharing one Redis')
+    parser.add_argument('--codes', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--burst', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--redis-url', help='real Redis server (default: in-process fakeredis)')
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
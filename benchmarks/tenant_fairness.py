@@ -0,0 +1,86 @@
+# 多群組准入公平性基準：一個群組湧入大量驗證請求時，其他群組的等待時間
+# 比較所有群組共用一個先進先出佇列（fifo）與各群組輪流放行（per-group）兩種方式
+#
+# 用法：python -m benchmarks.tenant_fairness [--groups 200] [--raid 5000] [--group-rate 0.2] [--duration 10]
+import argparse
+import asyncio
+import random
+from time import perf_counter
+
+from ratelimit import AdmissionController
+
+TICK = 0.05  # 其他群組產生請求的間隔（秒）
+
+
+def percentile(values: list[float], q: float) -> str:
+    if not values:
+        return '-'
+    values = sorted(values)
+    return f"{values[min(int(len(values) * q), len(values) - 1)] * 1000:.0f}ms"
+
+
+async def run(args, per_group: bool) -> dict:
+    # 湧入的群組為 0，其他群組以穩定速率開始驗證；per_group 為 False 時所有請求共用同一個佇列
+    admission = AdmissionController(args.global_rate, args.global_burst, queue_size=args.raid * 2)
+    await admission.start()
+
+    waits = {'raid': [], 'others': []}
+    unserved = {'raid': 0, 'others': 0}
+
+    async def verify(group: int):
+        kind = 'raid' if group == 0 else 'others'
+        key = group if per_group else None
+        start = perf_counter()
+        if not admission.try_acquire(key):
+            waiter = admission.enqueue(key)
+            if waiter is None:
+                unserved[kind] += 1
+                return
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                unserved[kind] += 1
+                return
+        waits[kind].append(perf_counter() - start)
+
+    rng = random.Random(42)
+    tasks = [asyncio.create_task(verify(0)) for _ in range(args.raid)]
+    per_tick = (args.groups - 1) * args.group_rate * TICK
+    carry = 0.0
+    deadline = perf_counter() + args.duration
+    while perf_counter() < deadline:
+        carry += per_tick
+        while carry >= 1:
+            carry -= 1
+            tasks.append(asyncio.create_task(verify(rng.randrange(1, args.groups))))
+        await asyncio.sleep(TICK)
+
+    # 時間到時仍在排隊的請求視為未服務
+    await admission.stop()
+    await asyncio.gather(*tasks)
+    return {'waits': waits, 'unserved': unserved}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-group admission fairness benchmark')
+    parser.add_argument('--groups', type=int, default=200)
+    parser.add_argument('--raid', type=int, default=5000, help='verifications arriving at once in one group')
+    parser.add_argument('--group-rate', type=float, default=0.2, help='verifications per second in every other group')
+    parser.add_argument('--global-rate', type=float, default=100)
+    parser.add_argument('--global-burst', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=10)
+    args = parser.parse_args()
+
+    print(f"{args.groups} groups, raid of {args.raid} in one group, "
+          f"{(args.groups - 1) * args.group_rate:.0f}/s across the others, global limit {args.global_rate:.0f}/s")
+    print(f"{'mode':<10} {'group':<7} {'served':>7} {'unserved':>9} {'p50 wait':>10} {'p99 wait':>10}")
+    for mode, per_group in (('fifo', False), ('per-group', True)):
+        result = asyncio.run(run(args, per_group))
+        for kind in ('raid', 'others'):
+            waits = result['waits'][kind]
+            print(f"{mode:<10} {kind:<7} {len(waits):>7} {result['unserved'][kind]:>9} "
+                  f"{percentile(waits, 0.5):>10} {percentile(waits, 0.99):>10}")
+
+
+if __name__ == '__main__':
+    main()
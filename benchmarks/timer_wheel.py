@@ -0,0 +1,49 @@
+# 時間輪基準：量測大量到期事件的排程、取消與觸發速度
+#
+# 用法：python -m benchmarks.timer_wheel [--timers 500000] [--horizon 86400]
+import argparse
+import random
+from time import perf_counter, time
+
+from timer_wheel import TimerWheel
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hierarchical timer wheel benchmark')
+    parser.add_argument('--timers', type=int, default=500000)
+    parser.add_argument('--horizon', type=int, default=86400, help='deadlines are spread over this many seconds')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    delays = [rng.uniform(1, args.horizon) for _ in range(args.timers)]
+    wheel = TimerWheel(tick=1.0)
+    fired = 0
+
+    def callback():
+        nonlocal fired
+        fired += 1
+
+    start = perf_counter()
+    for key, delay in enumerate(delays):
+        wheel.schedule(key, delay, callback)
+    schedule_time = perf_counter() - start
+
+    # 取消一半，模擬對話完成或請求被審核
+    start = perf_counter()
+    for key in range(0, args.timers, 2):
+        wheel.cancel(key)
+    cancel_time = perf_counter() - start
+
+    # 以模擬時鐘推進整個時間範圍
+    start = perf_counter()
+    wheel.advance(time() + args.horizon + 1)
+    advance_time = perf_counter() - start
+
+    cancelled = (args.timers + 1) // 2
+    print(f"schedule         {schedule_time / args.timers * 1e6:>8.2f} us/timer")
+    print(f"cancel           {cancel_time / cancelled * 1e6:>8.2f} us/timer")
+    print(f"advance {args.horizon} ticks {advance_time:>8.2f} s, fired {fired} ({advance_time / max(fired, 1) * 1e6:.2f} us/timer incl. idle ticks)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# 更新吞吐量基準：以本機假 Bot API 伺服器分別量測長輪詢與 webhook 模式每秒處理的更新數
+#
+# 用法：python -m benchmarks.update_throughput [--updates 5000] [--latency 0.005]
+import argparse
+import asyncio
+import importlib
+import logging
+import multiprocessing
+import os
+import socket
+import tempfile
+from time import perf_counter
+
+from benchmarks.fake_bot_api import FakeBotAPI, message_update
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def _measure(mode: str, updates: int, latency: float, state_dir: str) -> float:
+    api = FakeBotAPI(latency=latency)
+    await api.start()
+
+    os.environ.update({
+        'BOT_TOKEN': '1:benchmark',
+        'ADMIN_ID': '1',
+        'GROUP_ID': '-100',
+        'STATE_DB': os.path.join(state_dir, 'state.db'),
+        'AUDIT_DIR': os.path.join(state_dir, 'audit'),
+        'BOT_API_BASE_URL': api.base_url,
+        'CAPTCHA_EXECUTOR': 'thread',
+        'CAPTCHA_POOL_SIZE': '0',
+        'INVITE_LINK_POOL_SIZE': '0',
+        'OUTBOUND_GLOBAL_RATE': '1000000',
+    })
+    if mode == 'webhook':
+        port = _free_port()
+        os.environ.update({'WEBHOOK_URL': f'http://127.0.0.1:{port}', 'WEBHOOK_PORT': str(port)})
+
+    # 設定好環境變數後才載入機器人
+    bot = importlib.import_module('main')
+    application = bot.build_application()
+
+    replies = 0
+    done = asyncio.Event()
+
+    def on_call(method: str, params: dict):
+        nonlocal replies
+        if method == 'sendMessage':
+            replies += 1
+            if replies == updates:
+                done.set()
+
+    api.on_call = on_call
+    stop = asyncio.Event()
+    runner = asyncio.create_task(bot.run(application, stop))
+    while not application.running:
+        await asyncio.sleep(0.01)
+
+    # 每個更新來自不同的用戶，避免受各聊天室的發送限制影響
+    start = perf_counter()
+    for i in range(updates):
+        api.push_update(message_update(100000 + i, '/help'))
+    await done.wait()
+    elapsed = perf_counter() - start
+
+    stop.set()
+    await runner
+    await api.stop()
+    return elapsed
+
+
+def measure(mode: str, updates: int, latency: float) -> float:
+    # 每個 Bot API 呼叫都會產生 httpx 日誌，量測時關閉
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as state_dir:
+        return asyncio.run(_measure(mode, updates, latency, state_dir))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Long polling vs webhook update throughput against a fake Bot API')
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--latency', type=float, default=0.005, help='simulated Bot API latency in seconds')
+    args = parser.parse_args()
+
+    # 每種模式在獨立進程中量測，機器人的模組狀態互不影響
+    ctx = multiprocessing.get_context('spawn')
+    for mode in ('polling', 'webhook'):
+        with ctx.Pool(1) as pool:
+            elapsed = pool.apply(measure, (mode, args.updates, args.latency))
+        print(f"{mode:<16} {args.updates / elapsed:>10.0f} updates/s ({elapsed:.2f} s for {args.updates} updates)")
+
+
+if __name__ == '__main__':
+    main()
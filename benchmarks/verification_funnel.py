@@ -0,0 +1,377 @@
+# 驗證漏斗負載測試：以合成的更新驅動 main.py 實際的 Application 與 ConversationHandler，
+# Bot API 由同一進程中的假伺服器（benchmarks/fake_bot_api.py）回應。
+# 模擬大量用戶依序完成 /start → 取得驗證碼 → 回答驗證碼 → 輸入邀請碼 → 管理員批准，
+# 其中一部分用戶答錯驗證碼、一部分邀請碼需要人工審核；raid 情境中所有用戶同時湧入。
+# --join-mode request 時用戶改以入群申請開始驗證，通過後由機器人直接批准申請。
+# --challenge-mode 設定驗證方式（CHALLENGE_MODE），收到按鈕題目的用戶以按鈕作答。
+#
+# 各階段分開執行（所有用戶完成一個階段後才進入下一個階段），因此每個階段的 CPU 時間與記憶體變化
+# 都可以歸屬到該階段。結果以 JSON 儲存，可用 --compare 與先前的結果比較。
+#
+# 用法：python -m benchmarks.verification_funnel [--users 2000] [--scenario steady raid]
+#                                                [--join-mode link|request]
+#                                                [--challenge-mode adaptive|full|cached|keyboard]
+#                                                [--output funnel.json] [--compare baseline.json]
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+from collections import Counter
+from time import perf_counter, process_time
+
+from benchmarks.fake_bot_api import FakeBotAPI, InProcessRequest, callback_update, join_request_update, message_update
+
+ADMIN_ID = 99999
+GROUP_ID = -100
+APPROVE_BATCH_SIZE = 250  # 每則 /approve_codes 指令包含的邀請碼數，避免超過訊息長度上限
+
+
+def _rss_mb() -> float:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _percentile(values: list[float], percentile: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * percentile), len(values) - 1)]
+
+
+def _api_calls(api: FakeBotAPI) -> int:
+    # 機器人發出的 Bot API 呼叫數，不含接收更新的長輪詢
+    return sum(count for method, count in api.calls.items() if method != 'getUpdates')
+
+
+# 依機器人回覆判斷各階段的結果；回傳 None 表示不是該階段的最終回覆（例如排隊中的提示）
+def _classify_start(method: str, text: str):
+    if method == 'sendMessage' and text.startswith('👋'):
+        return 'welcomed'
+
+
+def _classify_captcha(method: str, text: str):
+    if method == 'sendPhoto':
+        return 'captcha_sent'
+    if method == 'sendMessage' and text.startswith('請點選'):
+        return 'keyboard_sent'
+    if method == 'editMessageText' and text.startswith('❌'):
+        return 'rejected_busy' if '人數過多' in text else 'rejected'
+
+
+def _classify_answer(method: str, text: str):
+    # 按鈕題目的結果以編輯題目訊息回覆
+    if method in ('sendMessage', 'editMessageText'):
+        if text.startswith('請輸入您的邀請碼'):
+            return 'captcha_passed'
+        if text.startswith('❌'):
+            return 'captcha_failed'
+
+
+def _classify_code(method: str, text: str):
+    if method == 'sendMessage':
+        if text.startswith('🎉'):
+            return 'code_accepted'
+        if text.startswith('✅'):
+            return 'pending'
+        if text.startswith('❌'):
+            return 'error'
+
+
+def _classify_approval(method: str, text: str):
+    if method == 'sendMessage' and text.startswith('🎉') or method == 'approveChatJoinRequest':
+        return 'approved'
+
+
+class FunnelDriver:
+
+    def __init__(self, bot, api: FakeBotAPI, timeout: float):
+        self.bot = bot
+        self.api = api
+        self.timeout = timeout
+        self.answers = {}
+        # 用戶 ID -> (判斷函數, future)
+        self._waiting = {}
+        api.on_call = self._on_call
+
+        # 記錄發出的驗證碼答案，與驗證碼模式及狀態後端無關
+        store_captcha = bot.store_captcha
+
+        async def record_captcha(user_id: int, code: str, context):
+            self.answers[user_id] = code
+            await store_captcha(user_id, code, context)
+
+        bot.store_captcha = record_captcha
+
+    def _on_call(self, method: str, params: dict):
+        try:
+            # 入群申請相關的 API 以 user_id 指定用戶
+            chat_id = int(params.get('user_id') or params.get('chat_id') or 0)
+        except ValueError:
+            return
+        waiting = self._waiting.get(chat_id)
+        if waiting is None:
+            return
+        classify, future = waiting
+        outcome = classify(method, str(params.get('text') or params.get('caption') or ''))
+        if outcome is not None and not future.done():
+            future.set_result(outcome)
+
+    async def _wait(self, user_id: int, classify, send) -> tuple[str, float]:
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[user_id] = (classify, future)
+        start = perf_counter()
+        send()
+        try:
+            outcome = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            outcome = 'timeout'
+        finally:
+            del self._waiting[user_id]
+        return outcome, perf_counter() - start
+
+    async def run_stage(self, name: str, user_ids: list[int], classify, send, concurrency: int) -> tuple[dict, dict]:
+        # 同時最多 concurrency 位用戶在此階段中；回傳 (統計, 用戶 ID -> 結果)
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        outcomes = {}
+
+        async def one(user_id: int):
+            async with semaphore:
+                outcome, latency = await self._wait(user_id, classify, lambda: send(user_id))
+                outcomes[user_id] = outcome
+                latencies.append(latency)
+
+        rss = _rss_mb()
+        calls = _api_calls(self.api)
+        uploaded = self.api.uploaded_bytes
+        cpu = process_time()
+        start = perf_counter()
+        await asyncio.gather(*(one(user_id) for user_id in user_ids))
+        return self._stats(
+            name, user_ids, latencies, outcomes, perf_counter() - start, process_time() - cpu, rss, calls, uploaded
+        ), outcomes
+
+    async def run_approvals(self, user_ids: list[int], codes: dict[int, str]) -> tuple[dict, dict]:
+        # 管理員以 /approve_codes 批次批准，等每一批都完成後才送出下一批
+        latencies = []
+        outcomes = {}
+
+        async def one(user_id: int, send):
+            outcome, latency = await self._wait(user_id, _classify_approval, send)
+            outcomes[user_id] = outcome
+            latencies.append(latency)
+
+        rss = _rss_mb()
+        calls = _api_calls(self.api)
+        uploaded = self.api.uploaded_bytes
+        cpu = process_time()
+        start = perf_counter()
+        for i in range(0, len(user_ids), APPROVE_BATCH_SIZE):
+            batch = user_ids[i:i + APPROVE_BATCH_SIZE]
+            command = '/approve_codes ' + ' '.join(codes[user_id] for user_id in batch)
+            # 第一位用戶的等待開始時才送出指令，整批的延遲從同一時間起算
+            send = lambda: self.api.push_update(message_update(ADMIN_ID, command))
+            await asyncio.gather(*(one(user_id, send if j == 0 else lambda: None) for j, user_id in enumerate(batch)))
+        return self._stats(
+            'approval', user_ids, latencies, outcomes, perf_counter() - start, process_time() - cpu, rss, calls, uploaded
+        ), outcomes
+
+    def _stats(self, name, user_ids, latencies, outcomes, elapsed, cpu, rss_before, calls_before, uploaded_before) -> dict:
+        calls = _api_calls(self.api) - calls_before
+        uploaded = self.api.uploaded_bytes - uploaded_before
+        rss = _rss_mb()
+        return {
+            'stage': name,
+            'users': len(user_ids),
+            'elapsed_s': round(elapsed, 4),
+            'throughput_per_s': round(len(user_ids) / elapsed, 1) if elapsed else 0.0,
+            'latency_p50_ms': round(_percentile(latencies, 0.5) * 1000, 2),
+            'latency_p99_ms': round(_percentile(latencies, 0.99) * 1000, 2),
+            'cpu_s': round(cpu, 4),
+            'cpu_per_user_ms': round(cpu / len(user_ids) * 1000, 3) if user_ids else 0.0,
+            'rss_mb': round(rss, 1),
+            'rss_delta_mb': round(rss - rss_before, 1),
+            'api_calls': calls,
+            'api_calls_per_user': round(calls / len(user_ids), 2) if user_ids else 0.0,
+            'upload_kb_per_user': round(uploaded / len(user_ids) / 1024, 2) if user_ids else 0.0,
+            'outcomes': dict(Counter(outcomes.values())),
+            'state_sizes': {name: size for (name,), size in self.bot.state_sizes().items()},
+        }
+
+
+async def _run_scenario(scenario: str, args, state_dir: str) -> dict:
+    raid = scenario == 'raid'
+    os.environ.update({
+        'BOT_TOKEN': '1:benchmark',
+        'ADMIN_ID': str(ADMIN_ID),
+        'GROUP_ID': str(GROUP_ID),
+        'JOIN_MODE': args.join_mode,
+        'CHALLENGE_MODE': args.challenge_mode,
+        'STATE_DB': os.path.join(state_dir, 'state.db'),
+        'AUDIT_DIR': os.path.join(state_dir, 'audit'),
+        'STATE_BACKEND': 'memory',
+        'BOT_API_BASE_URL': 'http://fake-bot-api.invalid',
+        # 量測機器人本身的處理能力，不受 Telegram 全域發送限制影響
+        'OUTBOUND_GLOBAL_RATE': '1000000',
+        # 待審核請求合併成摘要，避免管理員聊天室的發送限制拖慢批准
+        'ADMIN_DIGEST_WINDOW': '1',
+        'GLOBAL_VERIFY_RATE': str(args.raid_admission_rate if raid else 1000000),
+        'GLOBAL_VERIFY_BURST': str(args.raid_admission_rate if raid else 1000000),
+    })
+    # 渲染在執行緒中進行，CPU 時間才會計入本進程；可用環境變數覆寫
+    os.environ.setdefault('CAPTCHA_EXECUTOR', 'thread')
+    os.environ.setdefault('INVITE_LINK_POOL_SIZE', '0')
+
+    # 設定好環境變數後才載入機器人；Bot API 呼叫與更新處理的日誌量很大，量測時關閉
+    bot = importlib.import_module('main')
+    logging.getLogger().setLevel(logging.WARNING)
+    api = FakeBotAPI()
+    application = bot.build_application(request=InProcessRequest(api), get_updates_request=InProcessRequest(api))
+    driver = FunnelDriver(bot, api, timeout=args.timeout)
+
+    stop = asyncio.Event()
+    runner = asyncio.create_task(bot.run(application, stop))
+    while not application.running:
+        await asyncio.sleep(0.01)
+
+    users = list(range(100000, 100000 + args.users))
+    # 依用戶 ID 決定行為，每次執行的用戶組成相同
+    wrong_every = round(1 / args.wrong_captcha) if args.wrong_captcha else 0
+    manual_every = round(1 / args.manual_review) if args.manual_review else 0
+    codes = {user_id: f"LOAD{user_id}" for user_id in users}
+    await bot.backend.add_codes(
+        [code for i, code in enumerate(codes.values()) if not (manual_every and i % manual_every == 0)]
+    )
+    wrong = {user_id for i, user_id in enumerate(users) if wrong_every and i % wrong_every == 1}
+
+    concurrency = len(users) if raid else args.concurrency
+    stages = []
+    try:
+        if args.join_mode == 'request':
+            start_update = lambda user_id: join_request_update(user_id, GROUP_ID)
+        else:
+            start_update = lambda user_id: message_update(user_id, '/start')
+        stats, _ = await driver.run_stage(
+            'start', users, _classify_start, lambda user_id: api.push_update(start_update(user_id)), concurrency
+        )
+        stages.append(stats)
+
+        stats, outcomes = await driver.run_stage(
+            'captcha', users, _classify_captcha,
+            lambda user_id: api.push_update(callback_update(user_id, 'start_verify:default')), concurrency
+        )
+        stages.append(stats)
+        keyboard = {user_id for user_id in users if outcomes[user_id] == 'keyboard_sent'}
+        users = [user_id for user_id in users if outcomes[user_id] in ('captcha_sent', 'keyboard_sent')]
+
+        def answer_update(user_id: int):
+            answer = '0000' if user_id in wrong else driver.answers[user_id]
+            if user_id in keyboard:
+                return callback_update(user_id, f'captcha:{answer}')
+            return message_update(user_id, answer)
+
+        stats, outcomes = await driver.run_stage(
+            'answer', users, _classify_answer, lambda user_id: api.push_update(answer_update(user_id)), concurrency
+        )
+        stages.append(stats)
+        users = [user_id for user_id in users if outcomes[user_id] == 'captcha_passed']
+
+        stats, outcomes = await driver.run_stage(
+            'code', users, _classify_code,
+            lambda user_id: api.push_update(message_update(user_id, codes[user_id])), concurrency
+        )
+        stages.append(stats)
+        pending = [user_id for user_id in users if outcomes[user_id] == 'pending']
+
+        if pending:
+            stats, _ = await driver.run_approvals(pending, codes)
+            stages.append(stats)
+    finally:
+        stop.set()
+        await runner
+
+    total_elapsed = sum(stage['elapsed_s'] for stage in stages)
+    completed = sum(stage['outcomes'].get('code_accepted', 0) + stage['outcomes'].get('approved', 0) for stage in stages)
+    return {
+        'scenario': scenario,
+        'users': args.users,
+        'concurrency': concurrency,
+        'wrong_captcha': args.wrong_captcha,
+        'manual_review': args.manual_review,
+        'join_mode': args.join_mode,
+        'challenge_mode': args.challenge_mode,
+        'verified': completed,
+        'verified_per_s': round(completed / total_elapsed, 1) if total_elapsed else 0.0,
+        'cpu_per_verified_ms': round(sum(stage['cpu_s'] for stage in stages) / completed * 1000, 3) if completed else 0.0,
+        'stages': stages,
+    }
+
+
+def run_scenario(scenario: str, args) -> dict:
+    with tempfile.TemporaryDirectory() as state_dir:
+        return asyncio.run(_run_scenario(scenario, args, state_dir))
+
+
+def _print_result(result: dict, baseline: dict | None):
+    print(f"\n{result['scenario']}: {result['verified']}/{result['users']} verified, "
+          f"{result['verified_per_s']} verified/s, {result['cpu_per_verified_ms']} ms CPU per verified user")
+    print(f"  {'stage':<10}{'users':>7}{'users/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'CPU ms/user':>13}{'RSS MB':>9}"
+          f"{'API/user':>10}{'KB/user':>9}  outcomes")
+    baseline_stages = {stage['stage']: stage for stage in (baseline or {}).get('stages', [])}
+    for stage in result['stages']:
+        line = (f"  {stage['stage']:<10}{stage['users']:>7}{stage['throughput_per_s']:>10}{stage['latency_p50_ms']:>10}"
+                f"{stage['latency_p99_ms']:>10}{stage['cpu_per_user_ms']:>13}{stage['rss_mb']:>9}"
+                f"{stage['api_calls_per_user']:>10}{stage.get('upload_kb_per_user', 0.0):>9}  {stage['outcomes']}")
+        previous = baseline_stages.get(stage['stage'])
+        if previous and previous['throughput_per_s'] and previous['latency_p99_ms']:
+            line += (f"  [users/s {stage['throughput_per_s'] / previous['throughput_per_s'] - 1:+.0%}, "
+                     f"p99 {stage['latency_p99_ms'] / previous['latency_p99_ms'] - 1:+.0%}]")
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test of the verification funnel against an in-process fake Bot API')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--scenario', nargs='+', choices=('steady', 'raid'), default=['steady', 'raid'])
+    parser.add_argument('--concurrency', type=int, default=500, help='users in flight per stage (steady scenario)')
+    parser.add_argument('--wrong-captcha', type=float, default=0.1, help='fraction of users answering the captcha wrong')
+    parser.add_argument('--manual-review', type=float, default=0.2, help='fraction of users whose code needs approval')
+    parser.add_argument('--raid-admission-rate', type=int, default=200, help='GLOBAL_VERIFY_RATE during the raid')
+    parser.add_argument('--join-mode', choices=('link', 'request'), default='link',
+                        help='send invite links or approve chat join requests')
+    parser.add_argument('--challenge-mode', choices=('adaptive', 'full', 'cached', 'keyboard'), default='adaptive',
+                        help='CHALLENGE_MODE of the bot')
+    parser.add_argument('--timeout', type=float, default=120, help='seconds to wait for each reply')
+    parser.add_argument('--output', default='funnel_results.json')
+    parser.add_argument('--compare', help='previous results file to compare against')
+    args = parser.parse_args()
+
+    baselines = {}
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baselines = {result['scenario']: result for result in json.load(f)['results']}
+
+    # 每個情境在獨立進程中執行，機器人的模組狀態互不影響
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    for scenario in args.scenario:
+        with ctx.Pool(1) as pool:
+            result = pool.apply(run_scenario, (scenario, args))
+        _print_result(result, baselines.get(scenario))
+        results.append(result)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'args': vars(args), 'results': results}, f, indent=2, ensure_ascii=False)
+    print(f"\nResults saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import io
+import logging
+import multiprocessing
+import random
+from time import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from PIL import Image, ImageDraw, ImageFont
+
+
+CAPTCHA_WIDTH = 100
+CAPTCHA_HEIGHT = 40
+CAPTCHA_LENGTH = 4
+
+# 4 色調色盤：背景、淡雜點、干擾線、文字
+_PALETTE = [255, 255, 255, 200, 200, 200, 128, 128, 128, 0, 0, 0]
+_BACKGROUND, _DOT, _LINE, _INK = range(4)
+
+
+class CaptchaRenderer:
+    # 以快取素材合成驗證碼：字型只載入一次，數字字形與雜訊背景預先渲染，
+    # 每次請求只需複製背景、貼上字形並輸出 2-bit 調色盤 PNG（或灰階 WebP）
+
+    def __init__(self, font_path: str | None = None, font_size: int = 26, image_format: str = 'png',
+                 backgrounds: int = 32, glyph_variants: int = 5):
+        if font_path:
+            self.font = ImageFont.truetype(font_path, font_size)
+        else:
+            self.font = ImageFont.load_default(size=font_size)
+
+        self.image_format = image_format.lower()
+        self.backgrounds = [self._make_background() for _ in range(backgrounds)]
+        self.glyphs = {digit: self._make_glyphs(digit, glyph_variants) for digit in '0123456789'}
+        self.glyph_width = max(g.width for variants in self.glyphs.values() for g in variants)
+        self.glyph_height = max(g.height for variants in self.glyphs.values() for g in variants)
+
+    def _make_background(self) -> Image.Image:
+        img = Image.new('P', (CAPTCHA_WIDTH, CAPTCHA_HEIGHT), _BACKGROUND)
+        img.putpalette(_PALETTE)
+        draw = ImageDraw.Draw(img)
+
+        # 雜點
+        for i in range(80):
+            draw.point((random.randrange(CAPTCHA_WIDTH), random.randrange(CAPTCHA_HEIGHT)), fill=_DOT)
+
+        # 干擾線
+        for i in range(5):
+            x1 = random.randint(0, CAPTCHA_WIDTH)
+            y1 = random.randint(0, CAPTCHA_HEIGHT)
+            x2 = random.randint(0, CAPTCHA_WIDTH)
+            y2 = random.randint(0, CAPTCHA_HEIGHT)
+            draw.line([(x1, y1), (x2, y2)], fill=_LINE)
+
+        return img
+
+    def _make_glyphs(self, digit: str, variants: int) -> list[Image.Image]:
+        left, top, right, bottom = self.font.getbbox(digit)
+        mask = Image.new('1', (right - left + 4, bottom - top + 4), 0)
+        ImageDraw.Draw(mask).text((2 - left, 2 - top), digit, font=self.font, fill=1)
+
+        # 預先產生多個旋轉角度的字形遮罩
+        angles = [-12 + 24 * i / max(variants - 1, 1) for i in range(variants)]
+        return [mask.rotate(angle, expand=True) for angle in angles]
+
+    def render(self, code: str | None = None) -> tuple[str, bytes]:
+        if code is None:
+            code = ''.join(random.choices('0123456789', k=CAPTCHA_LENGTH))
+
+        img = random.choice(self.backgrounds).copy()
+
+        # 貼上字形，每個字元加入少量位移
+        step = (CAPTCHA_WIDTH - 8) // len(code)
+        max_y = max(CAPTCHA_HEIGHT - self.glyph_height, 0)
+        for i, digit in enumerate(code):
+            glyph = random.choice(self.glyphs[digit])
+            x = 4 + i * step + random.randint(0, max(step - glyph.width, 0))
+            y = random.randint(0, max_y)
+            img.paste(_INK, (x, y, x + glyph.width, y + glyph.height), glyph)
+
+        # 每張圖再加一條隨機干擾線，避免背景完全重複
+        ImageDraw.Draw(img).line(
+            [(0, random.randint(0, CAPTCHA_HEIGHT)), (CAPTCHA_WIDTH, random.randint(0, CAPTCHA_HEIGHT))],
+            fill=_LINE
+        )
+
+        img_byte_arr = io.BytesIO()
+        if self.image_format == 'webp':
+            img.convert('L').save(img_byte_arr, format='WEBP', quality=60, method=2)
+        else:
+            img.save(img_byte_arr, format='PNG', bits=2)
+
+        return code, img_byte_arr.getvalue()
+
+
+_renderer = None
+_renderer_options = {}
+
+
+def configure_renderer(font_path: str | None = None, image_format: str = 'png'):
+    # 作為進程池的 initializer，在每個工作進程中預先建立素材快取
+    global _renderer, _renderer_options
+    _renderer_options = {'font_path': font_path, 'image_format': image_format}
+    _renderer = CaptchaRenderer(**_renderer_options)
+
+
+def render_captcha() -> tuple[str, bytes]:
+    global _renderer
+    if _renderer is None:
+        _renderer = CaptchaRenderer(**_renderer_options)
+    return _renderer.render()
+
+
+def _captcha_mac(secret: bytes, user_id: int, expires: int, code: str) -> bytes:
+    message = f"{user_id}:{expires}:{code}".encode()
+    return hmac.new(secret, message, hashlib.sha256).digest()[:16]
+
+
+def issue_captcha_token(secret: bytes, user_id: int, code: str, ttl: int) -> str:
+    # token 只包含到期時間與簽名，不含驗證碼本身
+    expires = int(time()) + ttl
+    mac = base64.urlsafe_b64encode(_captcha_mac(secret, user_id, expires, code)).decode().rstrip('=')
+    return f"{expires}.{mac}"
+
+
+def verify_captcha_token(secret: bytes, token: str, user_id: int, answer: str) -> bool:
+    try:
+        expires_str, mac = token.split('.', 1)
+        expires = int(expires_str)
+        expected_mac = base64.urlsafe_b64decode(mac + '=' * (-len(mac) % 4))
+    except (ValueError, TypeError):
+        return False
+
+    if time() > expires:
+        return False
+
+    # 以使用者輸入重新計算簽名，並使用固定時間比較
+    return hmac.compare_digest(_captcha_mac(secret, user_id, expires, answer), expected_mac)
+
+
+class CaptchaPool:
+    # 預渲染驗證碼池：背景任務透過進程池/執行緒池補貨，事件循環只負責取用
+
+    def __init__(self, size: int, low_watermark: int, workers: int | None = None, use_processes: bool = True,
+                 font_path: str | None = None, image_format: str = 'png'):
+        self.size = max(size, 0)
+        self.low_watermark = min(max(low_watermark, 0), self.size)
+        self._workers = workers
+        self._use_processes = use_processes
+        self._renderer_args = (font_path, image_format)
+        self._pool = deque()
+        self._executor = None
+        self._refill_needed = asyncio.Event()
+        self._task = None
+
+    def __len__(self) -> int:
+        return len(self._pool)
+
+    async def start(self):
+        if self._use_processes:
+            # 啟動時寫入執行緒等背景執行緒已在運行，fork 會複製它們持有的鎖；改由 forkserver（無則 spawn）建立子進程
+            start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            self._executor = ProcessPoolExecutor(
+                max_workers=self._workers,
+                mp_context=multiprocessing.get_context(start_method),
+                initializer=configure_renderer,
+                initargs=self._renderer_args
+            )
+        else:
+            # 執行緒共用同一份素材快取，先在此建立
+            configure_renderer(*self._renderer_args)
+            self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='captcha')
+
+        if self.size:
+            self._task = asyncio.create_task(self._refill_loop())
+            self._refill_needed.set()
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+        self._pool.clear()
+
+    async def get(self) -> tuple[str, bytes]:
+        if self._pool:
+            item = self._pool.popleft()
+            if len(self._pool) < self.low_watermark:
+                self._refill_needed.set()
+            return item
+
+        # 池已空，在事件循環外即時渲染
+        self._refill_needed.set()
+        return await self._render()
+
+    async def _render(self) -> tuple[str, bytes]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, render_captcha)
+
+    async def _refill_loop(self):
+        batch_size = max(self._workers or 4, 1)
+
+        while True:
+            await self._refill_needed.wait()
+            self._refill_needed.clear()
+
+            while len(self._pool) < self.size:
+                batch = min(self.size - len(self._pool), batch_size)
+                results = await asyncio.gather(
+                    *(self._render() for _ in range(batch)),
+                    return_exceptions=True
+                )
+
+                failed = 0
+                for result in results:
+                    if isinstance(result, Exception):
+                        failed += 1
+                        logging.error(f"Error rendering captcha: {result}")
+                    elif len(self._pool) < self.size:
+                        self._pool.append(result)
+
+                # 全部失敗時稍作等待，避免忙碌重試
+                if failed == batch:
+                    await asyncio.sleep(1)
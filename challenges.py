@@ -0,0 +1,149 @@
+import random
+import secrets
+from collections import deque
+from time import time
+
+from captcha import CAPTCHA_LENGTH
+
+# 驗證方式，由弱到強：
+#   keyboard：以按鈕作答的文字題目，不需要渲染或上傳圖片
+#   cached：重複發送已上傳過的驗證碼圖片，只傳 Telegram file_id
+#   full：渲染並上傳新的驗證碼圖片
+TIERS = ('keyboard', 'cached', 'full')
+
+# 以 emoji 數字鍵帽顯示題目，按鈕上是一般數字
+_KEYCAPS = {digit: f"{digit}️⃣" for digit in '0123456789'}
+
+
+def keyboard_challenge(choices: int = 6) -> tuple[str, str, list[tuple[str, str]]]:
+    # 回傳 (正確選項的 ID, 題目文字, 打亂順序的 (按鈕文字, 選項 ID))；選項中只有一個與題目相同。
+    # 按鈕的回呼資料只帶隨機的選項 ID，答案由伺服器保存的 ID 比對，不能直接從回呼資料讀出
+    code = ''.join(random.choices('0123456789', k=CAPTCHA_LENGTH))
+    labels = {code}
+    while len(labels) < choices:
+        labels.add(''.join(random.choices('0123456789', k=CAPTCHA_LENGTH)))
+    options = [(label, secrets.token_hex(4)) for label in labels]
+    random.shuffle(options)
+    answer = next(option_id for label, option_id in options if label == code)
+    return answer, ' '.join(_KEYCAPS[digit] for digit in code), options
+
+
+class ImageLibrary:
+    # 已上傳過的驗證碼圖片（驗證碼、file_id、已使用次數），再次發送時只需傳 file_id，不必重新渲染與上傳；
+    # 每張圖片最多使用 max_reuse 次後淘汰，由新上傳的圖片補上，避免答案被收集後重複使用
+
+    def __init__(self, size: int, max_reuse: int):
+        self.size = max(size, 0)
+        self.max_reuse = max(max_reuse, 1)
+        self._entries = []
+        self.retired = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def full(self) -> bool:
+        return len(self._entries) >= self.size
+
+    def add(self, code: str, file_id: str):
+        if not self.full:
+            self._entries.append([code, file_id, 0])
+
+    def pick(self) -> tuple[str, str] | None:
+        if not self._entries:
+            return None
+        index = random.randrange(len(self._entries))
+        entry = self._entries[index]
+        entry[2] += 1
+        if entry[2] >= self.max_reuse:
+            # 與最後一項交換後移除，O(1)
+            self._entries[index] = self._entries[-1]
+            self._entries.pop()
+            self.retired += 1
+        return entry[0], entry[1]
+
+
+class ChallengeEngine:
+    # 依負載與失敗率選擇驗證方式：adaptive 模式下負載低時使用完整的圖片驗證碼，
+    # 每秒開始的驗證數超過 cached_above 時改為重複發送已上傳的圖片；
+    # 按鈕題目容易被程式自動作答，只有設定 keyboard_above（大於 0）時才會在每秒開始數超過此值時使用。
+    # 某個方式最近的失敗率超過 escalate_failure_rate（可能是自動化程式在猜答案）時改用更強的方式。
+    # 曾經答錯的用戶（可疑用戶）一律使用完整的圖片驗證碼
+
+    def __init__(self, mode: str = 'adaptive', cached_above: float = 5.0, keyboard_above: float = 0.0,
+                 escalate_failure_rate: float = 0.3, window: float = 30.0, min_samples: int = 20,
+                 library_size: int = 500, max_reuse: int = 20):
+        if mode != 'adaptive' and mode not in TIERS:
+            raise ValueError(f"Unknown challenge mode {mode!r}")
+        self.mode = mode
+        self.cached_above = cached_above
+        self.keyboard_above = keyboard_above
+        self.escalate_failure_rate = escalate_failure_rate
+        self.window = window
+        self.min_samples = min_samples
+        self.images = ImageLibrary(library_size, max_reuse)
+
+        # 最近 window 秒內開始驗證的時間，以及各方式的作答結果 (時間, 是否答錯)
+        self._starts = deque()
+        self._results = {tier: deque() for tier in TIERS}
+        # 各方式在 _results 中答錯的筆數，計算失敗率時不需要逐筆加總
+        self._failures = dict.fromkeys(TIERS, 0)
+
+        # 統計
+        self.issued = dict.fromkeys(TIERS, 0)
+
+    def start_rate(self, now: float | None = None) -> float:
+        # 最近 window 秒內平均每秒開始的驗證數
+        now = time() if now is None else now
+        cutoff = now - self.window
+        while self._starts and self._starts[0] < cutoff:
+            self._starts.popleft()
+        return len(self._starts) / self.window
+
+    def _trim_results(self, tier: str, now: float) -> deque:
+        results = self._results[tier]
+        cutoff = now - self.window
+        while results and results[0][0] < cutoff:
+            if results.popleft()[1]:
+                self._failures[tier] -= 1
+        return results
+
+    def failure_rate(self, tier: str, now: float | None = None) -> float | None:
+        # 樣本不足時回傳 None
+        results = self._trim_results(tier, time() if now is None else now)
+        if len(results) < self.min_samples:
+            return None
+        return self._failures[tier] / len(results)
+
+    def choose(self, suspicious: bool = False) -> str:
+        now = time()
+        self._starts.append(now)
+        rate = self.start_rate(now)
+
+        if suspicious:
+            tier = 'full'
+        elif self.mode != 'adaptive':
+            tier = self.mode
+        else:
+            if self.keyboard_above > 0 and rate >= self.keyboard_above:
+                level = 0
+            else:
+                level = 1 if rate >= self.cached_above else 2
+            while level < 2:
+                failures = self.failure_rate(TIERS[level], now)
+                if failures is None or failures <= self.escalate_failure_rate:
+                    break
+                level += 1
+            tier = TIERS[level]
+
+        # 圖片庫還是空的時只能上傳新圖片
+        if tier == 'cached' and not self.images:
+            tier = 'full'
+        self.issued[tier] += 1
+        return tier
+
+    def record(self, tier: str, passed: bool):
+        now = time()
+        self._trim_results(tier, now).append((now, not passed))
+        if not passed:
+            self._failures[tier] += 1
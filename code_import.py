@@ -0,0 +1,101 @@
+import asyncio
+import csv
+import os
+import re
+from time import time
+
+MAX_CODE_LENGTH = 64
+_VALID_CODE = re.compile(r'^\S+$')
+_HEADER_NAMES = {'code', 'codes', 'invite_code', '邀請碼'}
+
+
+class ImportResult:
+    __slots__ = ('lines', 'added', 'duplicates', 'invalid', 'elapsed', 'rejected_path')
+
+    def __init__(self):
+        self.lines = 0
+        self.added = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.elapsed = 0.0
+        self.rejected_path = None
+
+    @property
+    def rejected(self) -> int:
+        return self.duplicates + self.invalid
+
+
+def _parse_line(row: list[str]) -> tuple[str | None, str | None]:
+    # TXT 每行一個邀請碼；CSV 取第一欄
+    code = row[0].strip() if row else ''
+    if not code:
+        return None, None
+    if len(code) > MAX_CODE_LENGTH or not _VALID_CODE.match(code):
+        return None, 'invalid'
+    return code, None
+
+
+async def import_codes_file(path: str, add_codes, rejected_path: str, batch_size: int = 5000,
+                            on_progress=None, progress_interval: float = 2.0) -> ImportResult:
+    # 逐批讀取檔案並與現有邀請碼去重，每批之間讓出事件循環；
+    # 被拒絕的行以 CSV 寫入 rejected_path（行號、原因、內容）
+    result = ImportResult()
+    total_size = os.path.getsize(path) or 1
+    read_size = 0
+    start = last_progress = time()
+
+    def count_lines(source):
+        # 文字模式迭代時無法使用 tell()，以讀取的字元數估算進度
+        nonlocal read_size
+        for line in source:
+            read_size += len(line)
+            yield line
+
+    with open(path, newline='', encoding='utf-8-sig', errors='replace') as source, \
+            open(rejected_path, 'w', newline='', encoding='utf-8') as rejected_file:
+        rejected_writer = csv.writer(rejected_file)
+        reader = csv.reader(count_lines(source))
+
+        while True:
+            batch = []
+            rows = 0
+            for row in reader:
+                rows += 1
+                result.lines += 1
+                # 略過標題列
+                if result.lines == 1 and row and row[0].strip().lower() in _HEADER_NAMES:
+                    continue
+                code, reason = _parse_line(row)
+                if reason:
+                    result.invalid += 1
+                    rejected_writer.writerow([result.lines, reason, ','.join(row)])
+                elif code:
+                    batch.append((result.lines, code))
+                if rows >= batch_size:
+                    break
+
+            if batch:
+                # 整批去重：已存在或檔案內重複的邀請碼不會被加入
+                added = set(await add_codes([code for _, code in batch]))
+                for line_no, code in batch:
+                    if code in added:
+                        added.discard(code)
+                        result.added += 1
+                    else:
+                        result.duplicates += 1
+                        rejected_writer.writerow([line_no, 'duplicate', code])
+
+            now = time()
+            if on_progress and now - last_progress >= progress_interval:
+                last_progress = now
+                await on_progress(result, min(read_size / total_size, 1.0), now - start)
+
+            if rows < batch_size:
+                break
+
+            await asyncio.sleep(0)
+
+    result.elapsed = time() - start
+    if result.rejected:
+        result.rejected_path = rejected_path
+    return result
@@ -0,0 +1,162 @@
+import argparse
+import csv
+import hashlib
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+
+# 檔案格式（little-endian）：
+#   標頭：magic、邀請碼數量、Bloom filter 位元數、雜湊函數數量
+#   Bloom filter 位元組
+#   排序後的 64-bit 邀請碼雜湊
+# 已使用的邀請碼另外記錄在 <index>.used 的位元圖中
+_MAGIC = b'TGCIDX01'
+_HEADER = struct.Struct('<8sQQQ')
+
+
+def code_hash(code: str) -> int:
+    return int.from_bytes(hashlib.blake2b(code.encode(), digest_size=8).digest(), 'little')
+
+
+def _bloom_positions(h: int, bits: int, k: int):
+    # 由同一個 64-bit 雜湊以雙重雜湊法推導 k 個位置
+    h1 = h & 0xFFFFFFFF
+    h2 = (h >> 32) | 1
+    return ((h1 + i * h2) % bits for i in range(k))
+
+
+def build_index(codes, index_path: str, bits_per_code: int = 10, k: int = 7) -> int:
+    hashes = array('Q', sorted({code_hash(code) for code in codes}))
+    count = len(hashes)
+
+    bloom_bits = max(count * bits_per_code, 64)
+    bloom_bits += -bloom_bits % 64
+    bloom = bytearray(bloom_bits // 8)
+    for h in hashes:
+        for position in _bloom_positions(h, bloom_bits, k):
+            bloom[position >> 3] |= 1 << (position & 7)
+
+    if sys.byteorder != 'little':
+        hashes.byteswap()
+
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, count, bloom_bits, k))
+        f.write(bloom)
+        hashes.tofile(f)
+    os.replace(tmp_path, index_path)
+
+    # 重建索引時一併重置已使用紀錄
+    used_path = index_path + '.used'
+    if os.path.exists(used_path):
+        os.remove(used_path)
+
+    return count
+
+
+def read_codes(path: str):
+    # 每行一個邀請碼，CSV 取第一欄
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.reader(f):
+            if row and row[0].strip():
+                yield row[0].strip()
+
+
+class CodeIndex:
+    # 唯讀記憶體映射的邀請碼索引：先以 Bloom filter 快速排除無效邀請碼，
+    # 再在排序的雜湊陣列上二分搜尋（O(log n)），已使用的邀請碼記錄在可寫入的位元圖中
+
+    def __init__(self, path: str):
+        if sys.byteorder != 'little':
+            raise RuntimeError("CodeIndex requires a little-endian host")
+
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.count, self._bloom_bits, self._k = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not an invite code index")
+
+        offset = _HEADER.size
+        view = memoryview(self._mm)
+        self._bloom = view[offset:offset + self._bloom_bits // 8]
+        offset += self._bloom_bits // 8
+        self._hashes = view[offset:offset + self.count * 8].cast('Q')
+
+        # 已使用位元圖
+        used_path = path + '.used'
+        used_size = max((self.count + 7) // 8, 1)
+        with open(used_path, 'ab') as f:
+            if f.tell() < used_size:
+                f.truncate(used_size)
+        self._used_file = open(used_path, 'r+b')
+        self._used = mmap.mmap(self._used_file.fileno(), used_size, access=mmap.ACCESS_WRITE)
+        self.used = int.from_bytes(self._used, 'little').bit_count()
+
+    def close(self):
+        self._hashes.release()
+        self._bloom.release()
+        self._mm.close()
+        self._file.close()
+        self._used.flush()
+        self._used.close()
+        self._used_file.close()
+
+    def __len__(self) -> int:
+        return self.count - self.used
+
+    def _find(self, code: str) -> int:
+        h = code_hash(code)
+        for position in _bloom_positions(h, self._bloom_bits, self._k):
+            if not self._bloom[position >> 3] & (1 << (position & 7)):
+                return -1
+
+        i = bisect_left(self._hashes, h)
+        if i < self.count and self._hashes[i] == h:
+            return i
+        return -1
+
+    def _is_used(self, i: int) -> bool:
+        return bool(self._used[i >> 3] & (1 << (i & 7)))
+
+    def __contains__(self, code: str) -> bool:
+        i = self._find(code)
+        return i >= 0 and not self._is_used(i)
+
+    def knows(self, code: str) -> bool:
+        # 邀請碼是否在索引中，不論是否已使用
+        return self._find(code) >= 0
+
+    def consume(self, code: str) -> bool:
+        # 檢查與標記之間沒有 await，在事件循環中是原子操作
+        i = self._find(code)
+        if i < 0 or self._is_used(i):
+            return False
+        self._used[i >> 3] |= 1 << (i & 7)
+        self.used += 1
+        return True
+
+    def restore(self, code: str):
+        i = self._find(code)
+        if i >= 0 and self._is_used(i):
+            self._used[i >> 3] &= ~(1 << (i & 7)) & 0xFF
+            self.used -= 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build a memory-mapped invite code index')
+    parser.add_argument('source', help='TXT/CSV file with one invite code per line')
+    parser.add_argument('index', help='output index path')
+    parser.add_argument('--bits-per-code', type=int, default=10)
+    args = parser.parse_args()
+
+    count = build_index(read_codes(args.source), args.index, bits_per_code=args.bits_per_code)
+    print(f"Indexed {count} invite codes into {args.index} ({os.path.getsize(args.index)} bytes)")
+
+
+if __name__ == '__main__':
+    main()
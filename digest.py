@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import secrets
+from collections import OrderedDict
+
+
+class AdminDigest:
+    # 在時間窗口內收集新的待審核請求，窗口結束時合併成一則摘要訊息送出；
+    # 只保留最近 max_digests 份摘要供按鈕回呼使用
+
+    def __init__(self, window: float, max_digests: int = 100):
+        self.window = window
+        self.max_digests = max_digests
+        self.bot = None
+        self._on_flush = None
+        self.digests = OrderedDict()
+        self._buffer = []
+        self._timer = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def __len__(self) -> int:
+        # 等待送出的請求數
+        return len(self._buffer)
+
+    async def start(self, bot, on_flush):
+        # on_flush(bot, digest_id, user_ids) 負責送出摘要訊息
+        self.bot = bot
+        self._on_flush = on_flush
+
+    def add(self, user_id: int):
+        self._buffer.append(user_id)
+        if self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    def get(self, digest_id: str) -> list[int] | None:
+        return self.digests.get(digest_id)
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        if not self._buffer:
+            return
+
+        user_ids, self._buffer = list(dict.fromkeys(self._buffer)), []
+        # 摘要只保存在記憶體中，以隨機 ID 識別：重新啟動後舊摘要的按鈕不會對應到新的摘要，只會顯示已過期
+        digest_id = secrets.token_hex(4)
+        while digest_id in self.digests:
+            digest_id = secrets.token_hex(4)
+        self.digests[digest_id] = user_ids
+        while len(self.digests) > self.max_digests:
+            self.digests.popitem(last=False)
+
+        try:
+            await self._on_flush(self.bot, digest_id, user_ids)
+        except Exception as e:
+            logging.error(f"Error sending admin digest: {e}")
+
+    async def stop(self):
+        if self._timer:
+            self._timer.cancel()
+            try:
+                await self._timer
+            except asyncio.CancelledError:
+                pass
+            self._timer = None
+
+        # 關閉前送出尚未送出的請求
+        await self.flush()
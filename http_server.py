@@ -0,0 +1,165 @@
+import asyncio
+import logging
+from http import HTTPStatus
+
+MAX_HEADER_LINES = 100
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int):
+        super().__init__(HTTPStatus(status).phrase)
+        self.status = status
+
+
+class HTTPRequest:
+    __slots__ = ('method', 'path', 'query', 'headers', 'body')
+
+    def __init__(self, method: str, path: str, query: str, headers: dict[str, str], body: bytes):
+        self.method = method
+        self.path = path
+        self.query = query
+        # 標頭名稱一律小寫
+        self.headers = headers
+        self.body = body
+
+
+class HTTPServer:
+    # 以 asyncio streams 實作的精簡 HTTP/1.1 伺服器：支援 keep-alive 與 Content-Length 請求本文，
+    # 限制同時連線數與本文大小；關閉時先停止接受新連線，閒置連線立即關閉，處理中的請求在期限內完成。
+    # handler(request) 回傳 (status, content_type, body)
+
+    def __init__(self, handler, listen: str = '127.0.0.1', port: int = 8080, max_connections: int = 100,
+                 max_body_size: int = 1024 * 1024, keepalive_timeout: float = 75):
+        self.handler = handler
+        self.listen = listen
+        self.port = port
+        self.max_connections = max_connections
+        self.max_body_size = max_body_size
+        self.keepalive_timeout = keepalive_timeout
+
+        self._server = None
+        self._closing = False
+        # 連線任務 -> 是否正在處理請求
+        self._connections = {}
+
+        # 統計
+        self.requests = 0
+        self.rejected = 0
+
+    async def start(self):
+        self._closing = False
+        self._server = await asyncio.start_server(self._serve, self.listen, self.port)
+        # port 為 0 時使用系統分配的埠
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self, timeout: float = 10):
+        if self._server is None:
+            return
+        self._closing = True
+        self._server.close()
+
+        for task, busy in list(self._connections.items()):
+            if not busy:
+                task.cancel()
+        if self._connections:
+            _, remaining = await asyncio.wait(list(self._connections), timeout=timeout)
+            for task in remaining:
+                task.cancel()
+            await asyncio.gather(*remaining, return_exceptions=True)
+
+        await self._server.wait_closed()
+        self._server = None
+
+    @staticmethod
+    async def _readline(reader: asyncio.StreamReader, status: int) -> bytes:
+        # 超過 StreamReader 緩衝上限的行以 status 回應
+        try:
+            return await reader.readline()
+        except (ValueError, asyncio.LimitOverrunError):
+            raise HTTPError(status)
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> HTTPRequest | None:
+        line = await self._readline(reader, 400)
+        if not line:
+            return None
+        try:
+            method, target, _ = line.decode('latin-1').split()
+        except ValueError:
+            raise HTTPError(400)
+
+        headers = {}
+        for _ in range(MAX_HEADER_LINES):
+            line = await self._readline(reader, 431)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        else:
+            raise HTTPError(431)
+
+        if 'chunked' in headers.get('transfer-encoding', ''):
+            raise HTTPError(411)
+        try:
+            length = int(headers.get('content-length', '0'))
+        except ValueError:
+            raise HTTPError(400)
+        if length > self.max_body_size:
+            raise HTTPError(413)
+        body = await reader.readexactly(length) if length else b''
+
+        path, _, query = target.partition('?')
+        return HTTPRequest(method.upper(), path, query, headers, body)
+
+    @staticmethod
+    def _write_response(writer: asyncio.StreamWriter, status: int, content_type: str, body: bytes, keep_alive: bool):
+        writer.write(
+            f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + body
+        )
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        if len(self._connections) >= self.max_connections or self._closing:
+            self.rejected += 1
+            self._write_response(writer, 503, 'text/plain', b'', keep_alive=False)
+            writer.close()
+            return
+
+        self._connections[task] = False
+        try:
+            while not self._closing:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), self.keepalive_timeout)
+                except HTTPError as e:
+                    self._write_response(writer, e.status, 'text/plain', str(e).encode(), keep_alive=False)
+                    break
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if request is None:
+                    break
+
+                self._connections[task] = True
+                self.requests += 1
+                try:
+                    status, content_type, body = await self.handler(request)
+                except HTTPError as e:
+                    status, content_type, body = e.status, 'text/plain', str(e).encode()
+                except Exception as e:
+                    logging.error(f"Error handling HTTP request {request.method} {request.path}: {e}")
+                    status, content_type, body = 500, 'text/plain', b''
+
+                keep_alive = not self._closing and request.headers.get('connection', '').lower() != 'close'
+                self._write_response(writer, status, content_type, body, keep_alive)
+                await writer.drain()
+                self._connections[task] = False
+                if not keep_alive:
+                    break
+        except asyncio.CancelledError:
+            pass
+        except ConnectionError:
+            pass
+        finally:
+            self._connections.pop(task, None)
+            writer.close()
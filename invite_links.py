@@ -0,0 +1,148 @@
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+from outbound import PRIORITY_BACKGROUND
+
+
+class InviteLinkPool:
+    # 預先建立的一次性邀請連結池：背景任務在低於水位時補貨，審核時直接取用，
+    # 已發出的連結會被追蹤，快過期的庫存連結、逾時未使用的已發出連結與關閉時剩餘的庫存連結會被撤銷
+
+    def __init__(self, chat_id, size: int, low_watermark: int, link_ttl: int, timers, min_remaining: int = 3600,
+                 maintenance_interval: int = 60, unused_ttl: int | None = None):
+        self.chat_id = chat_id
+        self.size = max(size, 0)
+        self.low_watermark = min(max(low_watermark, 0), self.size)
+        self.link_ttl = timedelta(seconds=link_ttl)
+        # 發出的連結至少要還有這麼久才過期
+        self.min_remaining = timedelta(seconds=min(min_remaining, link_ttl // 2))
+        self.maintenance_interval = maintenance_interval
+        # 已發出的連結在這段時間內未被使用就撤銷，預設等於連結有效期
+        self.unused_ttl = min(unused_ttl or link_ttl, link_ttl)
+        self.timers = timers
+
+        self.bot = None
+        self._pool = deque()
+        # 已發出但尚未使用的連結：invite_link -> (user_id, expire_date)
+        self.issued = {}
+        self._stale = []
+        self._refill_needed = asyncio.Event()
+        self._task = None
+
+        # 統計
+        self.hits = 0
+        self.misses = 0
+        self.revoked = 0
+
+    def __len__(self) -> int:
+        return len(self._pool)
+
+    async def start(self, bot):
+        self.bot = bot
+        if self.size:
+            self._task = asyncio.create_task(self._refill_loop())
+            self._refill_needed.set()
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        # 撤銷尚未發出的庫存連結，避免外流
+        links = list(self._pool)
+        self._pool.clear()
+        await asyncio.gather(*(self._revoke(link.invite_link) for link in links), return_exceptions=True)
+
+    async def _create(self, priority=None):
+        return await self.bot.create_chat_invite_link(
+            chat_id=self.chat_id,
+            member_limit=1,
+            expire_date=datetime.now(timezone.utc) + self.link_ttl,
+            rate_limit_args={'priority': priority} if priority is not None else None
+        )
+
+    async def _revoke(self, invite_link: str):
+        try:
+            await self.bot.revoke_chat_invite_link(
+                chat_id=self.chat_id,
+                invite_link=invite_link,
+                rate_limit_args={'priority': PRIORITY_BACKGROUND}
+            )
+            self.revoked += 1
+        except Exception as e:
+            logging.error(f"Error revoking invite link: {e}")
+
+    async def acquire(self, user_id: int) -> str:
+        now = datetime.now(timezone.utc)
+
+        link = None
+        while self._pool:
+            candidate = self._pool.popleft()
+            if candidate.expire_date and candidate.expire_date - now < self.min_remaining:
+                # 快過期的庫存連結交給背景任務撤銷
+                self._stale.append(candidate.invite_link)
+                self._refill_needed.set()
+                continue
+            link = candidate
+            break
+
+        if len(self._pool) < self.low_watermark:
+            self._refill_needed.set()
+
+        if link is None:
+            # 池已空，直接建立
+            self.misses += 1
+            link = await self._create()
+        else:
+            self.hits += 1
+
+        self.issued[link.invite_link] = (user_id, link.expire_date)
+        self.timers.schedule(('invite_link', link.invite_link), self.unused_ttl, self._expire_issued, link.invite_link)
+        return link.invite_link
+
+    def mark_used(self, invite_link: str) -> int | None:
+        # 連結被使用後不再追蹤，回傳取得此連結的用戶 ID
+        issued = self.issued.pop(invite_link, None)
+        if issued is None:
+            return None
+        self.timers.cancel(('invite_link', invite_link))
+        return issued[0]
+
+    async def _expire_issued(self, invite_link: str):
+        issued = self.issued.pop(invite_link, None)
+        if issued is None:
+            return
+        # 連結本身已過期時只需停止追蹤
+        _, expire_date = issued
+        if expire_date is None or expire_date > datetime.now(timezone.utc):
+            await self._revoke(invite_link)
+
+    async def _refill_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._refill_needed.wait(), timeout=self.maintenance_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._refill_needed.clear()
+
+            # 撤銷庫存中快過期的連結
+            now = datetime.now(timezone.utc)
+            while self._pool and self._pool[0].expire_date - now < self.min_remaining:
+                self._stale.append(self._pool.popleft().invite_link)
+            stale, self._stale = self._stale, []
+            for invite_link in stale:
+                await self._revoke(invite_link)
+
+            while len(self._pool) < self.size:
+                try:
+                    self._pool.append(await self._create(priority=PRIORITY_BACKGROUND))
+                except Exception as e:
+                    logging.error(f"Error pre-creating invite link: {e}")
+                    await asyncio.sleep(5)
+                    break
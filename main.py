@@ -1,19 +1,41 @@
 import logging
 import os
 import asyncio
-import random
+import hmac
 import io
+import csv
+import secrets
+import signal
+import tempfile
+from collections import Counter
+from functools import partial, wraps
 from datetime import datetime
-from collections import deque, defaultdict
-from time import time
-from PIL import Image, ImageDraw, ImageFont
+from time import perf_counter, time
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, filters, 
-    ContextTypes, CallbackQueryHandler, ConversationHandler
+    ContextTypes, CallbackQueryHandler, ConversationHandler, ChatMemberHandler, ChatJoinRequestHandler, TypeHandler
 )
 from telegram.constants import ParseMode
+from telegram.error import BadRequest
+from telegram.request import BaseRequest
 from dotenv import load_dotenv
+from captcha import CaptchaPool, issue_captcha_token, verify_captcha_token
+from challenges import ChallengeEngine, keyboard_challenge
+from storage import StateStore
+from state_backend import MemoryBackend, RedisBackend
+from ratelimit import AdmissionController
+from outbound import OutboundQueue
+from update_processor import BoundedUpdateQueue, UserOrderedUpdateProcessor
+from invite_links import InviteLinkPool
+from code_import import import_codes_file
+from code_index import CodeIndex
+from digest import AdminDigest
+from timer_wheel import TimerWheel
+from webhook import WebhookServer
+from metrics import MetricsRegistry, MetricsServer, timed
+from audit import AuditLog
+from tenants import TenantRegistry
 
 load_dotenv()
 
@@ -21,93 +43,430 @@ load_dotenv()
 TYPING_CAPTCHA = 1
 TYPING_INVITE_CODE = 2
 
-# 存儲待審核用戶
-pending_users = {}
+# 大量活動用的唯讀邀請碼索引（由 `python -m code_index` 建立），不需要載入到記憶體；
+# 多群組時改在 TENANTS_FILE 中為各群組設定
+CODE_INDEX_PATH = os.getenv('CODE_INDEX_PATH')
 
-# 存儲有效的邀請碼
-valid_invite_codes = set()
+# 所有到期事件（驗證碼、閒置對話、待審核請求、已發出的邀請連結）共用的分層時間輪
+expiry = TimerWheel(tick=1.0)
 
-# 存儲驗證碼
-captcha_codes = {}
+# 驗證碼模式：memory 將驗證碼保存在狀態後端（STATE_BACKEND=redis 時所有實例共用）；
+# token 將 HMAC 簽名的到期 token 隨對話紀錄保存（STATE_BACKEND=redis 時同樣由所有實例共用），對話結束時一併清除
+CAPTCHA_MODE = os.getenv('CAPTCHA_MODE', 'memory')
+CAPTCHA_TTL = int(os.getenv('CAPTCHA_TTL', '300'))  # 驗證碼有效秒數
+CAPTCHA_SECRET = os.getenv('CAPTCHA_SECRET', '').encode()
 
-# 添加用戶嘗試次數限制
-user_attempts = defaultdict(int)
-attempt_timestamps = defaultdict(float)
+# 對話在等待輸入驗證碼或邀請碼時閒置超過此秒數即結束
+CONVERSATION_TIMEOUT = int(os.getenv('CONVERSATION_TIMEOUT', '600'))
+
+# 待審核請求逾時：先提醒管理員，再自動拒絕（秒，0 表示停用）
+PENDING_REMIND_AFTER = int(os.getenv('PENDING_REMIND_AFTER', '0'))
+PENDING_EXPIRE_AFTER = int(os.getenv('PENDING_EXPIRE_AFTER', '0'))
+
+# 添加用戶嘗試次數限制（紀錄在 ATTEMPT_RESET_TIME 後自動過期並清除）
 MAX_ATTEMPTS = 3
 ATTEMPT_RESET_TIME = 3600  # 1小時
 
-# 添加請求頻率限制
-user_requests = defaultdict(lambda: deque(maxlen=MAX_REQUESTS))
+# 添加請求頻率限制：每位用戶一個令牌桶，容量 MAX_REQUESTS，每 REQUEST_WINDOW 秒補滿
 REQUEST_WINDOW = 60  # 60秒
 MAX_REQUESTS = 5  # 每個時間窗口最大請求數
 
+# 共享狀態後端：memory 保存在本進程並寫入 SQLite（單一實例）；
+# redis 讓多個機器人實例共用邀請碼、待審核用戶、驗證碼、嘗試次數、頻率限制與對話狀態
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory')
+if STATE_BACKEND == 'redis':
+    backend = RedisBackend(
+        os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+        prefix=os.getenv('REDIS_PREFIX', 'tgverify:'),
+        attempt_ttl=ATTEMPT_RESET_TIME,
+        max_connections=int(os.getenv('REDIS_MAX_CONNECTIONS', '50'))
+    )
+else:
+    backend = MemoryBackend(StateStore(os.getenv('STATE_DB', 'bot_state.db')), expiry, attempt_ttl=ATTEMPT_RESET_TIME)
+CONVERSATION_NAME = 'verification'  # 對話狀態在後端中的名稱
+
+# 群組設定：設定 TENANTS_FILE 時從 JSON 檔載入多個群組（見 README「多群組」），否則以 GROUP_ID / ADMIN_ID 設定單一群組。
+# 驗證碼、嘗試次數、頻率限制與對話狀態以用戶為單位，所有群組共用 backend；邀請碼與待審核用戶則各群組獨立
+TENANTS_FILE = os.getenv('TENANTS_FILE')
+if TENANTS_FILE:
+    tenants = TenantRegistry.from_file(TENANTS_FILE)
+else:
+    tenants = TenantRegistry.single(os.getenv('GROUP_ID'), os.getenv('ADMIN_ID'), CODE_INDEX_PATH)
+
+# 稽核紀錄：邀請碼使用、驗證碼錯誤、審核結果與邀請連結發放等事件，批次寫入輪替的壓縮 JSONL 分段
+audit = AuditLog(
+    os.getenv('AUDIT_DIR', 'audit_log'),
+    segment_events=int(os.getenv('AUDIT_SEGMENT_EVENTS', '100000')),  # 每個分段的事件數
+    max_segments=int(os.getenv('AUDIT_MAX_SEGMENTS', '100'))  # 保留的分段數，超過時刪除最舊的分段
+)
+AUDIT_QUERY_LIMIT = 30  # /audit 最多顯示的事件數
+AUDIT_EVENT_LABELS = {
+    'captcha_failed': '❌ 驗證碼錯誤',
+    'code_used': '🎫 使用邀請碼',
+    'pending': '⏳ 提交審核',
+    'approved': '✅ 審核通過',
+    'rejected': '🚫 審核拒絕',
+    'expired': '⌛ 審核逾時',
+    'link_issued': '🔗 發出邀請連結',
+    'link_used': '👥 透過連結入群',
+    'join_requested': '📨 申請入群',
+    'join_approved': '✅ 批准入群申請',
+    'join_declined': '🚫 拒絕入群申請',
+}
+
+# 檔案匯入邀請碼設定
+IMPORT_BATCH_SIZE = 5000  # 每批去重與寫入的行數
+MAX_IMPORT_FILE_SIZE = 20 * 1024 * 1024  # Telegram 機器人可下載的檔案上限
+
+# 列表分頁與匯出設定
+PENDING_PAGE_SIZE = 10  # 待審核列表每頁筆數
+CODES_PAGE_SIZE = 50  # 邀請碼列表每頁筆數
+EXPORT_BATCH_SIZE = 5000  # 匯出時每批寫入的筆數
+EXPORT_SPOOL_SIZE = 1024 * 1024  # 匯出檔案超過此大小時改寫入磁碟
+
+# 批量審核設定
+APPROVE_CONCURRENCY = int(os.getenv('APPROVE_CONCURRENCY', '10'))  # 同時處理的審核數
+APPROVE_PROGRESS_INTERVAL = 2  # 進度訊息更新間隔（秒）
+
+# 管理員摘要：在時間窗口內收集新的待審核請求，合併成一則訊息發送
+ADMIN_DIGEST_WINDOW = float(os.getenv('ADMIN_DIGEST_WINDOW', '0'))  # 秒，0 表示每個請求各自發送
+DIGEST_PAGE_SIZE = 10  # 摘要每頁筆數
+
+# 全域驗證准入：限制本實例每秒開始驗證的總數，超出時進入所屬群組的有界等待佇列，各群組輪流放行
+GLOBAL_VERIFY_RATE = float(os.getenv('GLOBAL_VERIFY_RATE', '20'))  # 每秒可開始的驗證數
+GLOBAL_VERIFY_BURST = int(os.getenv('GLOBAL_VERIFY_BURST', '50'))  # 瞬間可開始的驗證數
+VERIFY_QUEUE_SIZE = int(os.getenv('VERIFY_QUEUE_SIZE', '1000'))  # 每個群組的等待佇列上限，超出時直接拒絕
+
+admission = AdmissionController(
+    global_rate=GLOBAL_VERIFY_RATE,
+    global_burst=GLOBAL_VERIFY_BURST,
+    queue_size=VERIFY_QUEUE_SIZE
+)
+
+# 預渲染驗證碼池設定
+CAPTCHA_POOL_SIZE = int(os.getenv('CAPTCHA_POOL_SIZE', '200'))  # 池中最多保留的驗證碼數量
+CAPTCHA_POOL_LOW_WATERMARK = int(os.getenv('CAPTCHA_POOL_LOW_WATERMARK', '50'))  # 低於此數量時開始補貨
+CAPTCHA_WORKERS = int(os.getenv('CAPTCHA_WORKERS', str(os.cpu_count() or 2)))
+CAPTCHA_USE_PROCESSES = os.getenv('CAPTCHA_EXECUTOR', 'process') == 'process'  # process 或 thread
+CAPTCHA_FONT = os.getenv('CAPTCHA_FONT')  # 可選的 TTF 字型路徑，未設定時使用內建字型
+CAPTCHA_FORMAT = os.getenv('CAPTCHA_FORMAT', 'png')  # png 或 webp
+
+captcha_pool = CaptchaPool(
+    size=CAPTCHA_POOL_SIZE,
+    low_watermark=CAPTCHA_POOL_LOW_WATERMARK,
+    workers=CAPTCHA_WORKERS,
+    use_processes=CAPTCHA_USE_PROCESSES,
+    font_path=CAPTCHA_FONT,
+    image_format=CAPTCHA_FORMAT
+)
+
+# 驗證方式：adaptive 依負載與失敗率在按鈕題目（不需上傳圖片）、重複發送已上傳的圖片（只傳 file_id）
+# 與完整的圖片驗證碼之間切換；也可以固定為 keyboard、cached 或 full
+challenge_engine = ChallengeEngine(
+    mode=os.getenv('CHALLENGE_MODE', 'adaptive'),
+    cached_above=float(os.getenv('CHALLENGE_CACHED_ABOVE', '5')),  # 每秒開始的驗證數超過此值時重複發送已上傳的圖片
+    keyboard_above=float(os.getenv('CHALLENGE_KEYBOARD_ABOVE', '0')),  # 超過此值時改用按鈕題目（0 表示不使用）
+    escalate_failure_rate=float(os.getenv('CHALLENGE_ESCALATE_FAILURE_RATE', '0.3')),  # 失敗率超過此值時改用更強的方式
+    library_size=int(os.getenv('CHALLENGE_LIBRARY_SIZE', '500')),  # 保留的已上傳圖片數
+    max_reuse=int(os.getenv('CHALLENGE_IMAGE_REUSE', '20'))  # 每張已上傳的圖片最多發送的次數
+)
+
+# 對外發送佇列：所有 Bot API 呼叫經此排隊，遵守 Telegram 的全域與各聊天室限制
+outbound = OutboundQueue(
+    admin_chat_ids=[*tenants.by_admin, *(tenant.review_chat_id for tenant in tenants)],
+    global_rate=float(os.getenv('OUTBOUND_GLOBAL_RATE', '30')),  # 每秒最多發送數
+    max_retries=int(os.getenv('OUTBOUND_MAX_RETRIES', '5'))
+)
+
+# 更新處理：不同用戶的更新並行處理，同一用戶的更新依序處理
+update_processor = UserOrderedUpdateProcessor(
+    max_concurrent_updates=int(os.getenv('UPDATE_CONCURRENCY', '256')),  # 同時處理的更新數
+    max_user_backlog=int(os.getenv('USER_UPDATE_BACKLOG', '10'))  # 單一用戶最多排隊的更新數，超過時丟棄
+)
+# 排隊與處理中的更新總數上限，達到上限時暫停接收更新
+update_queue = BoundedUpdateQueue(int(os.getenv('MAX_UPDATES_IN_FLIGHT', '10000')))
+
+# 接收更新的方式：設定 WEBHOOK_URL 時使用內建的 webhook 伺服器，否則使用長輪詢
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # 對外的 HTTPS 網址，例如 https://bot.example.com
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'webhook')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')  # 通常由反向代理處理 TLS 後轉發到本機
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))  # Telegram 同時推送的連線數（1-100）
+# 每次啟動都會以此密鑰重新設定 webhook；單一實例未設定時使用隨機密鑰即可，
+# 多個實例共用狀態後端時每個實例都會重新設定 webhook，必須使用相同的密鑰
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+if WEBHOOK_URL and not WEBHOOK_SECRET:
+    if STATE_BACKEND == 'redis':
+        raise ValueError("WEBHOOK_SECRET must be set when running webhook mode with STATE_BACKEND=redis")
+    WEBHOOK_SECRET = secrets.token_urlsafe(32)
+
+# Bot API 伺服器位址，可指向自架的 Bot API 伺服器或測試用的假伺服器
+BOT_API_BASE_URL = os.getenv('BOT_API_BASE_URL', 'https://api.telegram.org').rstrip('/')
+
+# 入群方式：link 在驗證通過後發送一次性邀請連結；request 由用戶先透過群組連結申請入群，
+# 機器人保留申請直到驗證通過後直接批准（每位用戶少一次 API 呼叫，也不會有連結外流）
+JOIN_MODE = os.getenv('JOIN_MODE', 'link')
+
+# 預先建立的一次性邀請連結池（每個群組一個）；入群申請模式下只在用戶沒有提出申請時才即時建立連結，不預先建立
+INVITE_LINK_POOL_SIZE = int(os.getenv('INVITE_LINK_POOL_SIZE', '20'))  # 0 表示停用，每次審核時即時建立
+INVITE_LINK_LOW_WATERMARK = int(os.getenv('INVITE_LINK_LOW_WATERMARK', '5'))
+INVITE_LINK_TTL = int(os.getenv('INVITE_LINK_TTL', '86400'))  # 連結有效秒數
+INVITE_LINK_UNUSED_TTL = int(os.getenv('INVITE_LINK_UNUSED_TTL', '0')) or None  # 已發出但未使用的連結在此秒數後撤銷，預設等於有效秒數
+
+# 為每個群組建立獨立的狀態命名空間、邀請連結池、管理員摘要與准入佇列；
+# 單一群組時直接使用 backend 本身，與升級前保存的狀態相容
+for tenant in tenants:
+    tenant.backend = backend.for_tenant(tenant.name) if TENANTS_FILE else backend
+    pool_size = INVITE_LINK_POOL_SIZE if tenant.invite_link_pool_size is None else tenant.invite_link_pool_size
+    tenant.link_pool = InviteLinkPool(
+        chat_id=tenant.group_id,
+        size=pool_size if JOIN_MODE != 'request' else 0,
+        low_watermark=INVITE_LINK_LOW_WATERMARK,
+        link_ttl=INVITE_LINK_TTL,
+        timers=expiry,
+        unused_ttl=INVITE_LINK_UNUSED_TTL
+    )
+    tenant.digest = AdminDigest(ADMIN_DIGEST_WINDOW)
+    admission.configure(tenant.group_id, tenant.verify_rate, tenant.verify_burst, tenant.verify_queue_size)
+
+def tenant_backends() -> list:
+    # 各群組獨立的狀態後端；單一群組時即為 backend 本身，不需要另外開啟或關閉
+    return [tenant.backend for tenant in tenants if tenant.backend is not backend]
+
+# Prometheus 指標：設定 METRICS_PORT 時以 HTTP 提供 /metrics
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))  # 0 表示停用
+metrics = MetricsRegistry()
+handler_latency = metrics.histogram(
+    'tgverify_handler_duration_seconds', 'Time spent in each update handler', ('handler',)
+)
+captcha_latency = metrics.histogram(
+    'tgverify_captcha_duration_seconds', 'Time to obtain a captcha image from the pool or render it on demand'
+)
+api_latency = metrics.histogram(
+    'tgverify_telegram_api_duration_seconds', 'Bot API request time per attempt, excluding outbound queueing', ('method',)
+)
+api_errors = metrics.counter(
+    'tgverify_telegram_api_errors_total', 'Failed Bot API requests per attempt', ('method', 'error')
+)
+admission_wait = metrics.histogram(
+    'tgverify_admission_wait_seconds', 'Time verifications spent queued for global admission (included in handler time)'
+)
+handler_errors = metrics.counter('tgverify_handler_errors_total', 'Errors raised by update handlers', ('error',))
+funnel = metrics.counter('tgverify_verification_funnel_total', 'Verifications reaching each stage', ('stage',))
+challenges = metrics.counter('tgverify_challenges_total', 'Captcha challenges by tier and outcome', ('tier', 'outcome'))
+
+def record_api_call(endpoint: str, duration: float, error: Exception | None):
+    api_latency.observe(duration, endpoint)
+    if error is not None:
+        api_errors.inc(endpoint, type(error).__name__)
+
+outbound.on_api_call = record_api_call
+
+def state_sizes() -> dict[tuple[str], int]:
+    # 抓取時才讀取各狀態結構的大小；狀態後端在本進程中的結構由後端回報，各群組的結構加總
+    sizes = Counter(backend.sizes())
+    for tenant_backend in tenant_backends():
+        sizes.update(tenant_backend.sizes())
+    sizes.update({
+        'conversation_handler': conversation_count(),
+        'timers': len(expiry),
+        'captcha_pool': len(captcha_pool),
+        'challenge_images': len(challenge_engine.images),
+        'invite_link_pool': sum(len(tenant.link_pool) for tenant in tenants),
+        'issued_invite_links': sum(len(tenant.link_pool.issued) for tenant in tenants),
+        'digest_buffer': sum(len(tenant.digest) for tenant in tenants),
+        'audit_queue': len(audit),
+        'admission_queue': len(admission),
+        'outbound_queue': outbound.queue_depth,
+        'updates_in_flight': update_queue.in_flight,
+        'update_users': update_processor.active_users,
+    })
+    return {(name,): size for name, size in sizes.items()}
+
+metrics.gauge('tgverify_state_size', 'Items held in each in-process state structure', ('structure',), state_sizes)
+
 # Configure logging
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
 )
 
+if CAPTCHA_MODE == 'token' and not CAPTCHA_SECRET:
+    # 作答可能由其他實例驗證，多個實例必須使用相同的密鑰；
+    # 單一實例未設定時使用隨機密鑰，重新啟動後先前發出的 token 都會失效
+    if STATE_BACKEND == 'redis':
+        raise ValueError("CAPTCHA_SECRET must be set when running CAPTCHA_MODE=token with STATE_BACKEND=redis")
+    logging.warning("CAPTCHA_SECRET is not set, using a random per-process secret")
+    CAPTCHA_SECRET = secrets.token_bytes(32)
+
 async def check_rate_limit(user_id: int) -> bool:
-    current_time = time()
-    user_requests[user_id].append(current_time)
-    
-    if len(user_requests[user_id]) < MAX_REQUESTS:
-        return True
-    
-    # 檢查最早的請求是否在時間窗口外
-    oldest_request = user_requests[user_id][0]
-    return (current_time - oldest_request) > REQUEST_WINDOW
+    # 每位用戶一個令牌桶，容量 MAX_REQUESTS，每 REQUEST_WINDOW 秒補滿；存放在共享後端，所有實例共用
+    return await backend.take_token(f"verify:{user_id}", MAX_REQUESTS / REQUEST_WINDOW, MAX_REQUESTS)
 
 async def check_attempts(user_id: int) -> tuple[bool, str]:
-    current_time = time()
-    
-    # 檢查是否需要重置嘗試次數
-    if current_time - attempt_timestamps[user_id] > ATTEMPT_RESET_TIME:
-        user_attempts[user_id] = 0
-        attempt_timestamps[user_id] = current_time
+    count, expires = await backend.get_attempts(user_id)
     
-    if user_attempts[user_id] >= MAX_ATTEMPTS:
-        remaining_time = int(ATTEMPT_RESET_TIME - (current_time - attempt_timestamps[user_id]))
+    if count >= MAX_ATTEMPTS:
+        remaining_time = int(expires - time())
         return False, f"❌ 您已超過最大嘗試次數，請在 {remaining_time//60} 分鐘後再試"
     
     return True, ""
 
+@timed(captcha_latency)
 async def generate_captcha():
-    # 生成 4 位數字驗證碼
-    code = ''.join(random.choices('0123456789', k=4))
+    # 從預渲染池取出驗證碼，池空時才在事件循環外即時渲染
+    code, png_bytes = await captcha_pool.get()
+    return code, io.BytesIO(png_bytes)
+
+async def store_captcha(user_id: int, code: str, context: ContextTypes.DEFAULT_TYPE):
+    if CAPTCHA_MODE == 'token':
+        # 簽名後的 token 放入對話資料，由 track_conversation 隨對話紀錄寫入狀態後端
+        context.conversation['captcha_token'] = issue_captcha_token(CAPTCHA_SECRET, user_id, code, CAPTCHA_TTL)
+    else:
+        await backend.set_captcha(user_id, code, CAPTCHA_TTL)
+
+async def verify_captcha(user_id: int, answer: str, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    # 不論成功與否都清除驗證碼，每個驗證碼只能驗證一次
+    if CAPTCHA_MODE == 'token':
+        token = context.conversation.pop('captcha_token', None)
+        return token is not None and verify_captcha_token(CAPTCHA_SECRET, token, user_id, answer)
     
-    # 創建圖片
-    img = Image.new('RGB', (100, 40), color='white')
-    draw = ImageDraw.Draw(img)
+    code = await backend.pop_captcha(user_id)
+    return code is not None and hmac.compare_digest(code.encode(), answer.encode())
+
+# PTB 沒有公開的 API 可以設定或查詢 ConversationHandler 的對話狀態，只能使用私有的 _update_state 與 _conversations；
+# 所有存取集中在以下兩個函數，依 python-telegram-bot 21.11.1 的實作，升級 PTB 時須確認其行為未改變
+def set_conversation_state(key: tuple[int, int], state):
+    # state 為 ConversationHandler.END 時移除該對話
+    conv_handler._update_state(state, key)
+
+def conversation_count() -> int:
+    return len(conv_handler._conversations)
+
+def saved_conversation_data(saved) -> dict:
+    # 後端的對話紀錄為 [狀態, 到期時間, 對話資料]；升級前的紀錄第三項是群組名稱或不存在
+    if saved is None or len(saved) < 3 or saved[2] is None:
+        return {}
+    return dict(saved[2]) if isinstance(saved[2], dict) else {'tenant': saved[2]}
+
+async def conversation_data(update: Update, context: ContextTypes.DEFAULT_TYPE) -> dict:
+    # 驗證中的對話資料（例如驗證的群組），不放在 PTB 的 user_data 中，避免每位驗證過的用戶都留下一筆永不釋放的資料；
+    # 由 track_conversation 與對話狀態一起寫入後端的對話紀錄，對話結束時一併清除。同一個更新只從後端讀取一次
+    data = getattr(context, 'conversation', None)
+    if data is None:
+        saved = await backend.get_conversation(CONVERSATION_NAME, (update.effective_chat.id, update.effective_user.id))
+        data = context.conversation = saved_conversation_data(saved)
+    return data
+
+def release_user_data(application: Application, user_id: int):
+    # 對話結束後釋放該用戶在 PTB user_data 中的項目；管理員以 /group 選擇的群組保留
+    if not tenants.administered_by(user_id):
+        application.drop_user_data(user_id)
+
+def track_conversation(callback):
+    # 包裝對話中的處理函數：進入等待輸入的狀態時重新計時，對話結束時取消計時；
+    # 狀態、到期時間與對話資料同時寫入狀態後端，重啟後或由其他實例處理下一個更新時可以繼續對話
+    @wraps(callback)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        state = await callback(update, context)
+        key = (update.effective_chat.id, update.effective_user.id)
+        if state in (TYPING_CAPTCHA, TYPING_INVITE_CODE):
+            expiry.schedule(('conversation', key), CONVERSATION_TIMEOUT, expire_conversation, context.application, key)
+            await backend.save_conversation(
+                CONVERSATION_NAME, key, [state, time() + CONVERSATION_TIMEOUT, await conversation_data(update, context)]
+            )
+        else:
+            expiry.cancel(('conversation', key))
+            await backend.save_conversation(CONVERSATION_NAME, key, None)
+            release_user_data(context.application, key[1])
+        return state
+    return wrapper
+
+async def sync_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # 多實例部署時同一用戶的上一個更新可能由其他實例處理，交給 ConversationHandler 前先從後端讀取對話狀態
+    if update.effective_chat is None or update.effective_user is None:
+        return
+    key = (update.effective_chat.id, update.effective_user.id)
+    saved = await backend.get_conversation(CONVERSATION_NAME, key)
+    if saved is not None and saved[1] > time():
+        set_conversation_state(key, saved[0])
+        context.conversation = saved_conversation_data(saved)
+    else:
+        set_conversation_state(key, ConversationHandler.END)
+        context.conversation = {}
+
+async def restore_conversations(application: Application):
+    # 重啟後還原未結束的對話，並依原本的到期時間重新計時；對話資料在用戶下次輸入時由 conversation_data 讀回
+    for key, saved in (await backend.load_conversations(CONVERSATION_NAME)).items():
+        set_conversation_state(key, saved[0])
+        expiry.schedule(('conversation', key), max(saved[1] - time(), 0), expire_conversation, application, key)
+
+async def conversation_tenant(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # 用戶正在驗證的群組：由 start_verification 記錄在對話資料中；升級前保存的對話沒有記錄群組，屬於唯一的群組
+    name = (await conversation_data(update, context)).get('tenant')
+    return tenants.named(name) if name is not None else tenants.default
+
+def welcome_keyboard(tenant) -> InlineKeyboardMarkup:
+    # 開始驗證與說明按鈕帶有群組名稱，同一位用戶可以分別驗證多個群組
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("🎫 開始驗證", callback_data=f"start_verify:{tenant.name}")],
+        [InlineKeyboardButton("❓ 查看指令說明", callback_data=f"show_help:{tenant.name}")]
+    ])
+
+async def admin_tenant(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # 管理員指令作用的群組：只管理一個群組時直接使用該群組，否則使用 /group 選擇的群組；
+    # 不是管理員或尚未選擇群組時回覆提示並回傳 None
+    user_id = update.effective_user.id
+    administered = tenants.administered_by(user_id)
+    if not administered:
+        await update.message.reply_text("❌ 只有管理員可以使用此命令")
+        return None
+    if len(administered) == 1:
+        return administered[0]
     
-    # 添加干擾線
-    for i in range(5):
-        x1 = random.randint(0, 100)
-        y1 = random.randint(0, 40)
-        x2 = random.randint(0, 100)
-        y2 = random.randint(0, 40)
-        draw.line([(x1, y1), (x2, y2)], fill='gray')
+    tenant = tenants.named(context.user_data.get('admin_group', ''))
+    if tenant is None or not tenant.is_admin(user_id):
+        await update.message.reply_text(
+            "❓ 您管理多個群組，請先選擇要管理的群組\n"
+            "格式：/group 群組名稱\n\n" +
+            "\n".join(f"▫️ {tenant.name}（{tenant.group_id}）" for tenant in administered)
+        )
+        return None
+    return tenant
+
+async def expire_conversation(application: Application, key: tuple[int, int]):
+    chat_id, user_id = key
     
-    # 寫入數字
-    draw.text((20, 10), code, fill='black')
+    # 對話可能已由其他實例結束或重新計時，以後端記錄的到期時間為準
+    saved = await backend.get_conversation(CONVERSATION_NAME, key)
+    if saved is None or saved[1] > time() + expiry.tick:
+        return
     
-    # 轉換為 bytes
-    img_byte_arr = io.BytesIO()
-    img.save(img_byte_arr, format='PNG')
-    img_byte_arr.seek(0)
+    # 沒有 JobQueue 時 ConversationHandler 的 conversation_timeout 不會生效，由時間輪直接結束對話
+    set_conversation_state(key, ConversationHandler.END)
+    await backend.save_conversation(CONVERSATION_NAME, key, None)
+    await backend.pop_captcha(user_id)
+    funnel.inc('timed_out')
+    release_user_data(application, user_id)
     
-    return code, img_byte_arr
+    await application.bot.send_message(
+        chat_id=chat_id,
+        text="⌛ 驗證已逾時，如需重新驗證，請發送 /start"
+    )
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_chat.type != 'private':
         return
     
+    # 多群組時由群組公開的深層連結（t.me/<bot>?start=<群組名稱>）指定要驗證的群組
+    tenant = tenants.named(context.args[0]) if context.args else tenants.default
+    if tenant is None:
+        await update.message.reply_text("❌ 請透過群組提供的連結開始驗證")
+        return
+    
     # 創建開始按鈕和幫助按鈕
-    keyboard = [
-        [InlineKeyboardButton("🎫 開始驗證", callback_data="start_verify")],
-        [InlineKeyboardButton("❓ 查看指令說明", callback_data="show_help")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = welcome_keyboard(tenant)
     
     # 發送歡迎消息
     welcome_message = (
@@ -123,11 +482,20 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=reply_markup
     )
 
+@timed(handler_latency, 'start_verification')
 async def start_verification(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     user = query.from_user
     await query.answer()
     
+    name = query.data.partition(':')[2]
+    tenant = tenants.named(name) if name else tenants.default
+    if tenant is None:
+        await query.edit_message_text("❌ 此群組已不再使用本機器人驗證")
+        return ConversationHandler.END
+    # 開始新的對話，先前對話留下的資料不再使用
+    context.conversation = {'tenant': tenant.name}
+    
     # 檢查請求頻率
     if not await check_rate_limit(user.id):
         await query.edit_message_text("❌ 請求過於頻繁，請稍後再試")
@@ -139,43 +507,109 @@ async def start_verification(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await query.edit_message_text(message)
         return ConversationHandler.END
     
-    # 生成驗證碼
-    code, img_bytes = await generate_captcha()
-    captcha_codes[user.id] = code
+    # 全域准入：名額用盡時在所屬群組的佇列中排隊等待
+    if not admission.try_acquire(tenant.group_id):
+        waiter = admission.enqueue(tenant.group_id)
+        if waiter is None:
+            await query.edit_message_text("❌ 目前驗證人數過多，請稍後再試")
+            return ConversationHandler.END
+        
+        await query.edit_message_text(
+            f"⏳ 目前驗證人數眾多，您排在第 {admission.queued(tenant.group_id)} 位\n"
+            "輪到您時會自動發送驗證碼，請稍候"
+        )
+        queued = perf_counter()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            return ConversationHandler.END
+        finally:
+            admission_wait.observe(perf_counter() - queued)
     
-    # 發送驗證碼圖片
-    await context.bot.send_photo(
-        chat_id=user.id,
-        photo=img_bytes,
-        caption="請先輸入圖片中的驗證碼："
-    )
+    # 發出驗證題目；曾經答錯的用戶一律使用完整的圖片驗證碼
+    failed_attempts, _ = await backend.get_attempts(user.id)
+    await send_challenge(context, user.id, suspicious=failed_attempts > 0)
     
+    funnel.inc('started')
     return TYPING_CAPTCHA
 
+async def send_challenge(context: ContextTypes.DEFAULT_TYPE, user_id: int, suspicious: bool):
+    # 依 challenge_engine 選擇的方式發出題目；答案一律以 store_captcha 保存，由 handle_captcha 統一驗證
+    tier = challenge_engine.choose(suspicious)
+    cached = challenge_engine.images.pick() if tier == 'cached' else None
+    if tier == 'cached' and cached is None:
+        tier = 'full'
+    # 題目類型隨對話紀錄寫入狀態後端，作答由其他實例處理時同樣計入 challenge_engine 的答錯率
+    context.conversation['challenge_tier'] = tier
+    challenges.inc(tier, 'issued')
+    
+    if tier == 'keyboard':
+        # 保存的答案是正確選項的隨機 ID，按鈕回呼資料中沒有驗證碼本身
+        answer, prompt, options = keyboard_challenge()
+        await store_captcha(user_id, answer, context)
+        keyboard = [
+            [InlineKeyboardButton(label, callback_data=f"captcha:{option_id}") for label, option_id in options[i:i + 3]]
+            for i in range(0, len(options), 3)
+        ]
+        await context.bot.send_message(
+            chat_id=user_id,
+            text=f"請點選與下列數字相同的按鈕：\n\n{prompt}",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return
+    
+    if cached is not None:
+        code, file_id = cached
+        await store_captcha(user_id, code, context)
+        await context.bot.send_photo(chat_id=user_id, photo=file_id, caption="請先輸入圖片中的驗證碼：")
+        return
+    
+    # 完整的圖片驗證碼：渲染並上傳，上傳後的 file_id 加入圖片庫供之後重複發送
+    code, img_bytes = await generate_captcha()
+    await store_captcha(user_id, code, context)
+    message = await context.bot.send_photo(chat_id=user_id, photo=img_bytes, caption="請先輸入圖片中的驗證碼：")
+    if message.photo:
+        challenge_engine.images.add(code, message.photo[-1].file_id)
+
+@timed(handler_latency, 'handle_captcha')
 async def handle_captcha(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # 圖片驗證碼以文字作答，按鈕題目以按鈕作答，兩者以同一個流程驗證
     user = update.effective_user
-    captcha_input = update.message.text
+    query = update.callback_query
+    if query is not None:
+        await query.answer()
+        captcha_input = query.data.split(':', 1)[1]
+        # 以編輯題目訊息的方式回覆，同時移除按鈕
+        reply = query.edit_message_text
+    else:
+        captcha_input = update.message.text
+        reply = update.message.reply_text
+    
+    # 驗證碼檢查；token 模式的 token 與題目類型保存在對話資料中，先從後端讀回
+    data = await conversation_data(update, context)
+    passed = await verify_captcha(user.id, captcha_input, context)
+    tier = data.pop('challenge_tier', None)
+    if tier is not None:
+        challenge_engine.record(tier, passed)
+        challenges.inc(tier, 'passed' if passed else 'failed')
     
-    # 驗證碼檢查
-    if user.id not in captcha_codes or captcha_input != captcha_codes[user.id]:
-        user_attempts[user.id] += 1
-        del captcha_codes[user.id]  # 清除驗證碼
+    if not passed:
+        tenant = await conversation_tenant(update, context)
+        funnel.inc('captcha_failed')
+        audit.record('captcha_failed', user.id, group_id=tenant.group_id if tenant else None)
+        await backend.add_attempt(user.id)
         
         # 檢查是否達到最大嘗試次數
         can_attempt, message = await check_attempts(user.id)
-        if not can_attempt:
-            await update.message.reply_text(message)
+        if not can_attempt or tenant is None:
+            await reply(message or "❌ 驗證碼錯誤，如需重新驗證，請發送 /start")
             return ConversationHandler.END
         
         # 創建開始按鈕和幫助按鈕
-        keyboard = [
-            [InlineKeyboardButton("🎫 開始驗證", callback_data="start_verify")],
-            [InlineKeyboardButton("❓ 查看指令說明", callback_data="show_help")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = welcome_keyboard(tenant)
         
         # 發送錯誤消息並返回開始畫面
-        await update.message.reply_text(
+        await reply(
             "❌ 驗證碼錯誤，請重新開始\n\n"
             "🔹 本群組需要驗證才能加入\n"
             "🔹 請準備好您的邀請碼\n"
@@ -185,17 +619,16 @@ async def handle_captcha(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return ConversationHandler.END
     
-    # 清除驗證碼
-    del captcha_codes[user.id]
+    funnel.inc('captcha_passed')
     
     # 要求輸入邀請碼
-    await update.message.reply_text("請輸入您的邀請碼：")
+    await reply("請輸入您的邀請碼：")
     return TYPING_INVITE_CODE
 
 async def add_codes(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # 檢查是否是管理員
-    if str(update.effective_user.id) != os.getenv('ADMIN_ID'):
-        await update.message.reply_text("❌ 只有管理員可以使用此命令")
+    # 檢查是否是管理員，並取得要管理的群組
+    tenant = await admin_tenant(update, context)
+    if tenant is None:
         return
     
     # 檢查是否有提供邀請碼
@@ -207,66 +640,228 @@ async def add_codes(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # 添加邀請碼
-    added_codes = []
-    for code in context.args:
-        if code not in valid_invite_codes:
-            valid_invite_codes.add(code)
-            added_codes.append(code)
+    added_codes = await tenant.backend.add_codes(context.args)
     
     # 回覆結果
     if added_codes:
         await update.message.reply_text(
             f"✅ 已添加 {len(added_codes)} 個邀請碼：\n" + 
-            "\n".join(f"🎫 {code}" for code in added_codes)
+            format_list([f"🎫 {code}" for code in added_codes])
         )
     else:
         await update.message.reply_text("❌ 沒有新的邀請碼被添加")
 
+async def import_codes(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # 檢查是否是管理員，並取得要管理的群組
+    tenant = await admin_tenant(update, context)
+    if tenant is None:
+        return
+    
+    document = update.message.document
+    if document.file_size and document.file_size > MAX_IMPORT_FILE_SIZE:
+        await update.message.reply_text("❌ 檔案過大，Telegram 機器人最多只能下載 20 MB 的檔案")
+        return
+    
+    status_message = await update.message.reply_text("⏳ 正在下載邀請碼檔案…")
+    
+    async def report_progress(result, progress, elapsed):
+        await status_message.edit_text(
+            f"⏳ 正在匯入邀請碼… {progress:.0%}\n"
+            f"📄 已處理 {result.lines} 行（{result.lines / max(elapsed, 0.001):.0f} 行/秒）\n"
+            f"✅ 新增 {result.added}，❌ 拒絕 {result.rejected}"
+        )
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        source_path = os.path.join(tmp_dir, 'codes.txt')
+        rejected_path = os.path.join(tmp_dir, 'rejected.csv')
+        
+        file = await document.get_file()
+        await file.download_to_drive(source_path)
+        
+        result = await import_codes_file(
+            source_path,
+            tenant.backend.add_codes,
+            rejected_path,
+            batch_size=IMPORT_BATCH_SIZE,
+            on_progress=report_progress
+        )
+        
+        logging.info(
+            f"Imported {result.added} invite codes for group {tenant.name} from {document.file_name} "
+            f"({result.lines} lines, {result.rejected} rejected) in {result.elapsed:.1f}s"
+        )
+        
+        await status_message.edit_text(
+            "✅ 邀請碼匯入完成\n\n"
+            f"📄 共 {result.lines} 行，耗時 {result.elapsed:.1f} 秒\n"
+            f"🎫 新增 {result.added} 個邀請碼\n"
+            f"🔁 重複 {result.duplicates} 個\n"
+            f"⚠️ 格式錯誤 {result.invalid} 行"
+        )
+        
+        # 有被拒絕的行時附上明細檔案
+        if result.rejected_path:
+            with open(result.rejected_path, 'rb') as rejected_file:
+                await update.message.reply_document(
+                    document=rejected_file,
+                    filename='rejected_codes.csv',
+                    caption=f"❌ 未匯入的 {result.rejected} 行（行號、原因、內容）"
+                )
+
+async def render_codes_page(tenant, cursor: int) -> tuple[str, InlineKeyboardMarkup]:
+    # 只讀取並渲染目前這一頁
+    total = await tenant.backend.count_codes()
+    cursor = min(max(cursor, 0), max(total - 1, 0) // CODES_PAGE_SIZE * CODES_PAGE_SIZE)
+    page = await tenant.backend.list_codes(cursor, CODES_PAGE_SIZE)
+    
+    text = (
+        f"📋 可用的邀請碼列表（{cursor + 1}-{min(cursor + CODES_PAGE_SIZE, total)} / {total}）：\n\n" +
+        "\n".join(f"🎫 {code}" for code in page)
+    )
+    return text, page_keyboard('codes', tenant, cursor, CODES_PAGE_SIZE, total)
+
 async def list_codes(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # 檢查是否是管理員
-    if str(update.effective_user.id) != os.getenv('ADMIN_ID'):
-        await update.message.reply_text("❌ 只有管理員可以使用此命令")
+    # 檢查是否是管理員，並取得要管理的群組
+    tenant = await admin_tenant(update, context)
+    if tenant is None:
         return
     
+    # 索引中只保存雜湊，無法列出原始邀請碼
+    if tenant.code_index is not None:
+        await update.message.reply_text(f"🗂 邀請碼索引中還有 {len(tenant.code_index)} 個可用邀請碼")
+    
     # 顯示所有有效的邀請碼
-    if not valid_invite_codes:
+    if not await tenant.backend.count_codes():
         await update.message.reply_text("📝 目前沒有可用的邀請碼")
         return
     
-    codes_list = "📋 可用的邀請碼列表：\n\n" + "\n".join(f"🎫 {code}" for code in valid_invite_codes)
-    await update.message.reply_text(codes_list)
+    text, reply_markup = await render_codes_page(tenant, 0)
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+async def consume_invite_code(tenant, code: str):
+    # 取用邀請碼並回傳歸還用的協程函數；邀請碼無效時回傳 None
+    tenant_backend, code_index = tenant.backend, tenant.code_index
+    if await tenant_backend.consume_code(code):
+        return tenant_backend.restore_code
+    if code_index is not None and await tenant_backend.claim_indexed_code(code_index, code):
+        return lambda code: tenant_backend.release_indexed_code(code_index, code)
+    return None
+
+async def add_pending(bot, tenant, user_id: int, info: dict):
+    await tenant.backend.add_pending(user_id, info)
+    schedule_pending_expiry(bot, tenant, user_id, info)
+
+async def pop_pending(tenant, user_id: int) -> dict | None:
+    info = await tenant.backend.pop_pending(user_id)
+    if info is not None:
+        expiry.cancel(('pending', tenant.name, user_id))
+    return info
+
+def schedule_pending_expiry(bot, tenant, user_id: int, info: dict):
+    if not (PENDING_REMIND_AFTER or PENDING_EXPIRE_AFTER):
+        return
+    
+    # 依提交時間計算，重啟後還原的請求也從原本的時間起算
+    age = time() - datetime.strptime(info['time'], '%Y-%m-%d %H:%M:%S').timestamp()
+    key = ('pending', tenant.name, user_id)
+    if PENDING_REMIND_AFTER and age < PENDING_REMIND_AFTER and (
+            not PENDING_EXPIRE_AFTER or PENDING_REMIND_AFTER < PENDING_EXPIRE_AFTER):
+        expiry.schedule(key, PENDING_REMIND_AFTER - age, remind_pending, bot, tenant, user_id)
+    elif PENDING_EXPIRE_AFTER:
+        expiry.schedule(key, PENDING_EXPIRE_AFTER - age, expire_pending, bot, tenant, user_id)
+
+async def remind_pending(bot, tenant, user_id: int):
+    info = (await tenant.backend.get_pending([user_id])).get(user_id)
+    if info is None:
+        return
+    
+    if PENDING_EXPIRE_AFTER:
+        schedule_pending_expiry(bot, tenant, user_id, info)
+    
+    # 摘要模式下提醒也合併到摘要中
+    if tenant.digest.enabled:
+        tenant.digest.add(user_id)
+    else:
+        await send_review_request(bot, tenant, user_id, info, title="⏰ 待審核提醒")
+
+async def expire_pending(bot, tenant, user_id: int):
+    info = await pop_pending(tenant, user_id)
+    if info is None:
+        return
+    
+    audit.record('expired', user_id, info['invite_code'], group_id=tenant.group_id, username=info['username'])
+    funnel.inc('expired')
+    await decline_join_request(bot, tenant, user_id, info['invite_code'])
+    await bot.send_message(
+        chat_id=user_id,
+        text="⌛ 您的驗證請求逾時未審核，如需重新驗證，請發送 /start"
+    )
 
+async def send_review_request(bot, tenant, user_id: int, info: dict, title: str = "📝 新的驗證請求"):
+    # 創建審核按鈕
+    keyboard = [
+        [
+            InlineKeyboardButton("✅ 通過", callback_data=f"approve_{user_id}_{tenant.name}"),
+            InlineKeyboardButton("❌ 拒絕", callback_data=f"reject_{user_id}_{tenant.name}")
+        ]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    # 發送驗證請求給管理員；同一位管理員可能管理多個群組，標示請求所屬的群組
+    admin_message = f"{title}\n\n"
+    if len(tenants) > 1:
+        admin_message += f"👥 群組: {tenant.name}\n"
+    admin_message += (
+        f"👤 用戶: @{info['username']}\n"
+        f"📌 ID: {user_id}\n"
+        f"👋 名稱: {info['first_name']}\n"
+        f"🎫 邀請碼: {info['invite_code']}\n"
+        f"⏰ 時間: {info['time']}"
+    )
+    
+    await bot.send_message(
+        chat_id=tenant.review_chat_id,
+        text=admin_message,
+        reply_markup=reply_markup
+    )
+
+@timed(handler_latency, 'handle_invite_code')
 async def handle_invite_code(update: Update, context: ContextTypes.DEFAULT_TYPE):
     invite_code = update.message.text
     user = update.effective_user
+    tenant = await conversation_tenant(update, context)
+    if tenant is None:
+        await update.message.reply_text("❌ 找不到您要驗證的群組，請重新透過群組提供的連結開始驗證")
+        return ConversationHandler.END
     
-    # 檢查是否是有效的邀請碼
-    if invite_code in valid_invite_codes:
+    # 檢查並原子地取用邀請碼，避免同一個邀請碼被兩個用戶同時使用
+    restore_code = await consume_invite_code(tenant, invite_code)
+    if restore_code:
         try:
-            # 生成邀請連結
-            invite_link = await context.bot.create_chat_invite_link(
-                chat_id=os.getenv('GROUP_ID'),
-                member_limit=1
-            )
+            invite_link = await grant_access(context.bot, tenant, user.id, invite_code)
             
-            # 發送邀請連結給用戶
-            await update.message.reply_text(
-                "🎉 邀請碼驗證通過！\n\n"
-                f"🔗 這是您的群組邀請連結：\n{invite_link.invite_link}\n\n"
-                "⚠️ 請注意：此連結僅能使用一次"
-            )
-            
-            # 移除已使用的邀請碼
-            valid_invite_codes.remove(invite_code)
+            if invite_link is None:
+                await update.message.reply_text(
+                    "🎉 邀請碼驗證通過！\n\n"
+                    "✅ 已批准您的入群申請，現在可以直接進入群組"
+                )
+            else:
+                # 發送邀請連結給用戶
+                await update.message.reply_text(
+                    "🎉 邀請碼驗證通過！\n\n"
+                    f"🔗 這是您的群組邀請連結：\n{invite_link}\n\n"
+                    "⚠️ 請注意：此連結僅能使用一次"
+                )
             
-            # 記錄到日誌
-            logging.info(f"User {user.username} (ID: {user.id}) used invite code: {invite_code}")
+            audit.record('code_used', user.id, invite_code, group_id=tenant.group_id, username=user.username)
+            funnel.inc('code_accepted')
             
             return ConversationHandler.END
             
         except Exception as e:
             logging.error(f"Error creating invite link: {e}")
             # 如果出錯，保留邀請碼
+            await restore_code(invite_code)
             await update.message.reply_text(
                 "❌ 抱歉，生成邀請連結時出現錯誤，請稍後再試或聯繫管理員"
             )
@@ -274,37 +869,21 @@ async def handle_invite_code(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     # 如果不是有效邀請碼，走原來的審核流程
     # 存儲用戶資訊
-    pending_users[user.id] = {
+    info = {
         'username': user.username,
         'first_name': user.first_name,
         'invite_code': invite_code,
         'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     }
+    await add_pending(context.bot, tenant, user.id, info)
+    audit.record('pending', user.id, invite_code, group_id=tenant.group_id, username=user.username)
+    funnel.inc('pending')
     
-    # 創建審核按鈕
-    keyboard = [
-        [
-            InlineKeyboardButton("✅ 通過", callback_data=f"approve_{user.id}"),
-            InlineKeyboardButton("❌ 拒絕", callback_data=f"reject_{user.id}")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    # 發送驗證請求給管理員
-    admin_message = (
-        f"📝 新的驗證請求\n\n"
-        f"👤 用戶: @{user.username}\n"
-        f"📌 ID: {user.id}\n"
-        f"👋 名稱: {user.first_name}\n"
-        f"🎫 邀請碼: {invite_code}\n"
-        f"⏰ 時間: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-    )
-    
-    await context.bot.send_message(
-        chat_id=os.getenv('ADMIN_ID'),
-        text=admin_message,
-        reply_markup=reply_markup
-    )
+    # 摘要模式下由摘要統一通知管理員
+    if tenant.digest.enabled:
+        tenant.digest.add(user.id)
+    else:
+        await send_review_request(context.bot, tenant, user.id, info)
     
     # 通知用戶
     await update.message.reply_text(
@@ -313,40 +892,236 @@ async def handle_invite_code(update: Update, context: ContextTypes.DEFAULT_TYPE)
     )
     return ConversationHandler.END
 
-async def list_pending(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # 檢查是否是管理員
-    if str(update.effective_user.id) != os.getenv('ADMIN_ID'):
-        await update.message.reply_text("❌ 只有管理員可以使用此命令")
-        return
+def page_keyboard(kind: str, tenant, cursor: int, page_size: int, total: int, extra_buttons=()) -> InlineKeyboardMarkup:
+    navigation = []
+    if cursor > 0:
+        navigation.append(InlineKeyboardButton("⬅️ 上一頁", callback_data=f"page:{kind}:{tenant.name}:{max(cursor - page_size, 0)}"))
+    if cursor + page_size < total:
+        navigation.append(InlineKeyboardButton("下一頁 ➡️", callback_data=f"page:{kind}:{tenant.name}:{cursor + page_size}"))
     
-    if not pending_users:
-        await update.message.reply_text("📝 目前沒有待審核的用戶")
-        return
+    keyboard = [navigation] if navigation else []
+    keyboard.extend([button] for button in extra_buttons)
+    keyboard.append([InlineKeyboardButton("📄 下載 CSV", callback_data=f"export:{kind}:{tenant.name}")])
+    return InlineKeyboardMarkup(keyboard)
+
+async def render_pending_page(tenant, cursor: int) -> tuple[str, InlineKeyboardMarkup]:
+    # 只讀取並渲染目前這一頁
+    total = await tenant.backend.count_pending()
+    cursor = min(max(cursor, 0), max(total - 1, 0) // PENDING_PAGE_SIZE * PENDING_PAGE_SIZE)
     
-    # 生成待審核用戶列表
-    message = "📋 待審核用戶列表：\n\n"
-    for user_id, info in pending_users.items():
-        message += (
+    lines = [f"📋 待審核用戶列表（{cursor + 1}-{min(cursor + PENDING_PAGE_SIZE, total)} / {total}）：\n"]
+    for user_id, info in await tenant.backend.list_pending(cursor, PENDING_PAGE_SIZE):
+        lines.append(
             f"👤 用戶: @{info['username']}\n"
             f"📌 ID: {user_id}\n"
             f"👋 名稱: {info['first_name']}\n"
             f"🎫 邀請碼: {info['invite_code']}\n"
             f"⏰ 時間: {info['time']}\n"
-            "➖➖➖➖➖➖➖➖➖➖\n"
+            "➖➖➖➖➖➖➖➖➖➖"
         )
     
     # 添加導出邀請碼按鈕
-    keyboard = [[InlineKeyboardButton("📥 導出邀請碼列表", callback_data="export_codes")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    export_button = InlineKeyboardButton("📥 導出邀請碼列表", callback_data=f"export_codes:{tenant.name}")
+    return "\n".join(lines), page_keyboard('pending', tenant, cursor, PENDING_PAGE_SIZE, total, [export_button])
+
+async def list_pending(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # 檢查是否是管理員，並取得要管理的群組
+    tenant = await admin_tenant(update, context)
+    if tenant is None:
+        return
+    
+    if not await tenant.backend.count_pending():
+        await update.message.reply_text("📝 目前沒有待審核的用戶")
+        return
+    
+    text, reply_markup = await render_pending_page(tenant, 0)
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+def callback_tenant(query, name: str):
+    # 按鈕回呼資料中的群組，只接受該群組的管理員；升級前發出的按鈕沒有群組名稱，屬於唯一的群組
+    tenant = tenants.named(name) if name else tenants.default
+    if tenant is None or not tenant.is_admin(query.from_user.id):
+        return None
+    return tenant
+
+async def page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    
+    _, kind, name, cursor = query.data.split(':')
+    tenant = callback_tenant(query, name)
+    if tenant is None:
+        return
     
-    await update.message.reply_text(message, reply_markup=reply_markup)
+    if kind == 'pending':
+        if not await tenant.backend.count_pending():
+            await query.edit_message_text("📝 目前沒有待審核的用戶")
+            return
+        text, reply_markup = await render_pending_page(tenant, int(cursor))
+    else:
+        if not await tenant.backend.count_codes():
+            await query.edit_message_text("📝 目前沒有可用的邀請碼")
+            return
+        text, reply_markup = await render_codes_page(tenant, int(cursor))
+    
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+async def send_csv_export(bot, chat_id: int, filename: str, header: list[str], batches, caption: str):
+    # 從後端逐批讀取資料（batches 為非同步迭代器，每次產生一批列）寫入暫存檔（小檔案留在記憶體），
+    # 每批之間讓出事件循環，再以文件發送
+    with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE, mode='w+b') as buffer:
+        text_buffer = io.TextIOWrapper(buffer, encoding='utf-8-sig', newline='')
+        writer = csv.writer(text_buffer)
+        writer.writerow(header)
+        
+        count = 0
+        async for rows in batches:
+            writer.writerows(rows)
+            count += len(rows)
+            await asyncio.sleep(0)
+        
+        text_buffer.flush()
+        buffer.seek(0)
+        # 上傳時 Bot API 客戶端本來就會讀入整個檔案
+        await bot.send_document(
+            chat_id=chat_id,
+            document=buffer.read(),
+            filename=filename,
+            caption=caption.format(count=count)
+        )
+        text_buffer.detach()
 
+async def export_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    
+    _, kind, name = query.data.split(':')
+    tenant = callback_tenant(query, name)
+    if tenant is None:
+        return
+    
+    if kind == 'pending':
+        batches = (
+            [[user_id, info['username'], info['first_name'], info['invite_code'], info['time']] for user_id, info in batch]
+            async for batch in tenant.backend.iter_pending(EXPORT_BATCH_SIZE)
+        )
+        await send_csv_export(
+            context.bot, query.message.chat_id, 'pending_users.csv',
+            ['user_id', 'username', 'first_name', 'invite_code', 'time'], batches,
+            "📋 待審核用戶列表（共 {count} 筆）"
+        )
+    elif kind == 'codes':
+        batches = ([[code] for code in batch] async for batch in tenant.backend.iter_codes(EXPORT_BATCH_SIZE))
+        await send_csv_export(
+            context.bot, query.message.chat_id, 'invite_codes.csv',
+            ['invite_code'], batches,
+            "📋 可用的邀請碼列表（共 {count} 個）"
+        )
+
+async def render_digest_page(tenant, digest_id: str, page: int) -> tuple[str, InlineKeyboardMarkup | None]:
+    user_ids = tenant.digest.get(digest_id)
+    if user_ids is None:
+        return "⚠️ 此摘要已過期，請使用 /pending 查看待審核用戶", None
+    
+    pages = max((len(user_ids) - 1) // DIGEST_PAGE_SIZE + 1, 1)
+    page = min(max(page, 0), pages - 1)
+    pending = await tenant.backend.get_pending(user_ids)
+    waiting = len(pending)
+    
+    # 每個請求只佔一行，已處理的請求標示出來
+    lines = [f"📬 驗證請求摘要 #{digest_id}（共 {len(user_ids)} 筆，待審核 {waiting} 筆）"]
+    if len(tenants) > 1:
+        lines[0] += f"\n👥 群組: {tenant.name}"
+    if pages > 1:
+        lines[0] += f"\n📄 第 {page + 1}/{pages} 頁"
+    lines.append("")
+    start = page * DIGEST_PAGE_SIZE
+    for number, user_id in enumerate(user_ids[start:start + DIGEST_PAGE_SIZE], start + 1):
+        info = pending.get(user_id)
+        if info is None:
+            lines.append(f"{number}. {user_id} ✔️ 已處理")
+        else:
+            lines.append(f"{number}. @{info['username']} ({user_id}) 🎫 {info['invite_code']}")
+    
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("⬅️ 上一頁", callback_data=f"digest:{tenant.name}:{digest_id}:page:{page - 1}"))
+    if page < pages - 1:
+        navigation.append(InlineKeyboardButton("下一頁 ➡️", callback_data=f"digest:{tenant.name}:{digest_id}:page:{page + 1}"))
+    
+    keyboard = [navigation] if navigation else []
+    if waiting:
+        keyboard.append([
+            InlineKeyboardButton("✅ 全部通過", callback_data=f"digest:{tenant.name}:{digest_id}:approve"),
+            InlineKeyboardButton("❌ 全部拒絕", callback_data=f"digest:{tenant.name}:{digest_id}:reject")
+        ])
+        keyboard.append([InlineKeyboardButton("🔍 逐一審核本頁", callback_data=f"digest:{tenant.name}:{digest_id}:review:{page}")])
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard) if keyboard else None
+
+async def send_digest(tenant, bot, digest_id: str, user_ids: list[int]):
+    text, reply_markup = await render_digest_page(tenant, digest_id, 0)
+    await bot.send_message(
+        chat_id=tenant.review_chat_id,
+        text=text,
+        reply_markup=reply_markup
+    )
+
+async def digest_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    
+    _, name, digest_id, action, *args = query.data.split(':')
+    tenant = callback_tenant(query, name)
+    if tenant is None:
+        return
+    
+    user_ids = tenant.digest.get(digest_id)
+    if user_ids is None:
+        text, _ = await render_digest_page(tenant, digest_id, 0)
+        await query.edit_message_text(text)
+        return
+    
+    if action == 'page':
+        text, reply_markup = await render_digest_page(tenant, digest_id, int(args[0]))
+        await query.edit_message_text(text, reply_markup=reply_markup)
+        return
+    
+    if action == 'review':
+        # 為本頁仍待審核的請求發送個別的審核訊息
+        page = int(args[0])
+        start = page * DIGEST_PAGE_SIZE
+        pending = await tenant.backend.get_pending(user_ids[start:start + DIGEST_PAGE_SIZE])
+        for user_id, info in pending.items():
+            await send_review_request(context.bot, tenant, user_id, info)
+        return
+    
+    # 全部通過或拒絕：原子地取出仍待審核的項目，已被個別處理的請求會被略過
+    batch = [(user_id, info) for user_id in user_ids if (info := await pop_pending(tenant, user_id)) is not None]
+    if action == 'approve':
+        done, failed = await bulk_review(context.bot, tenant, batch, approve_user, query.message, "批准", query.from_user.id)
+        summary = f"✅ 已批准 {len(done)} 個用戶"
+    else:
+        done, failed = await bulk_review(context.bot, tenant, batch, reject_user, query.message, "拒絕", query.from_user.id)
+        summary = f"❌ 已拒絕 {len(done)} 個用戶"
+    if failed:
+        summary += f"\n⚠️ {len(failed)} 個用戶處理失敗，已保留在待審核列表：\n" + format_list(failed, limit=10)
+    
+    text, reply_markup = await render_digest_page(tenant, digest_id, 0)
+    await query.edit_message_text(f"{text}\n\n{summary}", reply_markup=reply_markup)
+
+@timed(handler_latency, 'button_callback')
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
-    if query.data == "show_help":
-        is_admin = str(query.from_user.id) == os.getenv('ADMIN_ID')
+    action, _, name = query.data.partition(':')
+    if action == "captcha":
+        # 對話已結束（逾時、取消或已作答）後才按下的題目按鈕
+        await query.edit_message_text("⌛ 此驗證題目已失效，如需重新驗證，請發送 /start")
+        return
+    
+    if action == "show_help":
+        is_admin = bool(tenants.administered_by(query.from_user.id))
         
         help_text = (
             "📚 可用的指令列表：\n\n"
@@ -363,7 +1138,13 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "➖➖➖➖➖➖➖➖➖➖\n"
                 "/pending - 查看待審核的用戶列表\n"
                 "/approve_codes - 批量批准指定邀請碼的用戶\n"
-                "格式：/approve_codes code1 code2 code3\n\n"
+                "格式：/approve_codes code1 code2 code3\n"
+                "/stats - 查看運行狀態與記憶體用量\n"
+                "/audit - 查詢用戶 ID 或邀請碼的稽核紀錄\n"
+                "格式：/audit 用戶ID或邀請碼\n"
+                "/group - 查看或切換要管理的群組（管理多個群組時）\n"
+                "格式：/group 群組名稱\n"
+                "📎 上傳 TXT/CSV 檔案 - 批量匯入邀請碼（每行一個）\n\n"
                 "💡 提示：\n"
                 "• 在待審核列表中可以導出純邀請碼列表\n"
                 "• 可以對單個用戶進行審核或拒絕\n"
@@ -371,19 +1152,20 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
         
         # 添加返回按鈕
-        keyboard = [[InlineKeyboardButton("🔙 返回", callback_data="back_to_start")]]
+        keyboard = [[InlineKeyboardButton("🔙 返回", callback_data=f"back_to_start:{name}")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         await query.edit_message_text(help_text, reply_markup=reply_markup)
         return
     
-    if query.data == "back_to_start":
+    if action == "back_to_start":
+        tenant = tenants.named(name) if name else tenants.default
+        if tenant is None:
+            await query.edit_message_text("❌ 此群組已不再使用本機器人驗證")
+            return
+        
         # 返回開始界面
-        keyboard = [
-            [InlineKeyboardButton("🎫 開始驗證", callback_data="start_verify")],
-            [InlineKeyboardButton("❓ 查看指令說明", callback_data="show_help")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = welcome_keyboard(tenant)
         
         welcome_message = (
             "👋 歡迎來到驗證機器人！\n\n"
@@ -396,63 +1178,60 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text(welcome_message, reply_markup=reply_markup)
         return
     
-    if query.data == "export_codes":
-        if not pending_users:
+    if action == "export_codes":
+        tenant = callback_tenant(query, name)
+        if tenant is None:
+            return
+        if not await tenant.backend.count_pending():
             await query.edit_message_text("📝 目前沒有待審核的用戶")
             return
         
-        # 生成純邀請碼列表
-        codes_list = "📥 邀請碼列表：\n\n"
-        for info in pending_users.values():
-            codes_list += f"🎫 {info['invite_code']}\n"
-        
-        await query.message.reply_text(codes_list)
+        # 導出純邀請碼列表
+        batches = ([[info['invite_code']] for _, info in batch] async for batch in tenant.backend.iter_pending(EXPORT_BATCH_SIZE))
+        await send_csv_export(
+            context.bot, query.message.chat_id, 'pending_invite_codes.csv',
+            ['invite_code'], batches,
+            "📥 邀請碼列表（共 {count} 個）"
+        )
         return
     
-    action, user_id = query.data.split('_')
+    # 群組名稱可能含有底線，只切開前兩段
+    action, user_id, *rest = query.data.split('_', 2)
     user_id = int(user_id)
+    name = rest[0] if rest else ''
+    tenant = callback_tenant(query, name)
+    if tenant is None:
+        return
     
-    if action == "approve":
-        # 生成邀請連結
-        invite_link = await context.bot.create_chat_invite_link(
-            chat_id=os.getenv('GROUP_ID'),
-            member_limit=1
-        )
-        
-        # 發送邀請連結給用戶
-        await context.bot.send_message(
-            chat_id=user_id,
-            text=(
-                "🎉 恭喜！您的驗證請求已通過！\n\n"
-                f"🔗 這是您的群組邀請連結：\n{invite_link.invite_link}\n\n"
-                "⚠️ 請注意：此連結僅能使用一次"
-            )
+    # 原子地取出待審核項目，重複點擊或其他審核流程已處理時直接返回
+    info = await pop_pending(tenant, user_id)
+    if info is None:
+        await query.edit_message_text(
+            text=f"{query.message.text}\n\n⚠️ 此請求已被處理"
         )
+        return
+    
+    if action == "approve":
+        try:
+            await approve_user(context.bot, tenant, user_id, info, query.from_user.id)
+        except Exception:
+            # 失敗時放回待審核列表，以便重試
+            await add_pending(context.bot, tenant, user_id, info)
+            raise
         
         # 更新管理員消息
         await query.edit_message_text(
             text=f"{query.message.text}\n\n✅ 已通過 - 管理員已審核"
         )
-        
-        # 從待審核列表中移除
-        if user_id in pending_users:
-            del pending_users[user_id]
     
     elif action == "reject":
         # 通知用戶
-        await context.bot.send_message(
-            chat_id=user_id,
-            text="❌ 很抱歉，您的驗證請求未通過審核。"
-        )
+        await reject_user(context.bot, tenant, user_id, info, query.from_user.id)
         
         # 更新管理員消息
         await query.edit_message_text(
             text=f"{query.message.text}\n\n❌ 已拒絕 - 管理員已審核"
         )
-        
-        # 從待審核列表中移除
-        if user_id in pending_users:
-            del pending_users[user_id]
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
@@ -461,10 +1240,113 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return ConversationHandler.END
 
+async def grant_access(bot, tenant, user_id: int, code: str) -> str | None:
+    # 入群申請模式下直接批准用戶的入群申請並回傳 None；
+    # 連結模式或用戶沒有待處理的申請時，從群組的連結池取得一次性邀請連結並回傳
+    if JOIN_MODE == 'request':
+        try:
+            await bot.approve_chat_join_request(chat_id=tenant.group_id, user_id=user_id)
+            audit.record('join_approved', user_id, code, group_id=tenant.group_id)
+            return None
+        except BadRequest as e:
+            # 用戶沒有提出申請、已撤回申請或已在群組中
+            logging.warning(f"Cannot approve join request of user {user_id} ({e}), sending an invite link instead")
+    
+    invite_link = await tenant.link_pool.acquire(user_id)
+    audit.record('link_issued', user_id, code, group_id=tenant.group_id, link=invite_link)
+    return invite_link
+
+async def decline_join_request(bot, tenant, user_id: int, code: str):
+    # 入群申請模式下拒絕用戶待處理的入群申請，沒有申請時忽略
+    if JOIN_MODE != 'request':
+        return
+    try:
+        await bot.decline_chat_join_request(chat_id=tenant.group_id, user_id=user_id)
+        audit.record('join_declined', user_id, code, group_id=tenant.group_id)
+    except BadRequest:
+        pass
+
+async def approve_user(bot, tenant, user_id: int, info: dict, admin_id: int):
+    invite_link = await grant_access(bot, tenant, user_id, info['invite_code'])
+    
+    # 入群申請已直接批准時不需要再通知用戶
+    if invite_link is not None:
+        # 發送邀請連結給用戶
+        await bot.send_message(
+            chat_id=user_id,
+            text=(
+                "🎉 恭喜！您的驗證請求已通過！\n\n"
+                f"🔗 這是您的群組邀請連結：\n{invite_link}\n\n"
+                "⚠️ 請注意：此連結僅能使用一次"
+            )
+        )
+    audit.record(
+        'approved', user_id, info['invite_code'], group_id=tenant.group_id, username=info['username'], admin_id=admin_id
+    )
+    funnel.inc('approved')
+
+async def reject_user(bot, tenant, user_id: int, info: dict, admin_id: int):
+    await decline_join_request(bot, tenant, user_id, info['invite_code'])
+    await bot.send_message(
+        chat_id=user_id,
+        text="❌ 很抱歉，您的驗證請求未通過審核。"
+    )
+    audit.record(
+        'rejected', user_id, info['invite_code'], group_id=tenant.group_id, username=info['username'], admin_id=admin_id
+    )
+    funnel.inc('rejected')
+
+def format_list(lines: list[str], limit: int = 30) -> str:
+    # 避免超過 Telegram 單則訊息長度限制
+    text = "\n".join(lines[:limit])
+    if len(lines) > limit:
+        text += f"\n…以及其他 {len(lines) - limit} 項"
+    return text
+
+async def bulk_review(bot, tenant, batch: list[tuple[int, dict]], review, status_message, verb: str,
+                      admin_id: int) -> tuple[list[int], list[str]]:
+    # 並行處理已移出待審核列表的用戶，定期在狀態訊息上顯示進度；
+    # 失敗的用戶放回待審核列表，並回傳給呼叫者回報給管理員
+    done = []
+    failed = []
+    semaphore = asyncio.Semaphore(APPROVE_CONCURRENCY)
+    
+    async def review_one(user_id: int, info: dict):
+        async with semaphore:
+            try:
+                await review(bot, tenant, user_id, info, admin_id)
+                done.append(user_id)
+            except Exception as e:
+                logging.error(f"Error reviewing user {user_id}: {e}")
+                await add_pending(bot, tenant, user_id, info)
+                failed.append(f"👤 @{info['username']} ({user_id}) 🎫 {info['invite_code']}：{e}")
+    
+    async def report_progress():
+        # 定期編輯同一則狀態訊息顯示進度
+        last_text = None
+        while True:
+            await asyncio.sleep(APPROVE_PROGRESS_INTERVAL)
+            text = f"⏳ 正在{verb}用戶… {len(done) + len(failed)}/{len(batch)}（失敗 {len(failed)}）"
+            if text != last_text:
+                try:
+                    await status_message.edit_text(text)
+                except Exception as e:
+                    logging.error(f"Error updating review progress: {e}")
+                last_text = text
+    
+    progress_task = asyncio.create_task(report_progress())
+    try:
+        await asyncio.gather(*(review_one(user_id, info) for user_id, info in batch))
+    finally:
+        progress_task.cancel()
+    
+    return done, failed
+
+@timed(handler_latency, 'approve_codes')
 async def approve_codes(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # 檢查是否是管理員
-    if str(update.effective_user.id) != os.getenv('ADMIN_ID'):
-        await update.message.reply_text("❌ 只有管理員可以使用此命令")
+    # 檢查是否是管理員，並取得要管理的群組
+    tenant = await admin_tenant(update, context)
+    if tenant is None:
         return
     
     # 檢查是否有提供邀請碼
@@ -475,54 +1357,30 @@ async def approve_codes(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    valid_codes = set(context.args)
-    approved_count = 0
-    not_found = []
+    codes = list(dict.fromkeys(context.args))
     
-    # 找出所有匹配邀請碼的用戶
-    for user_id, info in list(pending_users.items()):  # 使用 list() 因為我們會修改字典
-        if info['invite_code'] in valid_codes:
-            try:
-                # 生成邀請連結
-                invite_link = await context.bot.create_chat_invite_link(
-                    chat_id=os.getenv('GROUP_ID'),
-                    member_limit=1
-                )
-                
-                # 發送邀請連結給用戶
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=(
-                        "🎉 恭喜！您的驗證請求已通過！\n\n"
-                        f"🔗 這是您的群組邀請連結：\n{invite_link.invite_link}\n\n"
-                        "⚠️ 請注意：此連結僅能使用一次"
-                    )
-                )
-                
-                # 從待審核列表中移除
-                del pending_users[user_id]
-                approved_count += 1
-                
-                # 記錄到日誌
-                logging.info(f"Approved user {info['username']} (ID: {user_id}) with invite code: {info['invite_code']}")
-                
-            except Exception as e:
-                logging.error(f"Error approving user {user_id}: {e}")
-        
-    # 檢查哪些邀請碼沒有找到對應用戶
-    for code in valid_codes:
-        if not any(info['invite_code'] == code for info in pending_users.values()):
-            not_found.append(code)
+    # 透過索引找出所有匹配邀請碼的用戶，並原子地移出待審核列表，避免同時被其他審核流程處理
+    by_code = await tenant.backend.pending_by_code(codes)
+    not_found = [code for code in codes if not by_code[code]]
+    user_ids = [user_id for code in codes for user_id in by_code[code]]
+    batch = [(user_id, info) for user_id in user_ids if (info := await pop_pending(tenant, user_id)) is not None]
+    
+    status_message = await update.message.reply_text(f"⏳ 正在批准 {len(batch)} 個用戶…")
+    approved, failed = await bulk_review(
+        context.bot, tenant, batch, approve_user, status_message, "批准", update.effective_user.id
+    )
     
     # 生成結果消息
-    result_message = f"✅ 已批准 {approved_count} 個用戶\n"
+    result_message = f"✅ 已批准 {len(approved)} 個用戶\n"
+    if failed:
+        result_message += f"\n⚠️ {len(failed)} 個用戶批准失敗，已保留在待審核列表：\n" + format_list(failed, limit=20) + "\n"
     if not_found:
-        result_message += f"\n❌ 這些邀請碼沒有找到對應的待審核用戶：\n" + "\n".join(f"🎫 {code}" for code in not_found)
+        result_message += f"\n❌ 這些邀請碼沒有找到對應的待審核用戶：\n" + format_list([f"🎫 {code}" for code in not_found])
     
-    await update.message.reply_text(result_message)
+    await status_message.edit_text(result_message)
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    is_admin = str(update.effective_user.id) == os.getenv('ADMIN_ID')
+    is_admin = bool(tenants.administered_by(update.effective_user.id))
     
     help_text = (
         "📚 可用的指令列表：\n\n"
@@ -539,7 +1397,13 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "➖➖➖➖➖➖➖➖➖➖\n"
             "/pending - 查看待審核的用戶列表\n"
             "/approve_codes - 批量批准指定邀請碼的用戶\n"
-            "格式：/approve_codes code1 code2 code3\n\n"
+            "格式：/approve_codes code1 code2 code3\n"
+            "/stats - 查看運行狀態與記憶體用量\n"
+            "/audit - 查詢用戶 ID 或邀請碼的稽核紀錄\n"
+            "格式：/audit 用戶ID或邀請碼\n"
+            "/group - 查看或切換要管理的群組（管理多個群組時）\n"
+            "格式：/group 群組名稱\n"
+            "📎 上傳 TXT/CSV 檔案 - 批量匯入邀請碼（每行一個）\n\n"
             "💡 提示：\n"
             "• 在待審核列表中可以導出純邀請碼列表\n"
             "• 可以對單個用戶進行審核或拒絕\n"
@@ -548,34 +1412,329 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(help_text)
 
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # 檢查是否是管理員，並取得要管理的群組
+    tenant = await admin_tenant(update, context)
+    if tenant is None:
+        return
+    
+    link_pool = tenant.link_pool
+    lines = [
+        "📊 運行狀態\n" if len(tenants) == 1 else f"📊 運行狀態（群組 {tenant.name}，共 {len(tenants)} 個群組）\n",
+        f"🎫 可用邀請碼: {await tenant.backend.count_codes()}",
+        f"⏳ 待審核用戶: {await tenant.backend.count_pending()}",
+        f"🗄 狀態後端: {STATE_BACKEND}",
+        f"🖼 預渲染驗證碼: {len(captcha_pool)}/{captcha_pool.size}",
+        f"🧩 驗證方式: {challenge_engine.mode}，每秒開始 {challenge_engine.start_rate():.1f} 個"
+        f"（按鈕 {challenge_engine.issued['keyboard']}，重複圖片 {challenge_engine.issued['cached']}，新圖片 {challenge_engine.issued['full']}；"
+        f"圖片庫 {len(challenge_engine.images)}/{challenge_engine.images.size}）",
+        f"🚥 驗證排隊人數: {admission.queued(tenant.group_id)}/{admission.queue_limit(tenant.group_id)}（所有群組 {len(admission)}，已拒絕 {admission.dropped}）",
+        f"🔗 邀請連結池: {len(link_pool)}/{link_pool.size}（命中 {link_pool.hits}，未命中 {link_pool.misses}，追蹤中 {len(link_pool.issued)}）",
+        f"📬 待送出摘要請求: {len(tenant.digest)}",
+        f"📜 稽核紀錄: 已寫入 {audit.written}，待寫入 {len(audit)}，已丟棄 {audit.dropped}",
+        f"⏲ 排程中的到期事件: {len(expiry)}（已觸發 {expiry.fired}）",
+        f"📥 處理中的更新: {update_queue.in_flight}/{update_queue.max_in_flight}（{update_processor.active_users} 位用戶，已丟棄 {update_processor.dropped}）",
+        f"📤 發送佇列: {outbound.queue_depth}（已發送 {outbound.sent}，失敗 {outbound.failed}，重試 {outbound.retries}）",
+        f"⏱ 發送延遲: p50 {outbound.latency_percentile(0.5) * 1000:.0f} ms / p99 {outbound.latency_percentile(0.99) * 1000:.0f} ms"
+    ]
+    if tenant.code_index is not None:
+        code_index = tenant.code_index
+        lines.insert(2, f"🗂 索引邀請碼: {code_index.count - await tenant.backend.count_indexed_used(code_index)}/{code_index.count}")
+    if isinstance(backend, MemoryBackend):
+        # 只有本進程保存的狀態才能量測記憶體用量
+        buckets = sum(len(b) for b in backend.buckets.values())
+        buckets_size = sum(b.memory_footprint() for b in backend.buckets.values())
+        lines[5:5] = [
+            f"🔢 嘗試次數紀錄: {len(backend.attempts)}（約 {backend.attempts.memory_footprint() / 1024:.1f} KB）",
+            f"🚦 頻率限制紀錄: {buckets}（約 {buckets_size / 1024:.1f} KB）",
+            f"💾 待寫入變更: {backend.store.pending_writes}"
+        ]
+    
+    await update.message.reply_text("\n".join(lines))
+
+async def audit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # 檢查是否是管理員
+    administered = tenants.administered_by(update.effective_user.id)
+    if not administered:
+        await update.message.reply_text("❌ 只有管理員可以使用此命令")
+        return
+    
+    if len(context.args) != 1:
+        await update.message.reply_text(
+            "❌ 請提供要查詢的用戶 ID 或邀請碼\n"
+            "格式：/audit 用戶ID或邀請碼"
+        )
+        return
+    
+    # 純數字同時當作用戶 ID 與邀請碼查詢；多群組時只顯示該管理員所管理群組的事件
+    target = context.args[0]
+    user_id = int(target) if target.isdigit() else None
+    group_ids = None if len(tenants) == 1 else {tenant.group_id for tenant in administered}
+    events = await audit.query(user_id=user_id, code=target, group_ids=group_ids, limit=AUDIT_QUERY_LIMIT)
+    if not events:
+        await update.message.reply_text(f"📝 沒有找到 {target} 的稽核紀錄")
+        return
+    
+    lines = []
+    for event in events:
+        line = f"{datetime.fromtimestamp(event['ts']).strftime('%Y-%m-%d %H:%M:%S')} {AUDIT_EVENT_LABELS.get(event['event'], event['event'])}"
+        if event.get('user_id') is not None:
+            line += f" 👤 {event['user_id']}"
+        if event.get('code') is not None:
+            line += f" 🎫 {event['code']}"
+        if group_ids is not None and (tenant := tenants.get(event.get('group_id'))) is not None:
+            line += f" 👥 {tenant.name}"
+        if event.get('admin_id') is not None:
+            line += f"（管理員 {event['admin_id']}）"
+        lines.append(line)
+    
+    await update.message.reply_text(f"📜 {target} 的最近 {len(events)} 筆稽核紀錄（由新到舊）：\n\n" + "\n".join(lines))
+
+async def group_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # 管理多個群組的管理員以 /group 群組名稱 選擇之後管理員指令作用的群組
+    user_id = update.effective_user.id
+    administered = tenants.administered_by(user_id)
+    if not administered:
+        await update.message.reply_text("❌ 只有管理員可以使用此命令")
+        return
+    
+    if context.args:
+        tenant = tenants.named(context.args[0])
+        if tenant is None or not tenant.is_admin(user_id):
+            await update.message.reply_text(f"❌ 找不到您管理的群組 {context.args[0]}")
+            return
+        context.user_data['admin_group'] = tenant.name
+        await update.message.reply_text(f"✅ 已切換到群組 {tenant.name}（{tenant.group_id}）")
+        return
+    
+    current = administered[0].name if len(administered) == 1 else context.user_data.get('admin_group')
+    await update.message.reply_text(
+        "📋 您管理的群組：\n\n" +
+        "\n".join(f"{'👉' if tenant.name == current else '▫️'} {tenant.name}（{tenant.group_id}）" for tenant in administered) +
+        "\n\n格式：/group 群組名稱"
+    )
+
+async def handle_join_request(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # 入群申請模式：申請由 Telegram 保留，私訊申請者開始驗證，驗證通過後直接批准
+    join_request = update.chat_join_request
+    tenant = tenants.get(join_request.chat.id, join_request.chat.username)
+    if tenant is None:
+        return
+    
+    user_id = join_request.from_user.id
+    audit.record('join_requested', user_id, group_id=tenant.group_id)
+    
+    # 已在待審核列表中的用戶不需要重新驗證，審核通過時會批准這次的申請
+    if (await tenant.backend.get_pending([user_id])).get(user_id) is not None:
+        await context.bot.send_message(
+            chat_id=join_request.user_chat_id,
+            text="⏳ 您的驗證請求正在審核中，審核通過後會自動批准您的入群申請"
+        )
+        return
+    
+    # 創建開始按鈕和幫助按鈕
+    reply_markup = welcome_keyboard(tenant)
+    
+    # 申請者尚未與機器人對話時，只能透過 user_chat_id 私訊
+    await context.bot.send_message(
+        chat_id=join_request.user_chat_id,
+        text=(
+            "👋 歡迎來到驗證機器人！\n\n"
+            "🔹 已收到您的入群申請\n"
+            "🔹 請準備好您的邀請碼\n"
+            "🔹 完成驗證後會自動批准您的申請\n\n"
+            "準備好了嗎？點擊下方按鈕開始驗證！"
+        ),
+        reply_markup=reply_markup
+    )
+
+async def track_link_usage(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # 用戶透過機器人發出的連結入群後，停止追蹤該連結
+    member_update = update.chat_member
+    tenant = tenants.get(member_update.chat.id, member_update.chat.username)
+    if tenant is not None and member_update.invite_link and member_update.new_chat_member.status == 'member':
+        user_id = tenant.link_pool.mark_used(member_update.invite_link.invite_link)
+        if user_id is not None:
+            audit.record(
+                'link_used', member_update.new_chat_member.user.id, group_id=tenant.group_id,
+                link=member_update.invite_link.invite_link, issued_to=user_id
+            )
+
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    handler_errors.inc(type(context.error).__name__)
     logging.error(f"Error occurred: {context.error}")
 
-if __name__ == '__main__':
+async def post_init(application: Application):
+    # 狀態後端已在 run() 中開啟；為還原的待審核請求重新排程
+    await expiry.start()
+    await restore_conversations(application)
+    for tenant in tenants:
+        async for batch in tenant.backend.iter_pending(EXPORT_BATCH_SIZE):
+            for user_id, info in batch:
+                schedule_pending_expiry(application.bot, tenant, user_id, info)
+        if tenant.code_index_path:
+            tenant.code_index = CodeIndex(tenant.code_index_path)
+            logging.info(f"Opened invite code index {tenant.code_index_path} with {tenant.code_index.count} codes")
+    
+    await admission.start()
+    
+    # 啟動驗證碼背景補貨
+    await captcha_pool.start()
+    
+    for tenant in tenants:
+        # 啟動邀請連結池
+        await tenant.link_pool.start(application.bot)
+        
+        # 啟動管理員摘要
+        await tenant.digest.start(application.bot, partial(send_digest, tenant))
+    
+    if len(tenants) > 1:
+        logging.info(f"Managing {len(tenants)} groups: {', '.join(tenant.name for tenant in tenants)}")
+
+async def post_stop(application: Application):
+    # 在機器人關閉前送出剩餘的摘要，並撤銷未發出的庫存連結
+    for tenant in tenants:
+        await tenant.digest.stop()
+        await tenant.link_pool.stop()
+    await expiry.stop()
+
+async def post_shutdown(application: Application):
+    await captcha_pool.stop()
+    await admission.stop()
+    for tenant in tenants:
+        if tenant.code_index is not None:
+            tenant.code_index.close()
+            tenant.code_index = None
+
+def build_application(request: BaseRequest | None = None, get_updates_request: BaseRequest | None = None) -> Application:
+    # request / get_updates_request 可替換 Bot API 的傳輸層，供基準測試使用
+    global conv_handler
+    
     # Initialize application
-    application = Application.builder().token(os.getenv('BOT_TOKEN')).build()
+    builder = (
+        Application.builder()
+        .token(os.getenv('BOT_TOKEN'))
+        .base_url(BOT_API_BASE_URL + '/bot')
+        .base_file_url(BOT_API_BASE_URL + '/file/bot')
+        .rate_limiter(outbound)
+        .concurrent_updates(update_processor)
+        .update_queue(update_queue)
+    )
+    if request is not None:
+        builder = builder.request(request)
+    if get_updates_request is not None:
+        builder = builder.get_updates_request(get_updates_request)
+    application = builder.build()
     
     # 設置對話處理
     conv_handler = ConversationHandler(
-        entry_points=[CallbackQueryHandler(start_verification, pattern='^start_verify$')],
+        # 非阻塞入口：排隊等待准入時不會阻擋其他用戶的更新
+        entry_points=[CallbackQueryHandler(track_conversation(start_verification), pattern='^start_verify(:|$)', block=False)],
         states={
-            TYPING_CAPTCHA: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_captcha)],
-            TYPING_INVITE_CODE: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_invite_code)]
+            TYPING_CAPTCHA: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, track_conversation(handle_captcha)),
+                CallbackQueryHandler(track_conversation(handle_captcha), pattern='^captcha:')
+            ],
+            TYPING_INVITE_CODE: [MessageHandler(filters.TEXT & ~filters.COMMAND, track_conversation(handle_invite_code))]
         },
-        fallbacks=[CommandHandler('cancel', cancel)]
+        fallbacks=[CommandHandler('cancel', track_conversation(cancel))]
     )
     
     # Add handlers
+    if backend.shared:
+        application.add_handler(TypeHandler(Update, sync_conversation), group=-1)
     application.add_handler(CommandHandler('start', start))
     application.add_handler(CommandHandler('help', help_command))
     application.add_handler(CommandHandler('pending', list_pending))
     application.add_handler(CommandHandler('add_codes', add_codes))
     application.add_handler(CommandHandler('list_codes', list_codes))
     application.add_handler(CommandHandler('approve_codes', approve_codes))
+    application.add_handler(MessageHandler(filters.ChatType.PRIVATE & filters.Document.ALL, import_codes))
+    application.add_handler(CommandHandler('stats', stats))
+    application.add_handler(CommandHandler('audit', audit_command))
+    application.add_handler(CommandHandler('group', group_command))
     application.add_handler(conv_handler)
+    application.add_handler(CallbackQueryHandler(page_callback, pattern='^page:'))
+    application.add_handler(CallbackQueryHandler(export_callback, pattern='^export:'))
+    application.add_handler(CallbackQueryHandler(digest_callback, pattern='^digest:'))
     application.add_handler(CallbackQueryHandler(button_callback))
+    application.add_handler(ChatMemberHandler(track_link_usage, ChatMemberHandler.CHAT_MEMBER))
+    if JOIN_MODE == 'request':
+        application.add_handler(ChatJoinRequestHandler(handle_join_request))
     application.add_error_handler(error_handler)
     
+    return application
+
+async def run(application: Application, stop_event: asyncio.Event | None = None):
+    # 依設定以 webhook 或長輪詢接收更新，收到 SIGINT/SIGTERM 或 stop_event 時依序關閉
+    if stop_event is None:
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:
+                pass
+    
+    webhook_server = None
+    metrics_server = None
+    await backend.open()
+    for tenant_backend in tenant_backends():
+        await tenant_backend.open()
+    await audit.open()
+    await application.initialize()
+    try:
+        await post_init(application)
+        
+        if METRICS_PORT:
+            metrics_server = MetricsServer(metrics, listen=METRICS_LISTEN, port=METRICS_PORT)
+            await metrics_server.start()
+        
+        if WEBHOOK_URL:
+            webhook_server = WebhookServer(
+                application,
+                url_path=WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                max_connections=WEBHOOK_MAX_CONNECTIONS
+            )
+            await webhook_server.start()
+            await application.bot.set_webhook(
+                url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH.strip('/')}",
+                secret_token=WEBHOOK_SECRET,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=Update.ALL_TYPES
+            )
+        else:
+            # 長輪詢：start_polling 會先刪除殘留的 webhook
+            await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        
+        await application.start()
+        logging.info(f"Bot started in {'webhook' if webhook_server else 'polling'} mode")
+        await stop_event.wait()
+    finally:
+        # 先停止接收新的更新，再讓已接收的更新處理完畢
+        if webhook_server is not None:
+            await webhook_server.stop()
+        if application.updater.running:
+            await application.updater.stop()
+        if application.running:
+            await application.stop()
+        await post_stop(application)
+        await application.shutdown()
+        await post_shutdown(application)
+        # 各群組的後端共用 backend 的連線或寫入執行緒，先於 backend 關閉
+        for tenant_backend in tenant_backends():
+            await tenant_backend.close()
+        await backend.close()
+        await audit.close()
+        if metrics_server is not None:
+            await metrics_server.stop()
+
+if __name__ == '__main__':
+    application = build_application()
+    
     # Run the bot
     print("Starting bot...")
-    application.run_polling() 
\ No newline at end of file
+    asyncio.run(run(application))
@@ -0,0 +1,169 @@
+import logging
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter
+
+from http_server import HTTPServer
+
+# 預設的延遲分桶（秒），涵蓋本機處理到 Telegram API 逾時
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    # 只增不減的計數器，依標籤值分別計數
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    # 固定分桶的直方圖：每次觀測只在對應的分桶加一（O(log 分桶數)），輸出時才累加成 Prometheus 的累積分桶
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # 標籤值 -> [各分桶計數（最後一格為 +Inf）, 總和]
+        self._values = {}
+
+    def observe(self, value: float, *labels):
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float('inf')), counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    # 在抓取時才讀取的量測值：collect_values() 回傳 {標籤值 tuple: 數值}，
+    # 不需要在每次狀態改變時更新
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...], collect_values):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.collect_values = collect_values
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.collect_values()
+        except Exception as e:
+            logging.error(f"Error collecting {self.name}: {e}")
+            return lines
+        for labels, value in values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple[str, ...], collect_values) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, collect_values))
+
+    def render(self) -> str:
+        # Prometheus 文字格式 0.0.4
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+def timed(histogram: Histogram, *labels):
+    # 以直方圖記錄協程函數的執行時間，拋出例外時同樣記錄
+    def decorator(callback):
+        @wraps(callback)
+        async def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return await callback(*args, **kwargs)
+            finally:
+                histogram.observe(perf_counter() - start, *labels)
+        return wrapper
+    return decorator
+
+
+class MetricsServer:
+    # 以 HTTP 提供 /metrics 給 Prometheus 抓取；預設只監聽本機
+
+    def __init__(self, registry: MetricsRegistry, listen: str = '127.0.0.1', port: int = 9090):
+        self.registry = registry
+        self.http = HTTPServer(self._handle, listen=listen, port=port, max_connections=10, max_body_size=0)
+
+    @property
+    def port(self) -> int:
+        return self.http.port
+
+    async def start(self):
+        await self.http.start()
+        logging.info(f"Metrics server listening on {self.http.listen}:{self.http.port}/metrics")
+
+    async def stop(self):
+        await self.http.stop(timeout=1)
+
+    async def _handle(self, request):
+        if request.path != '/metrics':
+            return 404, 'text/plain', b''
+        if request.method != 'GET':
+            return 405, 'text/plain', b''
+        return 200, 'text/plain; version=0.0.4; charset=utf-8', self.registry.render().encode()
@@ -0,0 +1,281 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from collections import deque
+from datetime import timedelta
+from time import perf_counter, time
+
+import httpx
+from telegram.error import BadRequest, NetworkError, RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from ratelimit import TokenBucket
+from ttl_store import TTLStore
+
+# 發送優先順序：數字越小越優先
+PRIORITY_USER = 0
+PRIORITY_ADMIN = 1
+PRIORITY_BACKGROUND = 2
+
+# 需要排隊並計入發送限制的 API（發送、編輯訊息與邀請連結相關操作）
+_QUEUED_PREFIXES = ('send', 'edit', 'copy', 'forward')
+_QUEUED_ENDPOINTS = {
+    'createChatInviteLink',
+    'revokeChatInviteLink',
+    'approveChatJoinRequest',
+    'declineChatJoinRequest',
+}
+
+# 非冪等的 API：逾時或連線中斷時 Telegram 可能已經處理了請求，重試會重複發送訊息或建立多餘的邀請連結，
+# 因此只在確定請求還沒送出時重試
+_NON_IDEMPOTENT_PREFIXES = ('send', 'copy', 'forward')
+_NON_IDEMPOTENT_ENDPOINTS = {
+    'createChatInviteLink',
+    'approveChatJoinRequest',
+    'declineChatJoinRequest',
+}
+
+
+class _OutboundRequest:
+    __slots__ = ('callback', 'args', 'kwargs', 'endpoint', 'chat_id', 'future', 'enqueued')
+
+    @property
+    def is_message(self) -> bool:
+        # 只有在聊天室中產生或修改訊息的請求才計入各聊天室的限制
+        return self.endpoint.startswith(_QUEUED_PREFIXES)
+
+    def __init__(self, callback, args, kwargs, endpoint, chat_id, future):
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.endpoint = endpoint
+        self.chat_id = chat_id
+        self.future = future
+        self.enqueued = time()
+
+
+def _seconds(value) -> float:
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+def _not_sent(error: NetworkError) -> bool:
+    # 無法建立連線或等待連線池逾時：請求還沒送到 Telegram
+    return isinstance(error.__cause__, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+
+
+def _retryable(endpoint: str, error: NetworkError) -> bool:
+    if endpoint.startswith(_NON_IDEMPOTENT_PREFIXES) or endpoint in _NON_IDEMPOTENT_ENDPOINTS:
+        return _not_sent(error)
+    return True
+
+
+class OutboundQueue(BaseRateLimiter):
+    # 所有 Bot API 呼叫的集中出口：依優先順序排隊，遵守全域與各聊天室的發送限制，
+    # 收到 RetryAfter 時暫停整個佇列並自動重試，網路錯誤以指數退避重試
+    # （發送訊息、建立邀請連結等非冪等的請求只在確定尚未送出時重試）
+
+    def __init__(self, admin_chat_ids=(), global_rate: float = 30, private_rate: float = 1,
+                 private_burst: int = 3, group_rate: float = 20 / 60, group_burst: int = 20,
+                 max_retries: int = 5, max_in_flight: int = 32):
+        self.admin_chat_ids = {str(chat_id) for chat_id in admin_chat_ids}
+        self.global_rate = global_rate
+        self.private_rate = private_rate
+        self.private_burst = private_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+        self.max_in_flight = max_in_flight
+
+        self._global = TokenBucket(global_rate)
+        self._private_buckets = TTLStore(private_burst / private_rate, lambda: TokenBucket(private_burst))
+        self._group_buckets = TTLStore(group_burst / group_rate, lambda: TokenBucket(group_burst))
+
+        self._heap = []
+        self._seq = itertools.count()
+        # 因聊天室限制延後排入的請求：序號 -> (call_later 的 handle, 請求)
+        self._deferred = {}
+        self._paused_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._slots = None
+        self._in_flight = set()
+        self._task = None
+
+        # 統計
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self._latencies = deque(maxlen=1000)
+        # on_api_call(endpoint, duration, error) 在每次實際呼叫 Bot API 後執行（包含每次重試），
+        # error 為例外或 None，用於記錄各 API 的延遲與錯誤
+        self.on_api_call = None
+
+    async def initialize(self):
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._task = asyncio.create_task(self._dispatcher())
+        await self._private_buckets.start()
+        await self._group_buckets.start()
+
+    async def shutdown(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        await self._private_buckets.stop()
+        await self._group_buckets.stop()
+
+        # 關閉時仍在排隊或延後排入的請求直接取消
+        for handle, _ in self._deferred.values():
+            handle.cancel()
+        requests = [request for _, _, request in self._heap] + [request for _, request in self._deferred.values()]
+        for request in requests:
+            if not request.future.done():
+                request.future.cancel()
+        self._heap.clear()
+        self._deferred.clear()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint == 'getUpdates':
+            # 長輪詢由 PTB 的 Updater 自行重試，等待時間也不是 API 延遲，不重試也不計入指標
+            return await callback(*args, **kwargs)
+        if not (endpoint.startswith(_QUEUED_PREFIXES) or endpoint in _QUEUED_ENDPOINTS):
+            # 查詢類或需要立即回應的請求（例如 answerCallbackQuery）不排隊
+            return await self._call(endpoint, callback, args, kwargs)
+
+        chat_id = data.get('chat_id')
+        chat_id = str(chat_id) if chat_id is not None else None
+
+        priority = (rate_limit_args or {}).get('priority')
+        if priority is None:
+            priority = PRIORITY_ADMIN if chat_id in self.admin_chat_ids else PRIORITY_USER
+
+        future = asyncio.get_running_loop().create_future()
+        request = _OutboundRequest(callback, args, kwargs, endpoint, chat_id, future)
+        self._push(priority, next(self._seq), request)
+
+        start = time()
+        try:
+            return await future
+        finally:
+            self._latencies.append(time() - start)
+
+    def _push(self, priority: int, seq: int, request: _OutboundRequest):
+        heapq.heappush(self._heap, (priority, seq, request))
+        self._wakeup.set()
+
+    def _requeue(self, priority: int, seq: int, request: _OutboundRequest):
+        del self._deferred[seq]
+        self._push(priority, seq, request)
+
+    def _chat_bucket(self, chat_id: str) -> tuple[TokenBucket, float, int]:
+        # 群組與頻道的 chat_id 為負數或 @username
+        if chat_id.startswith(('-', '@')):
+            return self._group_buckets.touch(chat_id), self.group_rate, self.group_burst
+        return self._private_buckets.touch(chat_id), self.private_rate, self.private_burst
+
+    async def _dispatcher(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            # 收到 RetryAfter 後整個佇列暫停
+            pause = self._paused_until - time()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+
+            delay = self._global.wait_time(self.global_rate, self.global_rate)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            priority, seq, request = heapq.heappop(self._heap)
+            if request.future.done():
+                continue
+
+            if request.chat_id is not None and request.is_message:
+                bucket, rate, burst = self._chat_bucket(request.chat_id)
+                wait = bucket.wait_time(rate, burst)
+                if wait > 0:
+                    # 該聊天室暫時不能發送，延後重新排入，不阻擋其他聊天室
+                    handle = loop.call_later(wait, self._requeue, priority, seq, request)
+                    self._deferred[seq] = (handle, request)
+                    continue
+                bucket.take(rate, burst)
+
+            self._global.take(self.global_rate, self.global_rate)
+
+            await self._slots.acquire()
+            task = asyncio.create_task(self._send(request))
+            self._in_flight.add(task)
+            task.add_done_callback(self._send_done)
+
+    def _send_done(self, task: asyncio.Task):
+        self._in_flight.discard(task)
+        self._slots.release()
+
+    async def _send(self, request: _OutboundRequest):
+        try:
+            result = await self._call(request.endpoint, request.callback, request.args, request.kwargs)
+        except Exception as e:
+            self.failed += 1
+            if not request.future.done():
+                request.future.set_exception(e)
+            return
+
+        self.sent += 1
+        if not request.future.done():
+            request.future.set_result(result)
+
+    async def _timed_call(self, endpoint: str, callback, args, kwargs):
+        if self.on_api_call is None:
+            return await callback(*args, **kwargs)
+        start = perf_counter()
+        try:
+            result = await callback(*args, **kwargs)
+        except Exception as e:
+            self.on_api_call(endpoint, perf_counter() - start, e)
+            raise
+        self.on_api_call(endpoint, perf_counter() - start, None)
+        return result
+
+    async def _call(self, endpoint: str, callback, args, kwargs):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self._timed_call(endpoint, callback, args, kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = _seconds(e.retry_after)
+                self.retries += 1
+                self._paused_until = max(self._paused_until, time() + delay)
+                logging.warning(f"Flood control exceeded, pausing outbound queue for {delay:.0f}s")
+                await asyncio.sleep(delay)
+            except BadRequest:
+                # 請求本身有誤，重試無意義
+                raise
+            except NetworkError as e:
+                if attempt == self.max_retries or not _retryable(endpoint, e):
+                    raise
+                delay = min(0.5 * 2 ** attempt, 30)
+                self.retries += 1
+                logging.warning(f"Network error while calling Bot API ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._heap) + len(self._deferred)
+
+    def latency_percentile(self, percentile: float) -> float:
+        if not self._latencies:
+            return 0.0
+        latencies = sorted(self._latencies)
+        return latencies[min(int(len(latencies) * percentile), len(latencies) - 1)]
@@ -0,0 +1,190 @@
+import asyncio
+import logging
+from collections import deque
+from time import time
+
+
+class TokenBucket:
+    __slots__ = ('expires', 'tokens', 'updated')
+
+    def __init__(self, capacity: float):
+        self.expires = 0.0
+        self.tokens = capacity
+        self.updated = time()
+
+    def _refill(self, rate: float, capacity: float, now: float):
+        if now > self.updated:
+            self.tokens = min(capacity, self.tokens + (now - self.updated) * rate)
+            self.updated = now
+
+    def take(self, rate: float, capacity: float, now: float | None = None) -> bool:
+        now = time() if now is None else now
+        self._refill(rate, capacity, now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self, rate: float, capacity: float, now: float | None = None) -> float:
+        # 距離下一個令牌可用的秒數
+        now = time() if now is None else now
+        self._refill(rate, capacity, now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / rate
+
+
+class _Lane:
+    # 單一群組的等待佇列與可選的速率限制（rate 為 0 表示只受全域限制）
+    __slots__ = ('waiters', 'bucket', 'rate', 'burst', 'queue_size', 'active')
+
+    def __init__(self, rate: float, burst: int, queue_size: int):
+        self.waiters = deque()
+        self.bucket = TokenBucket(burst)
+        self.rate = rate
+        self.burst = burst
+        self.queue_size = queue_size
+        self.active = False
+
+    def wait_time(self, now: float) -> float:
+        return self.bucket.wait_time(self.rate, self.burst, now) if self.rate else 0.0
+
+    def take(self, now: float):
+        if self.rate:
+            self.bucket.take(self.rate, self.burst, now)
+
+
+class AdmissionController:
+    # 全域准入控制：以一個全域令牌桶限制每秒開始驗證的總數（每位用戶的限制由狀態後端處理），
+    # 各群組可另外設定自己的速率上限。令牌用盡時請求進入所屬群組的有界等待佇列，
+    # 背景任務在有人排隊的群組之間輪流（round-robin）放行，單一群組湧入大量請求時只會排在自己的佇列中，
+    # 其他群組仍能分到相同比例的名額；佇列滿時直接拒絕
+
+    def __init__(self, global_rate: float, global_burst: int, queue_size: int):
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.queue_size = queue_size
+
+        self.global_bucket = TokenBucket(global_burst)
+
+        # 群組鍵 -> _Lane；未設定的群組使用只受全域限制的預設佇列
+        self._lanes = {}
+        # 有人排隊的群組，依輪流順序排列
+        self._active = deque()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        # 目前所有群組的排隊人數
+        return sum(len(self._lanes[key].waiters) for key in self._active)
+
+    def configure(self, key, rate: float = 0.0, burst: int = 0, queue_size: int | None = None):
+        self._lanes[key] = _Lane(rate, max(burst, 1), self.queue_size if queue_size is None else queue_size)
+
+    def _lane(self, key) -> _Lane:
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = _Lane(0.0, 1, self.queue_size)
+        return lane
+
+    def queued(self, key=None) -> int:
+        # 指定群組目前的排隊人數
+        lane = self._lanes.get(key)
+        return len(lane.waiters) if lane is not None else 0
+
+    def queue_limit(self, key=None) -> int:
+        return self._lane(key).queue_size
+
+    def try_acquire(self, key=None) -> bool:
+        # 已有人排隊時不插隊，由輪流放行決定順序
+        if self._active:
+            return False
+        lane = self._lane(key)
+        now = time()
+        if lane.wait_time(now) > 0:
+            return False
+        if not self.global_bucket.take(self.global_rate, self.global_burst, now):
+            return False
+        lane.take(now)
+        return True
+
+    def enqueue(self, key=None) -> asyncio.Future | None:
+        # 回傳輪到時完成的 future；所屬群組的佇列已滿時回傳 None
+        lane = self._lane(key)
+        if len(lane.waiters) >= lane.queue_size:
+            self.dropped += 1
+            return None
+
+        waiter = asyncio.get_running_loop().create_future()
+        lane.waiters.append(waiter)
+        if not lane.active:
+            lane.active = True
+            self._active.append(key)
+        self._wakeup.set()
+        return waiter
+
+    def _release_next(self) -> float:
+        # 依輪流順序放行下一個可放行群組的第一位等待者；已放行時回傳 0，否則回傳最短需要等待的秒數
+        now = time()
+        delay = float('inf')
+        for _ in range(len(self._active)):
+            key = self._active[0]
+            lane = self._lanes[key]
+            # 略過已取消的等待者（例如對話已結束）
+            while lane.waiters and lane.waiters[0].done():
+                lane.waiters.popleft()
+            if not lane.waiters:
+                self._active.popleft()
+                lane.active = False
+                continue
+
+            self._active.rotate(-1)
+            wait = lane.wait_time(now)
+            if wait > 0:
+                delay = min(delay, wait)
+                continue
+
+            self.global_bucket.take(self.global_rate, self.global_burst, now)
+            lane.take(now)
+            lane.waiters.popleft().set_result(None)
+            return 0.0
+        return delay
+
+    async def _dispatcher(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+            while self._active:
+                delay = self.global_bucket.wait_time(self.global_rate, self.global_burst)
+                if delay == 0:
+                    delay = self._release_next()
+                if delay == float('inf'):
+                    break
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+    async def start(self):
+        self._task = asyncio.create_task(self._dispatcher())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        # 通知所有仍在排隊的請求
+        while self._active:
+            lane = self._lanes[self._active.popleft()]
+            lane.active = False
+            while lane.waiters:
+                waiter = lane.waiters.popleft()
+                if not waiter.done():
+                    waiter.cancel()
+
+        if self.dropped:
+            logging.info(f"Admission queue dropped {self.dropped} verification requests")
@@ -0,0 +1,576 @@
+import json
+import os
+from abc import ABC, abstractmethod
+from collections.abc import AsyncIterator
+from itertools import islice
+from time import time
+
+from ratelimit import TokenBucket
+from ttl_store import AttemptRecord, TTLStore
+
+try:
+    import redis.asyncio as redis
+except ImportError:
+    redis = None
+
+
+class StateBackend(ABC):
+    # 機器人所有共享狀態的存取介面：邀請碼、待審核用戶、驗證碼、嘗試次數、令牌桶與對話狀態。
+    # 所有方法都是協程；取用類操作（consume_code、pop_pending、pop_captcha）必須是原子操作，
+    # 同一個請求在多個機器人實例之間只會被處理一次。shared 表示狀態是否由多個實例共用
+
+    shared = False
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def sizes(self) -> dict[str, int]:
+        # 本進程記憶體中各狀態結構的項目數，狀態保存在外部時為空
+        return {}
+
+    @abstractmethod
+    def for_tenant(self, name: str) -> 'StateBackend':
+        # 同一個後端中另一個群組的獨立命名空間：邀請碼與待審核用戶互不影響，共用連線或寫入執行緒。
+        # 回傳的後端需要另外開啟，並在本後端關閉前關閉
+        ...
+
+    # 邀請碼
+
+    @abstractmethod
+    async def add_codes(self, codes) -> list[str]:
+        ...
+
+    @abstractmethod
+    async def consume_code(self, code: str) -> bool:
+        ...
+
+    @abstractmethod
+    async def restore_code(self, code: str):
+        ...
+
+    @abstractmethod
+    async def count_codes(self) -> int:
+        ...
+
+    @abstractmethod
+    async def list_codes(self, offset: int, count: int) -> list[str]:
+        ...
+
+    @abstractmethod
+    def iter_codes(self, batch_size: int) -> AsyncIterator[list[str]]:
+        # 非同步產生器，每次產生一批邀請碼
+        ...
+
+    # 唯讀邀請碼索引（code_index.CodeIndex）的使用紀錄
+
+    @abstractmethod
+    async def claim_indexed_code(self, index, code: str) -> bool:
+        ...
+
+    @abstractmethod
+    async def release_indexed_code(self, index, code: str):
+        ...
+
+    @abstractmethod
+    async def count_indexed_used(self, index) -> int:
+        ...
+
+    # 待審核用戶
+
+    @abstractmethod
+    async def add_pending(self, user_id: int, info: dict):
+        ...
+
+    @abstractmethod
+    async def pop_pending(self, user_id: int) -> dict | None:
+        ...
+
+    @abstractmethod
+    async def get_pending(self, user_ids) -> dict[int, dict]:
+        ...
+
+    @abstractmethod
+    async def count_pending(self) -> int:
+        ...
+
+    @abstractmethod
+    async def list_pending(self, offset: int, count: int) -> list[tuple[int, dict]]:
+        ...
+
+    @abstractmethod
+    def iter_pending(self, batch_size: int) -> AsyncIterator[list[tuple[int, dict]]]:
+        # 非同步產生器，每次產生一批 (用戶 ID, 資料)
+        ...
+
+    @abstractmethod
+    async def pending_by_code(self, codes) -> dict[str, list[int]]:
+        ...
+
+    # 驗證碼（memory 模式）
+
+    @abstractmethod
+    async def set_captcha(self, user_id: int, code: str, ttl: int):
+        ...
+
+    @abstractmethod
+    async def pop_captcha(self, user_id: int) -> str | None:
+        ...
+
+    # 嘗試次數：回傳 (次數, 紀錄到期時間)
+
+    @abstractmethod
+    async def add_attempt(self, user_id: int) -> tuple[int, float]:
+        ...
+
+    @abstractmethod
+    async def get_attempts(self, user_id: int) -> tuple[int, float]:
+        ...
+
+    # 令牌桶頻率限制
+
+    @abstractmethod
+    async def take_token(self, key: str, rate: float, burst: int) -> bool:
+        ...
+
+    # 對話狀態：key 為 tuple，state 為可序列化成 JSON 的值，None 表示對話結束
+
+    @abstractmethod
+    async def load_conversations(self, name: str) -> dict:
+        ...
+
+    @abstractmethod
+    async def get_conversation(self, name: str, key: tuple):
+        ...
+
+    @abstractmethod
+    async def save_conversation(self, name: str, key: tuple, state):
+        ...
+
+
+class MemoryTenantBackend(StateBackend):
+    # 單一進程中一個群組的邀請碼與待審核用戶，由 StateStore 批次寫入 SQLite 持久化；
+    # 驗證碼、嘗試次數、令牌桶與對話狀態以用戶為單位，交給所屬的 MemoryBackend 處理
+
+    def __init__(self, store, shared: 'MemoryBackend'):
+        self.store = store
+        self._shared = shared
+
+    async def open(self):
+        await self.store.open()
+
+    async def close(self):
+        await self.store.close()
+
+    def sizes(self) -> dict[str, int]:
+        return {
+            'invite_codes': len(self.store.invite_codes),
+            'pending_users': len(self.store.pending_users),
+            'pending_by_code': len(self.store.pending_by_code),
+        }
+
+    def for_tenant(self, name: str) -> 'MemoryTenantBackend':
+        return self._shared.for_tenant(name)
+
+    async def add_codes(self, codes) -> list[str]:
+        return self.store.add_codes(codes)
+
+    async def consume_code(self, code: str) -> bool:
+        return self.store.consume_code(code)
+
+    async def restore_code(self, code: str):
+        self.store.restore_code(code)
+
+    async def count_codes(self) -> int:
+        return len(self.store.invite_codes)
+
+    async def list_codes(self, offset: int, count: int) -> list[str]:
+        return list(islice(self.store.invite_codes, offset, offset + count))
+
+    async def iter_codes(self, batch_size: int):
+        # 先建立快照，迭代期間的新增或兌換不會影響迭代
+        codes = list(self.store.invite_codes)
+        for i in range(0, len(codes), batch_size):
+            yield codes[i:i + batch_size]
+
+    async def claim_indexed_code(self, index, code: str) -> bool:
+        return index.consume(code)
+
+    async def release_indexed_code(self, index, code: str):
+        index.restore(code)
+
+    async def count_indexed_used(self, index) -> int:
+        return index.used
+
+    async def add_pending(self, user_id: int, info: dict):
+        self.store.add_pending(user_id, info)
+
+    async def pop_pending(self, user_id: int) -> dict | None:
+        return self.store.pop_pending(user_id)
+
+    async def get_pending(self, user_ids) -> dict[int, dict]:
+        pending = self.store.pending_users
+        return {user_id: pending[user_id] for user_id in user_ids if user_id in pending}
+
+    async def count_pending(self) -> int:
+        return len(self.store.pending_users)
+
+    async def list_pending(self, offset: int, count: int) -> list[tuple[int, dict]]:
+        return list(islice(self.store.pending_users.items(), offset, offset + count))
+
+    async def iter_pending(self, batch_size: int):
+        pending = list(self.store.pending_users.items())
+        for i in range(0, len(pending), batch_size):
+            yield pending[i:i + batch_size]
+
+    async def pending_by_code(self, codes) -> dict[str, list[int]]:
+        return {code: list(self.store.pending_by_code.get(code, ())) for code in codes}
+
+    async def set_captcha(self, user_id: int, code: str, ttl: int):
+        await self._shared.set_captcha(user_id, code, ttl)
+
+    async def pop_captcha(self, user_id: int) -> str | None:
+        return await self._shared.pop_captcha(user_id)
+
+    async def add_attempt(self, user_id: int) -> tuple[int, float]:
+        return await self._shared.add_attempt(user_id)
+
+    async def get_attempts(self, user_id: int) -> tuple[int, float]:
+        return await self._shared.get_attempts(user_id)
+
+    async def take_token(self, key: str, rate: float, burst: int) -> bool:
+        return await self._shared.take_token(key, rate, burst)
+
+    async def load_conversations(self, name: str) -> dict:
+        return await self._shared.load_conversations(name)
+
+    async def get_conversation(self, name: str, key: tuple):
+        return await self._shared.get_conversation(name, key)
+
+    async def save_conversation(self, name: str, key: tuple, state):
+        await self._shared.save_conversation(name, key, state)
+
+
+class MemoryBackend(MemoryTenantBackend):
+    # 單一進程的實作：狀態保存在本進程記憶體中，由 StateStore 批次寫入 SQLite 持久化；
+    # 驗證碼到期由時間輪處理，嘗試次數與令牌桶存放在自動過期的 TTLStore
+
+    def __init__(self, store, timers, attempt_ttl: float):
+        super().__init__(store, self)
+        self.timers = timers
+        self.captchas = {}
+        self.attempts = TTLStore(attempt_ttl, AttemptRecord, refresh_on_touch=False, on_expire=store.clear_attempts)
+        # (rate, burst) -> 令牌桶；令牌桶在補滿所需時間後即與新建的桶相同，可以直接過期移除
+        self.buckets = {}
+        # 對話名稱 -> {key: state}，啟動時從 StateStore 載入
+        self.conversations = {}
+
+    async def open(self):
+        await super().open()
+        for user_id, count, timestamp in await self.store.load_attempts(since=time() - self.attempts.ttl):
+            record = AttemptRecord()
+            record.count = count
+            record.timestamp = timestamp
+            self.attempts.put(user_id, record, timestamp + self.attempts.ttl)
+        for name, key, state in await self.store.load_conversations():
+            self._conversations(name)[tuple(json.loads(key))] = json.loads(state)
+        await self.attempts.start()
+
+    def sizes(self) -> dict[str, int]:
+        return {
+            **super().sizes(),
+            'captchas': len(self.captchas),
+            'attempts': len(self.attempts),
+            'rate_limit_buckets': sum(len(buckets) for buckets in self.buckets.values()),
+            'conversations': sum(len(conversations) for conversations in self.conversations.values()),
+        }
+
+    async def close(self):
+        for buckets in self.buckets.values():
+            await buckets.stop()
+        await self.attempts.stop()
+        await super().close()
+
+    def for_tenant(self, name: str) -> MemoryTenantBackend:
+        # 每個群組一個 SQLite 檔（例如 bot_state.<name>.db），只保存該群組的邀請碼與待審核用戶
+        root, ext = os.path.splitext(self.store.path)
+        return MemoryTenantBackend(self.store.sibling(f"{root}.{name}{ext}"), self)
+
+    async def set_captcha(self, user_id: int, code: str, ttl: int):
+        self.captchas[user_id] = code
+        self.timers.schedule(('captcha', user_id), ttl, self.captchas.pop, user_id, None)
+
+    async def pop_captcha(self, user_id: int) -> str | None:
+        self.timers.cancel(('captcha', user_id))
+        return self.captchas.pop(user_id, None)
+
+    async def add_attempt(self, user_id: int) -> tuple[int, float]:
+        record = self.attempts.touch(user_id)
+        record.count += 1
+        self.store.save_attempts(user_id, record.count, record.timestamp)
+        return record.count, record.expires
+
+    async def get_attempts(self, user_id: int) -> tuple[int, float]:
+        # 沒有紀錄或紀錄已過期表示嘗試次數已重置
+        record = self.attempts.get(user_id)
+        return (record.count, record.expires) if record is not None else (0, 0.0)
+
+    async def take_token(self, key: str, rate: float, burst: int) -> bool:
+        buckets = self.buckets.get((rate, burst))
+        if buckets is None:
+            buckets = self.buckets[(rate, burst)] = TTLStore(burst / rate, lambda: TokenBucket(burst))
+            await buckets.start()
+        return buckets.touch(key).take(rate, burst)
+
+    def _conversations(self, name: str) -> dict:
+        return self.conversations.setdefault(name, {})
+
+    async def load_conversations(self, name: str) -> dict:
+        return dict(self._conversations(name))
+
+    async def get_conversation(self, name: str, key: tuple):
+        return self._conversations(name).get(key)
+
+    async def save_conversation(self, name: str, key: tuple, state):
+        conversations = self._conversations(name)
+        if state is None:
+            if conversations.pop(key, None) is None:
+                return
+            self.store.save_conversation(name, json.dumps(list(key)), None)
+        else:
+            conversations[key] = state
+            self.store.save_conversation(name, json.dumps(list(key)), json.dumps(state))
+
+
+# KEYS: pending, pending_code, pending_order
+# ARGV: user_id, info, invite_code, score, pending_by_code 鍵前綴
+_ADD_PENDING = """
+local previous = redis.call('HGET', KEYS[2], ARGV[1])
+if previous then
+    redis.call('SREM', ARGV[5] .. previous, ARGV[1])
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[3])
+redis.call('ZADD', KEYS[3], ARGV[4], ARGV[1])
+redis.call('SADD', ARGV[5] .. ARGV[3], ARGV[1])
+return 1
+"""
+
+# KEYS: pending, pending_code, pending_order
+# ARGV: user_id, pending_by_code 鍵前綴
+_POP_PENDING = """
+local info = redis.call('HGET', KEYS[1], ARGV[1])
+if not info then
+    return false
+end
+local code = redis.call('HGET', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+redis.call('ZREM', KEYS[3], ARGV[1])
+if code then
+    redis.call('SREM', ARGV[2] .. code, ARGV[1])
+end
+return info
+"""
+
+# KEYS: attempts；ARGV: ttl（秒）
+_ADD_ATTEMPT = """
+local count = redis.call('INCR', KEYS[1])
+if count == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return {count, redis.call('PTTL', KEYS[1])}
+"""
+
+# KEYS: bucket；ARGV: rate, burst, now
+_TAKE_TOKEN = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+if now > updated then
+    tokens = math.min(burst, tokens + (now - updated) * rate)
+    updated = now
+end
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(updated))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate))
+return allowed
+"""
+
+
+class RedisBackend(StateBackend):
+    # Redis 協定的實作，多個機器人實例共用同一份狀態：
+    # 取用類操作以單一指令（ZREM、GETDEL、SADD）或 Lua 腳本完成，在伺服器端是原子操作；
+    # 令牌桶同樣以 Lua 腳本在伺服器端計算，所有實例共用同一個限制
+
+    shared = True
+
+    def __init__(self, url: str = 'redis://localhost:6379/0', prefix: str = 'tgverify:', attempt_ttl: float = 3600,
+                 max_connections: int = 50, client=None):
+        if client is None:
+            if redis is None:
+                raise RuntimeError("STATE_BACKEND=redis requires the redis package (pip install redis)")
+            # 連線用盡時等待而不是拋出錯誤，並行處理的更新數可以大於連線數
+            pool = redis.BlockingConnectionPool.from_url(url, max_connections=max_connections, decode_responses=True)
+            client = redis.Redis(connection_pool=pool)
+            self._owns_client = True
+        else:
+            self._owns_client = False
+        self.redis = client
+        self.prefix = prefix
+        self.attempt_ttl = int(attempt_ttl)
+
+        self._codes = prefix + 'codes'
+        self._index_used = prefix + 'index_used'
+        self._pending = prefix + 'pending'
+        self._pending_code = prefix + 'pending_code'
+        self._pending_order = prefix + 'pending_order'
+        self._pending_by_code = prefix + 'pending_by_code:'
+
+        self._add_pending = client.register_script(_ADD_PENDING)
+        self._pop_pending = client.register_script(_POP_PENDING)
+        self._add_attempt = client.register_script(_ADD_ATTEMPT)
+        self._take_token = client.register_script(_TAKE_TOKEN)
+
+    async def open(self):
+        await self.redis.ping()
+
+    async def close(self):
+        # 傳入的連線由建立者負責關閉
+        if self._owns_client:
+            await self.redis.aclose()
+
+    def for_tenant(self, name: str) -> 'RedisBackend':
+        # 共用同一個連線池，以鍵前綴區分群組
+        return RedisBackend(prefix=f"{self.prefix}{name}:", attempt_ttl=self.attempt_ttl, client=self.redis)
+
+    async def add_codes(self, codes) -> list[str]:
+        codes = list(codes)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for code in codes:
+                pipe.zadd(self._codes, {code: 0}, nx=True)
+            results = await pipe.execute()
+        return [code for code, added in zip(codes, results) if added]
+
+    async def consume_code(self, code: str) -> bool:
+        return await self.redis.zrem(self._codes, code) == 1
+
+    async def restore_code(self, code: str):
+        await self.redis.zadd(self._codes, {code: 0}, nx=True)
+
+    async def count_codes(self) -> int:
+        return await self.redis.zcard(self._codes)
+
+    async def list_codes(self, offset: int, count: int) -> list[str]:
+        return await self.redis.zrange(self._codes, offset, offset + count - 1)
+
+    async def iter_codes(self, batch_size: int):
+        batch = []
+        async for code, _ in self.redis.zscan_iter(self._codes, count=batch_size):
+            batch.append(code)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    async def claim_indexed_code(self, index, code: str) -> bool:
+        # 索引檔在每個實例上各有一份，已使用紀錄改存在 Redis
+        return index.knows(code) and await self.redis.sadd(self._index_used, code) == 1
+
+    async def release_indexed_code(self, index, code: str):
+        await self.redis.srem(self._index_used, code)
+
+    async def count_indexed_used(self, index) -> int:
+        return await self.redis.scard(self._index_used)
+
+    async def add_pending(self, user_id: int, info: dict):
+        await self._add_pending(
+            keys=[self._pending, self._pending_code, self._pending_order],
+            args=[user_id, json.dumps(info, ensure_ascii=False), info['invite_code'], time(), self._pending_by_code]
+        )
+
+    async def pop_pending(self, user_id: int) -> dict | None:
+        info = await self._pop_pending(
+            keys=[self._pending, self._pending_code, self._pending_order],
+            args=[user_id, self._pending_by_code]
+        )
+        return json.loads(info) if info else None
+
+    async def get_pending(self, user_ids) -> dict[int, dict]:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        values = await self.redis.hmget(self._pending, user_ids)
+        return {user_id: json.loads(info) for user_id, info in zip(user_ids, values) if info}
+
+    async def count_pending(self) -> int:
+        return await self.redis.zcard(self._pending_order)
+
+    async def list_pending(self, offset: int, count: int) -> list[tuple[int, dict]]:
+        user_ids = [int(user_id) for user_id in await self.redis.zrange(self._pending_order, offset, offset + count - 1)]
+        pending = await self.get_pending(user_ids)
+        return [(user_id, pending[user_id]) for user_id in user_ids if user_id in pending]
+
+    async def iter_pending(self, batch_size: int):
+        batch = []
+        async for user_id, info in self.redis.hscan_iter(self._pending, count=batch_size):
+            batch.append((int(user_id), json.loads(info)))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    async def pending_by_code(self, codes) -> dict[str, list[int]]:
+        codes = list(codes)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for code in codes:
+                pipe.smembers(self._pending_by_code + code)
+            results = await pipe.execute()
+        return {code: [int(user_id) for user_id in user_ids] for code, user_ids in zip(codes, results)}
+
+    async def set_captcha(self, user_id: int, code: str, ttl: int):
+        await self.redis.set(f"{self.prefix}captcha:{user_id}", code, ex=ttl)
+
+    async def pop_captcha(self, user_id: int) -> str | None:
+        return await self.redis.getdel(f"{self.prefix}captcha:{user_id}")
+
+    async def add_attempt(self, user_id: int) -> tuple[int, float]:
+        count, ttl_ms = await self._add_attempt(keys=[f"{self.prefix}attempts:{user_id}"], args=[self.attempt_ttl])
+        return int(count), time() + max(int(ttl_ms), 0) / 1000
+
+    async def get_attempts(self, user_id: int) -> tuple[int, float]:
+        key = f"{self.prefix}attempts:{user_id}"
+        async with self.redis.pipeline(transaction=True) as pipe:
+            count, ttl_ms = await pipe.get(key).pttl(key).execute()
+        if count is None:
+            return 0, 0.0
+        return int(count), time() + max(int(ttl_ms), 0) / 1000
+
+    async def take_token(self, key: str, rate: float, burst: int) -> bool:
+        return await self._take_token(keys=[f"{self.prefix}bucket:{key}"], args=[rate, burst, time()]) == 1
+
+    async def load_conversations(self, name: str) -> dict:
+        conversations = await self.redis.hgetall(f"{self.prefix}conversations:{name}")
+        return {tuple(json.loads(key)): json.loads(state) for key, state in conversations.items()}
+
+    async def get_conversation(self, name: str, key: tuple):
+        state = await self.redis.hget(f"{self.prefix}conversations:{name}", json.dumps(list(key)))
+        return json.loads(state) if state is not None else None
+
+    async def save_conversation(self, name: str, key: tuple, state):
+        field = json.dumps(list(key))
+        if state is None:
+            await self.redis.hdel(f"{self.prefix}conversations:{name}", field)
+        else:
+            await self.redis.hset(f"{self.prefix}conversations:{name}", field, json.dumps(state))
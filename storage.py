@@ -0,0 +1,199 @@
+import asyncio
+import json
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from write_behind import WriteBehindQueue
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS invite_codes (
+    code TEXT PRIMARY KEY
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS pending_users (
+    user_id INTEGER PRIMARY KEY,
+    info TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS user_attempts (
+    user_id INTEGER PRIMARY KEY,
+    count INTEGER NOT NULL,
+    timestamp REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state TEXT NOT NULL,
+    PRIMARY KEY (name, key)
+) WITHOUT ROWID;
+"""
+
+
+class StateStore:
+    # SQLite (WAL) 持久化狀態：記憶體中的 set/dict 為唯一真實來源，
+    # 所有寫入先進入佇列，再由背景任務在專用執行緒中批次寫入，處理器不會等待 fsync
+
+    def __init__(self, path: str, flush_interval: float = 0.05, batch_size: int = 5000, executor=None):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        self.invite_codes = set()
+        self.pending_users = {}
+        # 邀請碼 -> 待審核用戶 ID 的索引，與 pending_users 同步維護
+        self.pending_by_code = {}
+
+        self._conn = None
+        # 未指定執行緒時自行建立，關閉時一併關閉
+        self._owns_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix='state-store')
+        self._writes = WriteBehindQueue(self._write_batch, self._executor, flush_interval, batch_size, f"state to {path}")
+
+    def sibling(self, path: str) -> 'StateStore':
+        # 另一個 SQLite 檔的狀態庫，與本狀態庫共用同一個寫入執行緒；必須在本狀態庫關閉前關閉
+        return StateStore(path, self.flush_interval, self.batch_size, executor=self._executor)
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._open)
+        self._writes.start()
+        logging.info(
+            f"Loaded {len(self.invite_codes)} invite codes and {len(self.pending_users)} pending users from {self.path}"
+        )
+
+    def _open(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+
+        # 一次性讀取所有狀態到記憶體
+        self.invite_codes.update(row[0] for row in self._conn.execute('SELECT code FROM invite_codes'))
+        for user_id, info in self._conn.execute('SELECT user_id, info FROM pending_users'):
+            info = json.loads(info)
+            self.pending_users[user_id] = info
+            self.pending_by_code.setdefault(info['invite_code'], set()).add(user_id)
+
+    async def close(self):
+        # 關閉前寫入所有尚未落盤的變更
+        await self._writes.stop()
+
+        if self._conn:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._executor, self._conn.close)
+            self._conn = None
+        if self._owns_executor:
+            self._executor.shutdown(wait=True)
+
+    async def load_attempts(self, since: float) -> list[tuple[int, int, float]]:
+        # 只在啟動時呼叫，略過已過期的紀錄；與 _open 相同在寫入執行緒中讀取，不阻塞事件循環，
+        # 也不會與背景寫入同時使用同一個連線
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._load_attempts, since)
+
+    def _load_attempts(self, since: float) -> list[tuple[int, int, float]]:
+        return self._conn.execute(
+            'SELECT user_id, count, timestamp FROM user_attempts WHERE timestamp >= ? ORDER BY timestamp', (since,)
+        ).fetchall()
+
+    async def load_conversations(self) -> list[tuple[str, str, str]]:
+        # 只在啟動時呼叫，一次讀取所有對話的 (名稱, 鍵, 狀態)，鍵與狀態皆為 JSON
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._load_conversations)
+
+    def _load_conversations(self) -> list[tuple[str, str, str]]:
+        return self._conn.execute('SELECT name, key, state FROM conversations').fetchall()
+
+    # 邀請碼
+
+    def add_codes(self, codes) -> list[str]:
+        added = []
+        for code in codes:
+            if code not in self.invite_codes:
+                self.invite_codes.add(code)
+                added.append(code)
+                self._enqueue('INSERT OR IGNORE INTO invite_codes (code) VALUES (?)', (code,))
+        return added
+
+    def consume_code(self, code: str) -> bool:
+        # 檢查與移除之間沒有 await，因此在事件循環中是原子操作
+        if code not in self.invite_codes:
+            return False
+        self.invite_codes.remove(code)
+        self._enqueue('DELETE FROM invite_codes WHERE code = ?', (code,))
+        return True
+
+    def restore_code(self, code: str):
+        self.add_codes([code])
+
+    # 待審核用戶
+
+    def add_pending(self, user_id: int, info: dict):
+        previous = self.pending_users.get(user_id)
+        if previous is not None:
+            self._unindex_pending(user_id, previous)
+        self.pending_users[user_id] = info
+        self.pending_by_code.setdefault(info['invite_code'], set()).add(user_id)
+        self._enqueue(
+            'INSERT OR REPLACE INTO pending_users (user_id, info) VALUES (?, ?)',
+            (user_id, json.dumps(info, ensure_ascii=False))
+        )
+
+    def pop_pending(self, user_id: int) -> dict | None:
+        info = self.pending_users.pop(user_id, None)
+        if info is not None:
+            self._unindex_pending(user_id, info)
+            self._enqueue('DELETE FROM pending_users WHERE user_id = ?', (user_id,))
+        return info
+
+    def _unindex_pending(self, user_id: int, info: dict):
+        user_ids = self.pending_by_code.get(info['invite_code'])
+        if user_ids is not None:
+            user_ids.discard(user_id)
+            if not user_ids:
+                del self.pending_by_code[info['invite_code']]
+
+    # 嘗試次數
+
+    def save_attempts(self, user_id: int, count: int, timestamp: float):
+        self._enqueue(
+            'INSERT OR REPLACE INTO user_attempts (user_id, count, timestamp) VALUES (?, ?, ?)',
+            (user_id, count, timestamp)
+        )
+
+    def clear_attempts(self, user_id: int):
+        self._enqueue('DELETE FROM user_attempts WHERE user_id = ?', (user_id,))
+
+    # 對話狀態
+
+    def save_conversation(self, name: str, key: str, state: str | None):
+        if state is None:
+            self._enqueue('DELETE FROM conversations WHERE name = ? AND key = ?', (name, key))
+        else:
+            self._enqueue(
+                'INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)',
+                (name, key, state)
+            )
+
+    # 背景批次寫入
+
+    def _enqueue(self, sql: str, params: tuple):
+        self._writes.put((sql, params))
+
+    async def flush(self):
+        await self._writes.flush()
+
+    def _write_batch(self, batch: list[tuple[str, tuple]]):
+        with self._conn:
+            # 相鄰的相同語句合併為 executemany
+            i = 0
+            while i < len(batch):
+                sql = batch[i][0]
+                j = i
+                while j < len(batch) and batch[j][0] == sql:
+                    j += 1
+                self._conn.executemany(sql, [params for _, params in batch[i:j]])
+                i = j
+
+    @property
+    def pending_writes(self) -> int:
+        return len(self._writes)
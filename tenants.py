@@ -0,0 +1,132 @@
+import json
+import re
+
+# 群組名稱會用在深層連結（t.me/<bot>?start=<name>）、狀態檔名與 Redis 鍵前綴中
+_NAME_RE = re.compile(r'^[A-Za-z0-9_-]{1,32}$')
+
+
+def parse_chat_id(value) -> int | str:
+    # 群組 ID 可以是數字 ID 或公開群組的 @username
+    value = str(value).strip()
+    if value.startswith('@') and len(value) > 1:
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"Invalid group ID {value!r}: use the numeric chat ID or the group's @username") from None
+
+
+def _group_key(group_id):
+    # @username 不分大小寫
+    return group_id.lower() if isinstance(group_id, str) else group_id
+
+
+class Tenant:
+    # 一個由機器人管理的群組：設定在啟動時載入，執行期的狀態（狀態後端命名空間、邀請連結池、
+    # 管理員摘要、邀請碼索引）由 main.py 建立後掛在同一個物件上
+    __slots__ = (
+        'name', 'group_id', 'admin_ids', 'review_chat_id', 'verify_rate', 'verify_burst', 'verify_queue_size',
+        'invite_link_pool_size', 'code_index_path',
+        'backend', 'link_pool', 'digest', 'code_index'
+    )
+
+    def __init__(self, name: str, group_id: int | str | None, admin_ids, review_chat_id: int | None = None,
+                 verify_rate: float = 0.0, verify_burst: int = 0, verify_queue_size: int | None = None,
+                 invite_link_pool_size: int | None = None, code_index_path: str | None = None):
+        self.name = name
+        self.group_id = group_id
+        self.admin_ids = frozenset(admin_ids)
+        # 驗證請求與摘要送往的聊天室，預設為第一位管理員
+        self.review_chat_id = review_chat_id if review_chat_id is not None else next(iter(admin_ids), None)
+        # 本群組每秒可開始的驗證數（0 表示只受全域限制）與等待佇列上限（None 表示使用全域設定）
+        self.verify_rate = verify_rate
+        self.verify_burst = verify_burst
+        self.verify_queue_size = verify_queue_size
+        # None 表示使用全域設定
+        self.invite_link_pool_size = invite_link_pool_size
+        self.code_index_path = code_index_path
+
+        self.backend = None
+        self.link_pool = None
+        self.digest = None
+        self.code_index = None
+
+    def is_admin(self, user_id: int) -> bool:
+        return user_id in self.admin_ids
+
+
+class TenantRegistry:
+    # 啟動時載入一次的群組設定，依群組 ID、名稱與管理員 ID 以字典查詢
+
+    def __init__(self, tenants: list[Tenant]):
+        self.tenants = list(tenants)
+        self.by_group = {}
+        self.by_name = {}
+        # 管理員 ID -> 該管理員管理的群組
+        self.by_admin = {}
+        for tenant in self.tenants:
+            if not _NAME_RE.match(tenant.name):
+                raise ValueError(f"Invalid group name {tenant.name!r}: use 1-32 letters, digits, '_' or '-'")
+            if tenant.name in self.by_name:
+                raise ValueError(f"Duplicate group name {tenant.name!r}")
+            if _group_key(tenant.group_id) in self.by_group:
+                raise ValueError(f"Duplicate group_id {tenant.group_id}")
+            self.by_name[tenant.name] = tenant
+            self.by_group[_group_key(tenant.group_id)] = tenant
+            for admin_id in tenant.admin_ids:
+                self.by_admin.setdefault(admin_id, []).append(tenant)
+
+    @classmethod
+    def single(cls, group_id: str | None, admin_id: str | None, code_index_path: str | None = None) -> 'TenantRegistry':
+        # 以 GROUP_ID / ADMIN_ID 環境變數設定的單一群組
+        return cls([Tenant(
+            'default',
+            parse_chat_id(group_id) if group_id else None,
+            [int(admin_id)] if admin_id else [],
+            code_index_path=code_index_path
+        )])
+
+    @classmethod
+    def from_file(cls, path: str) -> 'TenantRegistry':
+        # JSON 陣列，每個元素為一個群組的設定，例如：
+        # {"name": "main", "group_id": -1001234567890, "admin_ids": [111, 222], "verify_rate": 10}
+        with open(path, encoding='utf-8') as f:
+            entries = json.load(f)
+        return cls([
+            Tenant(
+                name=entry['name'],
+                group_id=parse_chat_id(entry['group_id']),
+                admin_ids=[int(admin_id) for admin_id in entry['admin_ids']],
+                review_chat_id=int(entry['review_chat_id']) if entry.get('review_chat_id') is not None else None,
+                verify_rate=float(entry.get('verify_rate', 0)),
+                verify_burst=int(entry.get('verify_burst', 0)),
+                verify_queue_size=int(entry['verify_queue_size']) if entry.get('verify_queue_size') is not None else None,
+                invite_link_pool_size=int(entry['invite_link_pool_size']) if entry.get('invite_link_pool_size') is not None else None,
+                code_index_path=entry.get('code_index')
+            )
+            for entry in entries
+        ])
+
+    def __len__(self) -> int:
+        return len(self.tenants)
+
+    def __iter__(self):
+        return iter(self.tenants)
+
+    @property
+    def default(self) -> Tenant | None:
+        # 只有一個群組時，未指定群組的操作都屬於該群組
+        return self.tenants[0] if len(self.tenants) == 1 else None
+
+    def get(self, group_id, username: str | None = None) -> Tenant | None:
+        # 更新中的群組只有數字 ID 與 username；以 @username 設定的群組改以 username 比對
+        tenant = self.by_group.get(_group_key(group_id))
+        if tenant is None and username:
+            tenant = self.by_group.get(f"@{username}".lower())
+        return tenant
+
+    def named(self, name: str) -> Tenant | None:
+        return self.by_name.get(name)
+
+    def administered_by(self, user_id: int) -> list[Tenant]:
+        return self.by_admin.get(user_id, [])
@@ -0,0 +1,147 @@
+import asyncio
+import inspect
+import logging
+import math
+from time import time
+
+
+class _Timer:
+    __slots__ = ('key', 'deadline', 'callback', 'args', 'slot')
+
+    def __init__(self, key, deadline: int, callback, args):
+        self.key = key
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.slot = None
+
+
+class TimerWheel:
+    # 分層時間輪：第 0 層每格一個 tick，上一層每格涵蓋下一層一整圈。
+    # 計時器依到期 tick 放入對應層的格子（以 key 為鍵的字典），排程與取消都是 O(1)；
+    # 每個 tick 只處理第 0 層的一格，上層的格子在下層轉完一圈時才往下重新分配。
+    # 同一個 key 只會有一個計時器，重新排程會取代舊的計時器
+
+    def __init__(self, tick: float = 1.0, wheel_bits: tuple[int, ...] = (8, 6, 6, 6)):
+        self.tick = tick
+        self._bits = wheel_bits
+        self._shifts = [sum(wheel_bits[:level]) for level in range(len(wheel_bits))]
+        self._levels = [[{} for _ in range(1 << bits)] for bits in wheel_bits]
+        self._timers = {}
+        self._current = int(time() / tick)
+        self._pending_tasks = set()
+        self._task = None
+
+        # 統計
+        self.fired = 0
+
+    def __len__(self) -> int:
+        return len(self._timers)
+
+    def __contains__(self, key) -> bool:
+        return key in self._timers
+
+    def schedule(self, key, delay: float, callback, *args):
+        # delay 秒後呼叫 callback(*args)；callback 可以是協程函數
+        self.cancel(key)
+        deadline = max(math.ceil((time() + delay) / self.tick), self._current + 1)
+        timer = _Timer(key, deadline, callback, args)
+        self._timers[key] = timer
+        self._place(timer)
+
+    def cancel(self, key) -> bool:
+        timer = self._timers.pop(key, None)
+        if timer is None:
+            return False
+        del timer.slot[key]
+        return True
+
+    def _place(self, timer: _Timer):
+        top = len(self._bits) - 1
+        for level, bits in enumerate(self._bits):
+            shift = self._shifts[level]
+            distance = (timer.deadline >> shift) - (self._current >> shift)
+            if distance < (1 << bits) or level == top:
+                # 超出最上層範圍的計時器先放在最遠的格子，轉到時再重新分配
+                index = min(distance, (1 << bits) - 1) + (self._current >> shift)
+                slot = self._levels[level][index & ((1 << bits) - 1)]
+                slot[timer.key] = timer
+                timer.slot = slot
+                return
+
+    def _cascade(self, level: int):
+        # 將上層格子中的計時器重新分配到下層
+        index = (self._current >> self._shifts[level]) & ((1 << self._bits[level]) - 1)
+        slot = self._levels[level][index]
+        if slot:
+            self._levels[level][index] = {}
+            for timer in slot.values():
+                self._place(timer)
+
+    def advance(self, now: float | None = None) -> int:
+        # 推進到目前時間，回傳觸發的計時器數量
+        target = int((time() if now is None else now) / self.tick)
+        fired = 0
+        while self._current < target:
+            self._current += 1
+
+            # 由上而下轉動，確保上層分配下來的計時器能繼續往下分配
+            for level in range(len(self._bits) - 1, 0, -1):
+                if self._current & ((1 << self._shifts[level]) - 1) == 0:
+                    self._cascade(level)
+
+            index = self._current & ((1 << self._bits[0]) - 1)
+            slot = self._levels[0][index]
+            if not slot:
+                continue
+            self._levels[0][index] = {}
+            for timer in list(slot.values()):
+                # 回呼中可能取消了同一格的其他計時器
+                if self._timers.get(timer.key) is not timer:
+                    continue
+                del self._timers[timer.key]
+                self._fire(timer)
+                fired += 1
+
+        self.fired += fired
+        return fired
+
+    def _fire(self, timer: _Timer):
+        try:
+            result = timer.callback(*timer.args)
+        except Exception as e:
+            logging.error(f"Error in timer callback for {timer.key}: {e}")
+            return
+
+        if inspect.isawaitable(result):
+            task = asyncio.ensure_future(result)
+            self._pending_tasks.add(task)
+            task.add_done_callback(self._task_done)
+
+    def _task_done(self, task: asyncio.Task):
+        self._pending_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Error in timer callback: {task.exception()}")
+
+    async def _run(self):
+        while True:
+            self.advance()
+            # 對齊到下一個 tick 的邊界
+            await asyncio.sleep(self.tick - time() % self.tick)
+
+    async def start(self):
+        self._current = max(self._current, int(time() / self.tick))
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        # 等待已觸發的回呼完成
+        if self._pending_tasks:
+            await asyncio.gather(*self._pending_tasks, return_exceptions=True)
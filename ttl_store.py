@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import sys
+from collections import OrderedDict
+from time import time
+
+
+class AttemptRecord:
+    # 錯誤嘗試次數，timestamp 為本輪計數開始的時間
+    __slots__ = ('expires', 'count', 'timestamp')
+
+    def __init__(self):
+        self.expires = 0.0
+        self.count = 0
+        self.timestamp = time()
+
+
+class TTLStore:
+    # 以 OrderedDict 依到期順序保存紀錄：同一個 store 的 TTL 固定，
+    # 新建或刷新的紀錄一律移到尾端，因此最早到期的紀錄永遠在最前面，清理時只需從頭彈出
+
+    def __init__(self, ttl: float, factory, refresh_on_touch: bool = True, on_expire=None):
+        self.ttl = ttl
+        self._factory = factory
+        self._refresh_on_touch = refresh_on_touch
+        self._on_expire = on_expire
+        self._entries = OrderedDict()
+        self._task = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key) -> bool:
+        return self.get(key) is not None
+
+    def get(self, key):
+        record = self._entries.get(key)
+        if record is not None and record.expires <= time():
+            self._expire(key)
+            return None
+        return record
+
+    def touch(self, key):
+        # 取得紀錄（不存在或已過期時建立新紀錄），並視設定刷新到期時間
+        now = time()
+        record = self._entries.get(key)
+        if record is None or record.expires <= now:
+            if record is not None:
+                self._expire(key)
+            record = self._factory()
+            record.expires = now + self.ttl
+            self._entries[key] = record
+        elif self._refresh_on_touch:
+            record.expires = now + self.ttl
+            self._entries.move_to_end(key)
+        return record
+
+    def put(self, key, record, expires: float):
+        # 用於啟動時還原紀錄，呼叫者需依到期時間遞增的順序放入
+        record.expires = expires
+        self._entries[key] = record
+        self._entries.move_to_end(key)
+
+    def pop(self, key):
+        return self._entries.pop(key, None)
+
+    def _expire(self, key):
+        del self._entries[key]
+        if self._on_expire:
+            self._on_expire(key)
+
+    def sweep(self, budget: int = 1000) -> int:
+        # 每次最多移除 budget 筆，避免長時間佔用事件循環
+        now = time()
+        removed = 0
+        while self._entries and removed < budget:
+            key, record = next(iter(self._entries.items()))
+            if record.expires > now:
+                break
+            self._expire(key)
+            removed += 1
+        return removed
+
+    async def _sweeper(self, interval: float, budget: int):
+        while True:
+            try:
+                removed = self.sweep(budget)
+            except Exception as e:
+                logging.error(f"Error sweeping expired entries: {e}")
+                removed = 0
+
+            # 還有過期紀錄時立即讓出後繼續，否則等待下一輪
+            await asyncio.sleep(0 if removed >= budget else interval)
+
+    async def start(self, interval: float = 1.0, budget: int = 1000):
+        self._task = asyncio.create_task(self._sweeper(interval, budget))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def memory_footprint(self) -> int:
+        # 估算佔用的位元組數：字典本身加上每筆紀錄（以第一筆紀錄取樣）
+        size = sys.getsizeof(self._entries)
+        if self._entries:
+            sample = next(iter(self._entries.values()))
+            record_size = sys.getsizeof(sample)
+            for attr in sample.__slots__:
+                value = getattr(sample, attr)
+                record_size += sys.getsizeof(value)
+            # 鍵為 int，每筆另外計算鍵的大小
+            size += len(self._entries) * (record_size + sys.getsizeof(next(iter(self._entries))))
+        return size
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class BoundedUpdateQueue(asyncio.Queue):
+    # 更新佇列：名額在更新處理完成（task_done）時才釋放，而不是在取出時釋放，
+    # 因此排隊中與處理中的更新總數不超過 max_in_flight；
+    # 名額用盡時長輪詢與 webhook 的 put 會等待，形成背壓，記憶體用量有上限
+
+    def __init__(self, max_in_flight: int):
+        super().__init__()
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self._slots = asyncio.Semaphore(max_in_flight)
+
+    async def put(self, item):
+        await self._slots.acquire()
+        self.in_flight += 1
+        super().put_nowait(item)
+
+    def task_done(self):
+        super().task_done()
+        self.in_flight -= 1
+        self._slots.release()
+
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    # 不同用戶的更新並行處理，同一用戶的更新依到達順序逐一處理，
+    # 對話狀態與嘗試次數等以用戶為單位的狀態不會被同一用戶的並行更新破壞。
+    # 單一用戶排隊中的更新超過 max_user_backlog 時直接丟棄，避免洗版佔滿所有並行名額
+
+    def __init__(self, max_concurrent_updates: int, max_user_backlog: int = 10):
+        super().__init__(max_concurrent_updates)
+        self.max_user_backlog = max_user_backlog
+        # 用戶 ID -> [鎖, 排隊與處理中的更新數]，沒有更新時移除
+        self._users = {}
+
+        # 統計
+        self.dropped = 0
+
+    @staticmethod
+    def _key(update: object):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine):
+        key = self._key(update)
+        if key is None:
+            await coroutine
+            return
+
+        entry = self._users.get(key)
+        if entry is None:
+            entry = self._users[key] = [asyncio.Lock(), 0]
+        elif entry[1] >= self.max_user_backlog:
+            self.dropped += 1
+            coroutine.close()
+            logging.debug(f"Dropping update {update.update_id} from {key}: too many queued updates")
+            return
+
+        entry[1] += 1
+        try:
+            # asyncio.Lock 依等待順序喚醒，同一用戶的更新依到達順序處理
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._users[key]
+
+    @property
+    def active_users(self) -> int:
+        return len(self._users)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,61 @@
+import hmac
+import json
+import logging
+
+from telegram import Update
+
+from http_server import HTTPServer
+
+
+class WebhookServer:
+    # 接收 Telegram 推送的更新並放入 Application 的更新佇列；
+    # 以 X-Telegram-Bot-Api-Secret-Token 驗證請求確實來自 Telegram
+
+    def __init__(self, application, url_path: str, secret_token: str, listen: str = '127.0.0.1', port: int = 8443,
+                 max_connections: int = 40):
+        self.application = application
+        self.url_path = '/' + url_path.strip('/')
+        self.secret_token = secret_token.encode()
+        self.max_connections = max_connections
+        # 保留少量額外連線，讓 Telegram 重新連線時不會被拒絕
+        self.http = HTTPServer(self._handle, listen=listen, port=port, max_connections=max_connections + 10)
+
+        # 統計
+        self.received = 0
+        self.unauthorized = 0
+
+    @property
+    def port(self) -> int:
+        return self.http.port
+
+    async def start(self):
+        await self.http.start()
+        logging.info(f"Webhook server listening on {self.http.listen}:{self.http.port}{self.url_path}")
+
+    async def stop(self):
+        await self.http.stop()
+
+    async def _handle(self, request):
+        if request.path != self.url_path:
+            return 404, 'text/plain', b''
+        if request.method != 'POST':
+            return 405, 'text/plain', b''
+
+        token = request.headers.get('x-telegram-bot-api-secret-token', '').encode()
+        if not hmac.compare_digest(token, self.secret_token):
+            self.unauthorized += 1
+            return 403, 'text/plain', b''
+
+        try:
+            data = json.loads(request.body)
+            if not isinstance(data, dict):
+                raise ValueError("update must be a JSON object")
+            update = Update.de_json(data, self.application.bot)
+        except Exception as e:
+            logging.error(f"Invalid webhook update: {e}")
+            return 400, 'text/plain', b''
+
+        # 放入佇列後立即回應，處理在背景進行，Telegram 不會因為處理緩慢而重送
+        self.received += 1
+        await self.application.update_queue.put(update)
+        return 200, 'text/plain', b''
@@ -0,0 +1,73 @@
+import asyncio
+import logging
+from collections import deque
+
+
+class WriteBehindQueue:
+    # 寫入後置的批次佇列：put() 只把項目放入記憶體佇列，處理器不會等待磁碟；
+    # 背景任務稍作等待以累積更多項目，再以 write_batch(batch) 在指定的執行緒中批次寫入。
+    # start() 之後才會寫入，寫入失敗時項目放回佇列並在稍後重試
+
+    def __init__(self, write_batch, executor, flush_interval: float, batch_size: int, name: str):
+        self.write_batch = write_batch
+        self.executor = executor
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        # 寫入失敗時的日誌用
+        self.name = name
+
+        self._items = deque()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._running = False
+
+    def __len__(self) -> int:
+        # 等待寫入的項目數
+        return len(self._items)
+
+    def put(self, item):
+        self._items.append(item)
+        self._wakeup.set()
+
+    def start(self):
+        self._running = True
+        self._task = asyncio.create_task(self._writer())
+
+    async def stop(self):
+        # 停止背景任務並寫入所有剩餘的項目；寫入失敗時例外交給呼叫者處理
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        try:
+            await self.flush()
+        finally:
+            self._running = False
+
+    async def _writer(self):
+        while True:
+            await self._wakeup.wait()
+            # 稍作等待以累積更多項目，合併成同一批寫入
+            await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Error writing {self.name}: {e}")
+                self._wakeup.set()
+                await asyncio.sleep(1)
+
+    async def flush(self):
+        loop = asyncio.get_running_loop()
+        while self._items and self._running:
+            batch = [self._items.popleft() for _ in range(min(len(self._items), self.batch_size))]
+            try:
+                await loop.run_in_executor(self.executor, self.write_batch, batch)
+            except Exception:
+                # 寫入失敗時放回佇列前端，保持順序
+                self._items.extendleft(reversed(batch))
+                raise